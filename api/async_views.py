@@ -0,0 +1,110 @@
+import copy
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from rest_framework.authentication import get_authorization_header
+from rest_framework.exceptions import AuthenticationFailed
+from .stats import timer
+from .authentication import CachedTokenAuthentication, token_cache
+from .tokens import is_expired, needs_refresh
+from .views import SegmentViewSet, BrandViewSet, VehicleViewSet, ProfileUserView, CreateUserView, ObtainTokenView
+
+
+# DBアクセスを含む同期処理をスレッドプールで実行する
+# DjangoはASGIで同期Viewを全リクエスト共通の1スレッド(thread_sensitive)で実行するため、
+# 読み取りはスレッドを固定せずに並行して実行し、スレッドごとの古い接続は前後で閉じる
+def database_sync_to_async(func):
+    def run(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(run, thread_sensitive=False)
+
+
+# CachedTokenAuthenticationの非同期版
+# キャッシュにあればスレッドを使わずに認証し、なければトークンの検索だけをスレッドプールで実行する
+# (Django 3.2には非同期のORMがないため)
+class AsyncTokenAuthentication(CachedTokenAuthentication):
+    async def authenticate_async(self, request):
+        with timer('auth'):
+            return await self.authenticate_header_async(request)
+
+    async def authenticate_header_async(self, request):
+        auth = get_authorization_header(request).split()
+        if len(auth) != 2 or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        try:
+            key = auth[1].decode()
+        except UnicodeError:
+            return None
+        # キャッシュにあり、期限切れでもなく有効期限の延長(DBへの書き込み)も不要であればスレッドを使わない
+        credentials = token_cache.get(key)
+        if credentials is not None and not is_expired(credentials[1]) and not needs_refresh(credentials[1]):
+            user, token = credentials
+            return copy.copy(user), token
+        try:
+            return await database_sync_to_async(self.authenticate_credentials)(key)
+        except AuthenticationFailed:
+            return None
+
+
+# 読み取り用のDRFのViewを非同期のViewにする
+# 認証は非同期で済ませ、Viewの実行とレンダリングを1回のスレッドプールの呼び出しにまとめる
+# 認証できなかった場合は同期のViewがそのまま認証してエラーを返すので、レスポンスは同期版と同じになる
+def async_read_view(view):
+    authentication = AsyncTokenAuthentication()
+    render = render_in_thread(view)
+
+    # wrapsでDRFのViewの属性(csrf_exemptなど)も引き継ぐ
+    @wraps(view)
+    async def async_view(request, *args, **kwargs):
+        credentials = await authentication.authenticate_async(request)
+        if credentials is not None:
+            # DRFのRequestはこの属性があれば認証クラスの代わりにこのユーザーを使う
+            request._force_auth_user, request._force_auth_token = credentials
+        return await render(request, *args, **kwargs)
+
+    return async_view
+
+
+# Viewの実行とレンダリングをスレッドプールで実行する非同期関数を作る
+def render_in_thread(view):
+    def render(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        if hasattr(response, 'render'):
+            with timer('render'):
+                response.render()
+        return response
+
+    return database_sync_to_async(render)
+
+
+# パスワードのハッシュ計算をするView(ユーザー登録・ログイン)を非同期のViewにする
+# 同期のViewのままでは全リクエスト共通の1スレッドでハッシュを計算し、その間は他の同期のViewも待たされるので、
+# Viewごとスレッドプールで実行する(認証はDRFのViewがそのまま行う)
+def async_offloaded_view(view):
+    render = render_in_thread(view)
+
+    @wraps(view)
+    async def async_view(request, *args, **kwargs):
+        return await render(request, *args, **kwargs)
+
+    return async_view
+
+
+# router(DefaultRouter)と同じ引数でlist/retrieveのViewを作る
+def viewset_read_views(viewset, basename):
+    return (
+        async_read_view(viewset.as_view({'get': 'list'}, basename=basename, detail=False)),
+        async_read_view(viewset.as_view({'get': 'retrieve'}, basename=basename, detail=True)),
+    )
+
+
+segment_list, segment_detail = viewset_read_views(SegmentViewSet, 'segment')
+brand_list, brand_detail = viewset_read_views(BrandViewSet, 'brand')
+vehicle_list, vehicle_detail = viewset_read_views(VehicleViewSet, 'vehicle')
+profile = async_read_view(ProfileUserView.as_view())
+create_user = async_offloaded_view(CreateUserView.as_view())
+obtain_token = async_offloaded_view(ObtainTokenView.as_view())
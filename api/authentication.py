@@ -0,0 +1,74 @@
+import copy
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from .cache import bump_version, get_version
+from .stats import timer
+from .tokens import is_expired, needs_refresh, refresh_token
+
+# トークン→ユーザーのキャッシュの有効期間(秒、0でキャッシュしない)
+TOKEN_CACHE_TTL = getattr(settings, 'API_TOKEN_CACHE_TTL', 60)
+
+
+# 認証結果をDjangoのキャッシュ(CACHES['default'])に保存する
+# キャッシュを共有するバックエンド(memcached/redisなど)であれば、トークンの削除やユーザーの無効化が
+# 他のワーカープロセスにも即時に反映される(プロセスごとのLocMemCacheでは最大ttl秒古い内容になりうる)
+# キーにはTokenモデルのキャッシュバージョンを含め、clear()はバージョンを上げて全て無効化する
+class TokenCache:
+    def __init__(self, ttl=TOKEN_CACHE_TTL):
+        self.ttl = ttl
+
+    def cache_key(self, key):
+        return 'api:token:%s:%s' % (get_version(Token), key)
+
+    def get(self, key):
+        return cache.get(self.cache_key(key))
+
+    def set(self, key, credentials):
+        if self.ttl > 0:
+            cache.set(self.cache_key(key), credentials, self.ttl)
+
+    def invalidate(self, key):
+        cache.delete(self.cache_key(key))
+
+    # ユーザーのトークンを無効化する(ユーザーの更新・無効化・削除時)
+    def invalidate_user(self, user_id):
+        keys = Token.objects.filter(user_id=user_id).values_list('key', flat=True)
+        cache.delete_many([self.cache_key(key) for key in keys])
+
+    def clear(self):
+        bump_version(Token)
+
+
+token_cache = TokenCache()
+
+
+# 毎リクエストのauthtoken_tokenとauth_userのJOINを省くため、認証結果をキャッシュするTokenAuthentication
+# トークンの削除・再発行、ユーザーの更新・削除はsignalでキャッシュから消す
+# 期限切れのトークンは認証せず、スライディング方式の場合は有効期限を延長する
+class CachedTokenAuthentication(TokenAuthentication):
+    def authenticate(self, request):
+        with timer('auth'):
+            return super().authenticate(request)
+
+    def authenticate_credentials(self, key):
+        credentials = token_cache.get(key)
+        if credentials is not None and is_expired(credentials[1]):
+            # 他のプロセスで延長されている場合があるので、DBから取得し直して確認する
+            token_cache.invalidate(key)
+            credentials = None
+        if credentials is None:
+            credentials = super().authenticate_credentials(key)
+            if is_expired(credentials[1]):
+                raise AuthenticationFailed(_('Token has expired.'))
+            token_cache.set(key, credentials)
+        user, token = credentials
+        if needs_refresh(token):
+            refresh_token(token)
+            # 延長した有効期限をキャッシュにも反映する(他のプロセスが延長し直さないように)
+            token_cache.set(key, credentials)
+        # リクエスト間でユーザーのオブジェクトを共有しないようにコピーを返す
+        return copy.copy(user), token
@@ -0,0 +1,60 @@
+import io
+import json
+from urllib.parse import urlsplit
+from django.core.handlers.wsgi import WSGIRequest
+from django.urls import Resolver404, resolve
+from rest_framework import status
+from .renderers import LosslessJSONEncoder
+
+# バッチで実行できるメソッド
+ALLOWED_METHODS = ('GET', 'POST', 'PUT', 'PATCH', 'DELETE')
+
+
+# バッチのサブリクエストのエラー(400で結果に含める)
+class SubRequestError(Exception):
+    pass
+
+
+# 元のリクエストの認証済みユーザー・ヘッダーを引き継いだサブリクエストを作る
+def build_subrequest(request, method, path, body):
+    url = urlsplit(path)
+    content = b'' if body is None else json.dumps(body, cls=LosslessJSONEncoder).encode()
+    environ = {
+        key: value for key, value in request.META.items()
+        if key.startswith('HTTP_') or key in ('SERVER_NAME', 'SERVER_PORT', 'REMOTE_ADDR', 'wsgi.url_scheme')
+    }
+    environ.update({
+        'REQUEST_METHOD': method,
+        'PATH_INFO': url.path,
+        'QUERY_STRING': url.query,
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(content)),
+        'wsgi.input': io.BytesIO(content),
+    })
+    environ.setdefault('wsgi.url_scheme', request.scheme)
+    subrequest = WSGIRequest(environ)
+    # バッチのリクエストで認証済みのユーザーをそのまま使い、サブリクエストごとの認証をしない
+    # (DRFのRequestはこの属性があれば認証クラスの代わりにこのユーザーを使う)
+    subrequest._force_auth_user = request.user
+    subrequest._force_auth_token = request.auth
+    return subrequest
+
+
+# サブリクエストを同じプロセス内でURLに対応するViewに渡し、(ステータス, データ)を返す
+# HTTPの送受信やミドルウェアを通さない
+def dispatch(request, method, path, body, excluded_views=()):
+    method = str(method).upper()
+    if method not in ALLOWED_METHODS:
+        raise SubRequestError('Method "%s" is not allowed.' % method)
+    if not isinstance(path, str) or not path.startswith('/api/'):
+        raise SubRequestError('Path must start with /api/.')
+    try:
+        match = resolve(urlsplit(path).path)
+    except Resolver404:
+        return status.HTTP_404_NOT_FOUND, {'detail': 'Not found.'}
+    if match.url_name in excluded_views:
+        raise SubRequestError('Path "%s" cannot be used in a batch.' % path)
+
+    response = match.func(build_subrequest(request, method, path, body), *match.args, **match.kwargs)
+    # DRFのResponseはレンダリング前のデータをそのまま使う(ストリーミングなどはデータなし)
+    return response.status_code, getattr(response, 'data', None)
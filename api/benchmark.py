@@ -0,0 +1,189 @@
+import json
+import re
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.request
+from django.conf import settings
+from django.db import connection
+from django.test import Client
+from django.utils import timezone
+
+# 計測するリクエスト(名前, メソッド, パス, 書き込みか)
+# パスの{segment}/{brand}/{vehicle}はデータの中のidに置き換える
+SCENARIOS = [
+    ('segment-list', 'GET', '/api/segments/', False),
+    ('brand-list', 'GET', '/api/brands/', False),
+    ('vehicle-list', 'GET', '/api/vehicles/?page_size=100', False),
+    ('vehicle-list-filtered', 'GET', '/api/vehicles/?segment={segment}&price_max=3000&ordering=-price&page_size=100',
+     False),
+    ('vehicle-detail', 'GET', '/api/vehicles/{vehicle}/', False),
+    ('profile', 'GET', '/api/profile/', False),
+    ('bootstrap', 'GET', '/api/bootstrap/?sections=profile,segments,brands', False),
+    ('vehicle-create', 'POST', '/api/vehicles/', True),
+]
+
+SERVER_TIMING_QUERIES = re.compile(r'desc="(\d+) queries"')
+
+
+# 線形補間によるパーセンタイル
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    position = (len(values) - 1) * p / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def summarize(latencies, queries, errors, elapsed):
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else None,
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3) if latencies else None,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3) if latencies else None,
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3) if latencies else None,
+        # Server-Timing(api.middleware.StatsMiddleware)から取得したクエリ数の平均
+        'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+    }
+
+
+def queries_from(server_timing):
+    match = SERVER_TIMING_QUERIES.search(server_timing or '')
+    return int(match.group(1)) if match else None
+
+
+# Djangoのテストクライアントでプロセス内のViewを呼ぶ(ネットワークを通さない)
+class InProcessTransport:
+    def __init__(self, token):
+        self.token = token
+        self.local = threading.local()
+
+    def request(self, method, path, body):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            # ALLOWED_HOSTSで許可されたホスト名でリクエストする
+            host = next((host.lstrip('.') for host in settings.ALLOWED_HOSTS if host != '*'), 'localhost')
+            client = self.local.client = Client(HTTP_AUTHORIZATION='Token ' + self.token, HTTP_HOST=host)
+        if method == 'GET':
+            response = client.get(path)
+        else:
+            response = client.generic(method, path, json.dumps(body), content_type='application/json')
+        return response.status_code, response.get('Server-Timing')
+
+    def close(self):
+        # 並列実行したスレッドのDB接続を閉じる
+        connection.close()
+
+
+# 起動済みのサーバー(runserver/gunicorn/uvicornなど)にHTTPでリクエストを送る
+class HttpTransport:
+    def __init__(self, token, base_url):
+        self.token = token
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, path, body):
+        data = None if body is None else json.dumps(body).encode()
+        request = urllib.request.Request(self.base_url + path, data=data, method=method, headers={
+            'Authorization': 'Token ' + self.token, 'Content-Type': 'application/json',
+        })
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                return response.status, response.headers.get('Server-Timing')
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers.get('Server-Timing')
+
+    def close(self):
+        pass
+
+
+# 1つのシナリオをconcurrency並列でrequests回実行して集計する
+def run_scenario(transport, method, path, body_factory, requests, concurrency, warmup):
+    for i in range(warmup):
+        transport.request(method, path, body_factory(-1 - i))
+    latencies, queries = [], []
+    errors = 0
+    lock = threading.Lock()
+
+    def work(i):
+        nonlocal errors
+        started = time.perf_counter()
+        status, server_timing = transport.request(method, path, body_factory(i))
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            if status >= 400:
+                errors += 1
+            count = queries_from(server_timing)
+            if count is not None:
+                queries.append(count)
+
+    indexes = iter(range(requests))
+
+    # 各スレッドが残りのリクエストを順に取って実行する
+    def worker():
+        try:
+            while True:
+                with lock:
+                    i = next(indexes, None)
+                if i is None:
+                    return
+                work(i)
+        finally:
+            transport.close()
+
+    started = time.perf_counter()
+    if concurrency <= 1:
+        for i in indexes:
+            work(i)
+    else:
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return summarize(latencies, queries, errors, time.perf_counter() - started)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# 全シナリオを実行し、比較できるようにJSONにまとめる
+def run(transport, ids, requests=200, concurrency=1, warmup=5, include_writes=False, only=None, meta=None):
+    results = {}
+    for name, method, path, writes in SCENARIOS:
+        if (writes and not include_writes) or (only and name not in only):
+            continue
+
+        def body_factory(i, name=name):
+            if name != 'vehicle-create':
+                return None
+            return {'vehicle_name': 'bench %d' % i, 'release_year': 2020, 'price': '1000.00',
+                    'segment': ids['segment'], 'brand': ids['brand']}
+
+        results[name] = run_scenario(transport, method, path.format(**ids), body_factory,
+                                     requests, concurrency, warmup)
+    return {
+        'meta': dict(meta or {}, commit=git_commit(), timestamp=timezone.now().isoformat(),
+                     requests=requests, concurrency=concurrency),
+        'results': results,
+    }
+
+
+# 前回の結果と比べたp95の変化率(%)
+def compare(current, previous):
+    changes = {}
+    for name, result in current['results'].items():
+        before = previous.get('results', {}).get(name)
+        if before and before.get('p95_ms') and result.get('p95_ms') is not None:
+            changes[name] = round((result['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100, 1)
+    return changes
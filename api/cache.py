@@ -0,0 +1,96 @@
+import hashlib
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+from rest_framework.response import Response
+from .routers import reading_from_replica
+
+# レスポンスキャッシュの有効期限(秒)。バージョンキーで無効化するので長めでもよい
+CACHE_TIMEOUT = getattr(settings, 'API_CACHE_TIMEOUT', 60 * 60)
+
+
+# レプリカから読んだデータは複製の遅延で古い場合があるので、プライマリから読んだデータとは別のキーにし、
+# 遅延の上限(DATABASE_REPLICA_STICKY_SECONDS)で期限切れにする
+# (新しいバージョンのキーに古い内容が入り、書き込んだクライアントにもCACHE_TIMEOUTの間返り続けるのを防ぐ)
+def read_scope():
+    if reading_from_replica():
+        return 'replica', getattr(settings, 'DATABASE_REPLICA_STICKY_SECONDS', 5)
+    return 'primary', CACHE_TIMEOUT
+
+
+def version_key(model):
+    return 'api:version:%s' % model._meta.label_lower
+
+
+# モデルごとのキャッシュバージョンを取得する
+# バージョンキーが追い出された場合に古いレスポンスを拾わないよう、初期値は現在時刻(ms)にする
+def get_version(model):
+    return cache.get_or_set(version_key(model), lambda: int(time.time() * 1000), timeout=None)
+
+
+# モデルのキャッシュバージョンを上げて、そのモデルのキャッシュ済みレスポンスを全て無効化する
+# (キャッシュ共有のバックエンドであれば他のワーカープロセスにも即時に反映される)
+def bump_version(model):
+    try:
+        cache.incr(version_key(model))
+    except ValueError:
+        # バージョンキーがまだない(または追い出された)場合
+        cache.set(version_key(model), int(time.time() * 1000), timeout=None)
+
+
+# build()で作ったデータを、作ったときのモデルのバージョンと一緒にキャッシュする
+# (bootstrapのように、Viewset以外でSegment/Brand/Vehicleの一覧を返す場合に使う)
+# depends: データに内容が含まれる関連モデル(そのバージョンも確認する)
+# キーにバージョンを含めず、バージョンが変わっていれば作り直して上書きするので、
+# 更新のたびに古い一覧(Vehicleでは全件)のコピーが期限切れまでキャッシュに残ることはない
+def get_or_build(model, name, build, depends=()):
+    versions = [get_version(m) for m in (model,) + tuple(depends)]
+    scope, timeout = read_scope()
+    key = 'api:data:%s:%s:%s' % (scope, model._meta.label_lower, name)
+    cached = cache.get(key)
+    if cached is not None and cached['versions'] == versions:
+        return cached['data']
+    data = list(build())
+    cache.set(key, {'versions': versions, 'data': data}, timeout)
+    return data
+
+
+# Viewsetのlist/retrieveのレスポンスをキャッシュするMixin
+# キャッシュキーには読み取り先(read_scope)とモデルのバージョン、URL(クエリパラメータを含む)、レスポンスの形式を使う
+# ConditionalGetMixinと併用する場合は、こちらを先に継承する
+# (キャッシュヒット時もキャッシュしたETag/Last-Modifiedで304を返す)
+class CachedResponseMixin:
+    # キャッシュと一緒に保存するレスポンスヘッダー
+    cached_headers = ('ETag', 'Last-Modified')
+
+    def get_response_cache_key(self, request, scope='primary'):
+        model = self.get_queryset().model
+        url = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+        return 'api:response:%s:%s:%s:%s:%s' % (
+            scope, model._meta.label_lower, get_version(model), request.accepted_renderer.format, url
+        )
+
+    def cached_response(self, request, handler, *args, **kwargs):
+        scope, timeout = read_scope()
+        key = self.get_response_cache_key(request, scope)
+        cached = cache.get(key)
+        if cached is not None:
+            response = Response(cached['data'], headers=cached['headers'])
+            last_modified = parse_http_date_safe(cached['headers'].get('Last-Modified', ''))
+            return get_conditional_response(
+                request, etag=cached['headers'].get('ETag'), last_modified=last_modified, response=response
+            )
+        response = handler(request, *args, **kwargs)
+        # 正常なレスポンスのみキャッシュする(404や304などはキャッシュしない)
+        if response.status_code == 200:
+            headers = {name: response[name] for name in self.cached_headers if response.has_header(name)}
+            cache.set(key, {'data': response.data, 'headers': headers}, timeout)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(request, super().retrieve, *args, **kwargs)
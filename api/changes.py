@@ -0,0 +1,103 @@
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from .models import Segment, Brand, Vehicle, Change
+from .serializers import SegmentSerializer, BrandSerializer, FastVehicleSerializer
+
+# 変更履歴を記録するモデルと、変更の内容を返すSerializer
+TRACKED_MODELS = {
+    Segment: SegmentSerializer,
+    Brand: BrandSerializer,
+    Vehicle: FastVehicleSerializer,
+}
+# 変更履歴の保持期間(日)
+RETENTION_DAYS = getattr(settings, 'CHANGE_LOG_RETENTION_DAYS', 30)
+
+
+def record_change(model, object_id, action):
+    Change.objects.create(model_name=model._meta.model_name, object_id=object_id, action=action)
+
+
+# 一括処理の変更履歴をまとめて記録する
+# idが分からないオブジェクトがある場合(bulk_createでidを返さないDBなど)はresetを記録する
+def record_bulk_changes(model, instances, action):
+    if any(instance.pk is None for instance in instances):
+        record_change(model, None, Change.ACTION_RESET)
+        return
+    Change.objects.bulk_create([
+        Change(model_name=model._meta.model_name, object_id=instance.pk, action=action)
+        for instance in instances
+    ])
+
+
+# 保持期間を過ぎた変更履歴をbatch_size件ずつ削除する(長時間のロックを避ける)
+# 最後に発行したid(ハイウォーターマーク)の行は残し、全て削除された後も古いカーソルを410にできるようにする
+def prune_changes(days=RETENTION_DAYS, batch_size=5000):
+    cutoff = timezone.now() - timedelta(days=days)
+    latest = Change.objects.order_by('-id').values_list('id', flat=True).first()
+    if latest is None:
+        return 0
+    deleted = 0
+    while True:
+        ids = list(Change.objects.filter(created_at__lt=cutoff, id__lt=latest)
+                   .order_by('id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += Change.objects.filter(id__in=ids).delete()[0]
+
+
+# 変更がされたオブジェクトの現在の内容をモデルごとに1クエリで取得する
+def load_objects(model, ids):
+    serializer = TRACKED_MODELS[model](model.objects.filter(id__in=ids), many=True)
+    return {item['id']: item for item in serializer.data}
+
+
+# カーソル(since)より後の変更を最大limit件分まとめる
+# 同じオブジェクトへの複数の変更は最後のものだけにし、create/updateには現在の内容を含める
+# 保持期間を過ぎて削除された範囲のカーソルの場合はNoneを返す(全件の再取得が必要)
+# (prune_changesは最後に発行したidの行を残すので、履歴が1件でもあれば最も古いidと比べればよい)
+# カーソルのidの順がコミットの順と一致し、idに欠番がないことを前提にするのでSQLite専用
+# (SQLiteは書き込みのトランザクションが1つずつで、ロールバックでAUTOINCREMENTの採番も戻る)
+# PostgreSQLなどでは同時に実行したトランザクションがidの順と違う順にコミットされ、
+# 後から見える小さいidの変更をクライアントが取りこぼしたり、ロールバックの欠番で誤って410になったりする
+def get_changes(since, limit):
+    oldest = Change.objects.order_by('id').values_list('id', flat=True).first()
+    if oldest is not None and since + 1 < oldest:
+        return None
+    rows = list(
+        Change.objects.filter(id__gt=since).order_by('id')
+        .values_list('id', 'model_name', 'object_id', 'action')[:limit + 1]
+    )
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    latest = {}
+    for cursor, model_name, object_id, action in rows:
+        key = (model_name, object_id)
+        # 順番を最後の変更の位置にするため、削除してから入れ直す
+        latest.pop(key, None)
+        latest[key] = action
+
+    objects = {}
+    for model in TRACKED_MODELS:
+        model_name = model._meta.model_name
+        ids = [object_id for (name, object_id), action in latest.items()
+               if name == model_name and action in (Change.ACTION_CREATE, Change.ACTION_UPDATE)]
+        if ids:
+            objects[model_name] = load_objects(model, ids)
+
+    changes = []
+    for (model_name, object_id), action in latest.items():
+        data = None
+        if action in (Change.ACTION_CREATE, Change.ACTION_UPDATE):
+            data = objects[model_name].get(object_id)
+            # 後で削除されたオブジェクト(削除は次以降のページに含まれる)
+            if data is None:
+                action = Change.ACTION_DELETE
+        changes.append({'model': model_name, 'id': object_id, 'action': action, 'data': data})
+
+    return {
+        'cursor': rows[-1][0] if rows else since,
+        'has_more': has_more,
+        'changes': changes,
+    }
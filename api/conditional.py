@@ -0,0 +1,79 @@
+import hashlib
+from django.db.models import Subquery
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+from .models import Change
+
+
+# ETag/Last-Modifiedによる条件付きGET(If-None-Match/If-Modified-Sinceに304を返す)のMixin
+# 検証子はレスポンスをシリアライズしてハッシュを取るのではなく、
+# 更新日時の最大値などインデックスから読める値から安く計算する
+class ConditionalGetMixin:
+    # 一覧の表示内容に影響する関連テーブル(Vehicleのsegment_name/brand_nameなど)
+    # 関連テーブルの最終更新日時もサブクエリで同じクエリ内で取得する
+    related_models = ()
+
+    def get_etag(self, request, *parts):
+        # 同じデータでもレンダラーが違えば別の内容になるので、形式とURLもETagに含める
+        source = ':'.join(str(part) for part in (request.build_absolute_uri(), request.accepted_renderer.format) + parts)
+        # 形式ごとにバイト列が同一とは限らないので弱いETagにする
+        return 'W/' + quote_etag(hashlib.md5(source.encode()).hexdigest())
+
+    def get_list_validators(self, request, queryset):
+        # 絞り込んだ一覧を集計すると件数に比例して遅くなる(カーソルのページでも毎回全件を集計する)ので、
+        # テーブル全体の最終更新日時をupdated_atのインデックスの先頭から読む
+        # (どこかが更新されれば全ての一覧・ページの検証子が変わる。URLもETagに含めるので一覧ごとに別の値になる)
+        latest = {model._meta.model_name: model.objects.order_by('-updated_at').values_list('updated_at', flat=True)
+                  for model in self.related_models}
+        # 削除ではupdated_atの最大値が変わらないので、変更履歴の最後の削除日時もLast-Modifiedに含める
+        # (If-Modified-Sinceだけのクライアントが削除後も304を受け取り続けないようにする)
+        latest['deleted'] = Change.objects.filter(
+            model_name=queryset.model._meta.model_name, action=Change.ACTION_DELETE,
+        ).order_by('-created_at').values_list('created_at', flat=True)
+        # 相関のないスカラーサブクエリなのでDB側で1回だけ評価され、全体で1クエリになる
+        meta = queryset.model.objects.order_by('-updated_at').values('updated_at').annotate(
+            **{name: Subquery(subquery[:1]) for name, subquery in latest.items()}
+        ).first()
+        if meta is None:
+            # テーブルが空の場合(全て削除された場合など)はサブクエリだけを個別に読む
+            meta = {'updated_at': None}
+            meta.update({name: subquery.first() for name, subquery in latest.items()})
+        timestamps = [value for value in meta.values() if value is not None]
+        last_modified = max(timestamps) if timestamps else None
+        etag = self.get_etag(request, *sorted(meta.items()))
+        return etag, last_modified
+
+    def get_object_validators(self, request, instance):
+        timestamps = [instance.updated_at] + [
+            getattr(instance, model._meta.model_name).updated_at for model in self.related_models
+        ]
+        last_modified = max(timestamps)
+        etag = self.get_etag(request, instance.pk, *timestamps)
+        return etag, last_modified
+
+    def conditional_response(self, request, etag, last_modified, handler):
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+        not_modified = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if not_modified is not None:
+            return not_modified
+        response = handler()
+        response['ETag'] = etag
+        if timestamp is not None:
+            response['Last-Modified'] = http_date(timestamp)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        etag, last_modified = self.get_list_validators(request, queryset)
+        return self.conditional_response(
+            request, etag, last_modified, lambda: super(ConditionalGetMixin, self).list(request, *args, **kwargs)
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        # 取得したオブジェクトをそのままシリアライズに使い、追加のクエリを発生させない
+        instance = self.get_object()
+        etag, last_modified = self.get_object_validators(request, instance)
+        return self.conditional_response(
+            request, etag, last_modified, lambda: Response(self.get_serializer(instance).data)
+        )
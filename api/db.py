@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from .stats import record_query
+
+
+# 接続を作ったときに、リクエストごとのクエリ数・SQLの実行時間を計測するexecute_wrapperを設定する
+# (接続し直した場合も同じDatabaseWrapperが使われるので二重に設定しない)
+@receiver(connection_created)
+def install_query_recorder(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+# SQLiteの接続を作ったときにPRAGMAを設定する
+# (journal_mode=walはDBファイルに記録されるが、他は接続ごとの設定)
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            cursor.execute('PRAGMA %s = %s' % (name, value))
+
+
+# 使い回している接続がDBの再起動などで切れていないかをリクエストの開始時に確認し、
+# 使えなければ閉じて、次のクエリで接続し直させる
+@receiver(request_started)
+def check_connections(sender, **kwargs):
+    if not getattr(settings, 'DB_HEALTH_CHECKS', False):
+        return
+    for connection in connections.all():
+        if connection.connection is not None and not connection.in_atomic_block and not connection.is_usable():
+            connection.close()
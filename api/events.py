@@ -0,0 +1,68 @@
+import asyncio
+import threading
+from django.conf import settings
+from django.db import transaction
+
+# 接続ごとのイベントキューの上限。あふれた接続にはresetを送って切断する
+QUEUE_SIZE = getattr(settings, 'SSE_QUEUE_SIZE', 100)
+
+
+# 1つのSSE接続の購読者
+# キューはイベントループ内でのみ操作し、他スレッドからはcall_soon_threadsafeで渡す
+class Subscriber:
+    def __init__(self, loop, queue_size=QUEUE_SIZE):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        # 処理が追いつかずキューがあふれた場合(バックプレッシャー)
+        self.overflowed = False
+
+    def push(self, event):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # 遅いクライアントのためにメモリを使い続けないよう、溜まったイベントを捨てて
+            # 終了の合図(None)だけを入れる
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+
+# プロセス内でイベントを全購読者に配信するブロードキャスター
+# publish()はどのスレッド(同期のViewやsignal)からでも呼べる
+class Broadcaster:
+    def __init__(self):
+        self.subscribers = set()
+        self.lock = threading.Lock()
+
+    def subscribe(self, queue_size=QUEUE_SIZE):
+        subscriber = Subscriber(asyncio.get_running_loop(), queue_size)
+        with self.lock:
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def publish(self, event):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.loop.call_soon_threadsafe(subscriber.push, event)
+            except RuntimeError:
+                # イベントループが既に終了している接続
+                self.unsubscribe(subscriber)
+
+
+broadcaster = Broadcaster()
+
+
+# コミット後に変更を配信する(ロールバックされた変更は配信しない)
+# イベント: {"model": モデル名, "action": create/update/delete/reset, "ids": [id, ...]}
+def publish_change(model, ids, action):
+    event = {'model': model._meta.model_name, 'action': action, 'ids': list(ids)}
+    transaction.on_commit(lambda: broadcaster.publish(event))
@@ -0,0 +1,46 @@
+import csv
+import itertools
+import json
+from .serializers import FastVehicleSerializer
+
+# DBから1回に取得する件数(サーバーサイドカーソルのチャンクサイズ)と、まとめて書き出す行数
+CHUNK_SIZE = 2000
+
+
+# Django公式ドキュメントのストリーミングCSVの例と同様に、
+# csv.writerの書き込み先として値をそのまま返すだけのバッファ
+class Echo:
+    def write(self, value):
+        return value
+
+
+# モデルインスタンスを作らずに.values()の辞書をチャンクごとに取得し、
+# VehicleSerializerと同じ形のデータにする
+def iter_rows(queryset):
+    serializer = FastVehicleSerializer()
+    rows = FastVehicleSerializer.values_queryset(queryset.order_by('id')).iterator(chunk_size=CHUNK_SIZE)
+    return (serializer.to_representation(row) for row in rows)
+
+
+# 複数行をまとめてyieldし、レスポンスの書き込み回数を減らす
+def batched(lines):
+    while True:
+        batch = ''.join(itertools.islice(lines, CHUNK_SIZE))
+        if not batch:
+            return
+        yield batch
+
+
+def iter_ndjson(queryset):
+    lines = (json.dumps(item, ensure_ascii=False, separators=(',', ':')) + '\n' for item in iter_rows(queryset))
+    return batched(lines)
+
+
+def iter_csv(queryset):
+    writer = csv.writer(Echo())
+    header = [name for name, lookup, accessor in FastVehicleSerializer.get_fields()]
+    lines = itertools.chain(
+        [writer.writerow(header)],
+        (writer.writerow(item.values()) for item in iter_rows(queryset)),
+    )
+    return batched(lines)
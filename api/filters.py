@@ -0,0 +1,52 @@
+from decimal import Decimal, InvalidOperation
+from rest_framework import filters
+from rest_framework.exceptions import ValidationError
+
+
+# NaN/Infinityは数値として扱わない(Decimalはこれらの文字列も受け付ける)
+def finite_decimal(value):
+    value = Decimal(value)
+    if not value.is_finite():
+        raise ValueError(value)
+    return value
+
+
+# DBの整数(64bit)の範囲外は数値として扱わない(SQLiteではOverflowErrorになり500が返る)
+def bounded_int(value):
+    value = int(value)
+    if not -2 ** 63 <= value < 2 ** 63:
+        raise ValueError(value)
+    return value
+
+
+# Vehicle一覧のサーバーサイド絞り込み
+# ?segment= ?brand= ?user= の完全一致と、
+# ?release_year_min= ?release_year_max= ?price_min= ?price_max= の範囲指定に対応する
+# (それぞれの組み合わせはVehicle.Meta.indexesの複合インデックスで検索される)
+class VehicleFilterBackend(filters.BaseFilterBackend):
+    # クエリパラメータ名 => (ORMのlookup, 値の変換関数)
+    lookups = {
+        'segment': ('segment_id', bounded_int),
+        'brand': ('brand_id', bounded_int),
+        'user': ('user_id', bounded_int),
+        'release_year_min': ('release_year__gte', bounded_int),
+        'release_year_max': ('release_year__lte', bounded_int),
+        'price_min': ('price__gte', finite_decimal),
+        'price_max': ('price__lte', finite_decimal),
+    }
+
+    def filter_queryset(self, request, queryset, view):
+        conditions = {}
+        errors = {}
+        for param, (lookup, convert) in self.lookups.items():
+            value = request.query_params.get(param)
+            if value in (None, ''):
+                continue
+            try:
+                conditions[lookup] = convert(value)
+            except (ValueError, InvalidOperation):
+                errors[param] = ['A valid number is required.']
+        # 不正な値は無視せずに400で返す
+        if errors:
+            raise ValidationError(errors)
+        return queryset.filter(**conditions)
@@ -0,0 +1,41 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+# PBKDF2の反復回数(0ならDjangoのデフォルト)
+HASH_ITERATIONS = getattr(settings, 'PASSWORD_HASH_ITERATIONS', 0)
+# パスワードのハッシュ計算を実行するスレッド数(0ならリクエストのスレッドでそのまま計算する)
+HASH_WORKERS = getattr(settings, 'PASSWORD_HASH_WORKERS', 0)
+
+executor = None
+executor_lock = threading.Lock()
+
+
+def get_executor():
+    global executor
+    with executor_lock:
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix='password-hash')
+        return executor
+
+
+# ハッシュ計算をスレッド数に上限のあるプールで実行し、結果を待つ
+# (hashlib.pbkdf2_hmacは計算中にGILを解放するので、プールのスレッド数までコア数に応じて並列に計算できる。
+#  同時に大量のユーザー登録・ログインがあってもハッシュ計算で使うCPUはプールのスレッド数までになる)
+# 呼び出したスレッドは結果を待つので、これはCPUの上限であり、リクエストのスレッドを空けるものではない
+# (ASGIでは登録・ログインのViewをapi.async_viewsでスレッドプールに逃がしている)
+def run_in_pool(func, *args):
+    if HASH_WORKERS <= 0:
+        return func(*args)
+    return get_executor().submit(func, *args).result()
+
+
+# 反復回数を設定で変更でき、計算をプールで実行するPBKDF2のハッシャー
+# アルゴリズム名はDjangoのものと同じなので既存のハッシュもそのまま検証でき、
+# 反復回数を変更した場合はログイン時に新しい回数で再ハッシュされる
+class TunablePBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    iterations = HASH_ITERATIONS or PBKDF2PasswordHasher.iterations
+
+    def encode(self, password, salt, iterations=None):
+        return run_in_pool(super().encode, password, salt, iterations)
@@ -0,0 +1,71 @@
+import json
+import logging
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.authtoken.models import Token
+from api.benchmark import SCENARIOS, HttpTransport, InProcessTransport, compare, run
+from api.models import Segment, Brand, Vehicle
+from .seed_data import USERNAME_PREFIX
+
+
+# APIのベンチマークを実行し、シナリオごとのp50/p95/p99・スループット・クエリ数をJSONに出力するコマンド
+# 先にseed_dataでデータを作っておく
+#   python manage.py benchmark --requests 500 --output bench.json --compare bench_prev.json
+#   python manage.py benchmark --url http://127.0.0.1:8000 --concurrency 16
+class Command(BaseCommand):
+    help = 'Benchmark the API endpoints in-process or against a running server.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help='base URL of a running server (default: in-process)')
+        parser.add_argument('--requests', type=int, default=200, help='requests per scenario')
+        parser.add_argument('--concurrency', type=int, default=1, help='concurrent clients')
+        parser.add_argument('--warmup', type=int, default=5, help='untimed requests per scenario')
+        parser.add_argument('--user', help='username to authenticate as (default: first seeded user)')
+        parser.add_argument('--scenario', action='append', choices=[s[0] for s in SCENARIOS],
+                            help='run only this scenario (repeatable)')
+        parser.add_argument('--writes', action='store_true', help='include scenarios that create data')
+        parser.add_argument('--output', help='write the results as JSON to this file')
+        parser.add_argument('--compare', help='previous JSON results to compare p95 latency with')
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('id')
+        user = (users.filter(username=options['user']) if options['user']
+                else users.filter(username__startswith=USERNAME_PREFIX)).first()
+        ids = {
+            'segment': Segment.objects.values_list('id', flat=True).order_by('id').first(),
+            'brand': Brand.objects.values_list('id', flat=True).order_by('id').first(),
+            'vehicle': Vehicle.objects.values_list('id', flat=True).order_by('id').first(),
+        }
+        if user is None or None in ids.values():
+            raise CommandError('No data to benchmark. Run "manage.py seed_data" first.')
+        token, _ = Token.objects.get_or_create(user=user)
+
+        # リクエストごとの計測値のログ(api.stats)を出力しない
+        logging.getLogger('api.stats').setLevel(logging.WARNING)
+        transport = HttpTransport(token.key, options['url']) if options['url'] else InProcessTransport(token.key)
+        meta = {
+            'mode': 'http' if options['url'] else 'in-process',
+            'dataset': {'segments': Segment.objects.count(), 'brands': Brand.objects.count(),
+                        'vehicles': Vehicle.objects.count()},
+        }
+        results = run(transport, ids, requests=options['requests'], concurrency=options['concurrency'],
+                      warmup=options['warmup'], include_writes=options['writes'], only=options['scenario'],
+                      meta=meta)
+
+        changes = {}
+        if options['compare']:
+            with open(options['compare']) as f:
+                changes = compare(results, json.load(f))
+        self.stdout.write('%-24s %8s %9s %9s %9s %9s %8s %6s' % (
+            'scenario', 'requests', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s', 'queries', 'errors'))
+        for name, result in results['results'].items():
+            line = '%-24s %8d %9.2f %9.2f %9.2f %9.1f %8s %6d' % (
+                name, result['requests'], result['p50_ms'], result['p95_ms'], result['p99_ms'],
+                result['throughput_rps'], result['queries_per_request'], result['errors'])
+            if name in changes:
+                line += '  p95 %+.1f%%' % changes[name]
+            self.stdout.write(line)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(self.style.SUCCESS('Wrote results to %s' % options['output']))
@@ -0,0 +1,120 @@
+import csv
+import json
+import sys
+import time
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from api.models import Segment, Brand, Vehicle
+from api.signals import post_bulk_create
+
+# 行の値をそのまま取り込むVehicleのフィールド
+VEHICLE_FIELDS = [Vehicle._meta.get_field(name) for name in ('vehicle_name', 'release_year', 'price')]
+
+
+# CSV/NDJSONファイルからVehicleを高速に一括登録するコマンド
+# (/api/vehicles/export/ の出力をそのまま取り込める)
+#   python manage.py import_vehicles vehicles.csv --user admin --batch-size 5000
+class Command(BaseCommand):
+    help = 'Import vehicles (and their brands/segments by name) from a CSV or NDJSON file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV/NDJSON file to import ("-" for stdin)')
+        parser.add_argument('--user', required=True, help='username that owns the imported vehicles')
+        parser.add_argument('--format', choices=['csv', 'ndjson'],
+                            help='file format (default: guessed from the file extension)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='rows per bulk INSERT')
+        parser.add_argument('--skip-invalid', action='store_true',
+                            help='skip invalid rows instead of aborting')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError('User "%s" does not exist.' % options['user'])
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be a positive integer.')
+        file_format = options['format'] or ('ndjson' if options['path'].endswith(('.ndjson', '.jsonl')) else 'csv')
+
+        # 名前 => オブジェクトの対応をメモリに持ち、行ごとにSegment/Brandを検索しない
+        self.segments = {segment.segment_name: segment for segment in Segment.objects.all()}
+        self.brands = {brand.brand_name: brand for brand in Brand.objects.all()}
+
+        self.verbosity = options['verbosity']
+        started = time.monotonic()
+        imported = skipped = 0
+        batch = []
+        stream = sys.stdin if options['path'] == '-' else open(options['path'], newline='', encoding='utf-8')
+        with stream:
+            if file_format == 'csv':
+                rows, parse = self.read_csv(stream), dict
+            else:
+                rows, parse = self.read_ndjson(stream), self.parse_ndjson
+            for line_number, row in rows:
+                try:
+                    batch.append(self.build_vehicle(user, parse(row)))
+                except (KeyError, TypeError, ValueError, ValidationError) as e:
+                    if not options['skip_invalid']:
+                        raise CommandError('Invalid row at line %d: %r' % (line_number, e))
+                    skipped += 1
+                    continue
+                if len(batch) >= options['batch_size']:
+                    imported += self.flush(batch)
+                    batch = []
+                    self.report(imported, started)
+            imported += self.flush(batch)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            'Imported %d vehicles (%d skipped) in %.2fs (%.0f rows/s)'
+            % (imported, skipped, elapsed, imported / elapsed if elapsed else 0)
+        ))
+
+    def read_csv(self, stream):
+        # ヘッダー行が1行目なので、データはline 2から
+        return enumerate(csv.DictReader(stream), start=2)
+
+    def read_ndjson(self, stream):
+        # 行ごとの解析は行のエラーとして扱えるようにparse_ndjsonで行う
+        for line_number, line in enumerate(stream, start=1):
+            if line.strip():
+                yield line_number, line
+
+    def parse_ndjson(self, line):
+        # priceを誤差なく読むためにfloatではなくDecimalにする
+        row = json.loads(line, parse_float=Decimal)
+        if not isinstance(row, dict):
+            raise ValueError('expected a JSON object, got %s' % type(row).__name__)
+        return row
+
+    def build_vehicle(self, user, row):
+        # モデルのフィールド定義(max_length, max_digitsなど)で値を検証・変換する
+        return Vehicle(
+            user=user,
+            **{field.name: field.clean(row[field.name], None) for field in VEHICLE_FIELDS},
+            segment=self.get_or_create(self.segments, Segment, 'segment_name', row['segment_name']),
+            brand=self.get_or_create(self.brands, Brand, 'brand_name', row['brand_name']),
+        )
+
+    def get_or_create(self, cache, model, field, name):
+        if not name:
+            raise ValueError('%s is required' % field)
+        if name not in cache:
+            cache[name] = model.objects.create(**{field: name})
+        return cache[name]
+
+    def flush(self, batch):
+        if not batch:
+            return 0
+        # バッチ単位でコミットし、長時間のロックを避ける
+        with transaction.atomic():
+            Vehicle.objects.bulk_create(batch, batch_size=len(batch))
+            post_bulk_create.send(sender=Vehicle, instances=batch)
+        return len(batch)
+
+    def report(self, imported, started):
+        if self.verbosity > 1:
+            elapsed = time.monotonic() - started
+            self.stdout.write('%d rows (%.0f rows/s)' % (imported, imported / elapsed if elapsed else 0))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from api.changes import RETENTION_DAYS, prune_changes
+
+
+# 差分同期用の古い変更履歴を削除するコマンド(cronなどで定期的に実行する)
+#   python manage.py prune_changes --days 30
+class Command(BaseCommand):
+    help = 'Delete change log entries older than the retention period in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=RETENTION_DAYS, help='retention period in days')
+        parser.add_argument('--batch-size', type=int, default=5000, help='rows deleted per statement')
+
+    def handle(self, *args, **options):
+        deleted = prune_changes(days=options['days'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('Deleted %d change log entries' % deleted))
@@ -0,0 +1,32 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.authtoken.models import Token
+from api.tokens import delete_tokens, purge_expired_tokens
+
+
+# 期限切れのトークンを削除するコマンド(cronなどで定期的に実行する)
+#   python manage.py purge_tokens
+# 指定したユーザーのトークン、または全てのトークンを失効させることもできる
+#   python manage.py purge_tokens --user alice --user bob
+#   python manage.py purge_tokens --all
+class Command(BaseCommand):
+    help = 'Delete expired auth tokens in batches, or revoke tokens of the given users.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', default=[], help='revoke the token of this username')
+        parser.add_argument('--all', action='store_true', help='revoke all tokens')
+        parser.add_argument('--batch-size', type=int, default=1000, help='rows deleted per statement')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if options['all']:
+            deleted = delete_tokens(Token.objects.all(), batch_size)
+        elif options['user']:
+            users = get_user_model().objects.filter(username__in=options['user'])
+            missing = set(options['user']) - set(users.values_list('username', flat=True))
+            if missing:
+                raise CommandError('Unknown user(s): %s' % ', '.join(sorted(missing)))
+            deleted = delete_tokens(Token.objects.filter(user__in=users), batch_size)
+        else:
+            deleted = purge_expired_tokens(batch_size)
+        self.stdout.write(self.style.SUCCESS('Deleted %d tokens' % deleted))
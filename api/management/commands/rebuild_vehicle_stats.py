@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from api.summary import rebuild
+
+
+# /api/vehicles/stats/ の集計テーブルをVehicleから全て作り直すコマンド
+# (通常はVehicleの更新時に差分が反映されるので、SQLで直接更新した場合などに実行する)
+#   python manage.py rebuild_vehicle_stats
+class Command(BaseCommand):
+    help = 'Rebuild the vehicle stats summary table from all vehicles.'
+
+    def handle(self, *args, **options):
+        created = rebuild()
+        self.stdout.write(self.style.SUCCESS('Rebuilt %d stat rows' % created))
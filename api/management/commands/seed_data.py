@@ -0,0 +1,134 @@
+import random
+import time
+from decimal import Decimal
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, transaction
+from api.cache import bump_version
+from api.models import Segment, Brand, Vehicle
+from api.summary import batch_delete
+from api.signals import post_bulk_create
+
+# 作成するユーザーのユーザー名の接頭辞(--clearで削除する対象)
+USERNAME_PREFIX = 'bench_user_'
+SEGMENT_NAMES = ['Sedan', 'SUV', 'Hatchback', 'Crossover', 'Pickup', 'Coupe', 'Wagon', 'Minivan',
+                 'Convertible', 'Roadster']
+BRAND_NAMES = ['Toyota', 'Honda', 'Nissan', 'Mazda', 'Subaru', 'Suzuki', 'Tesla', 'BMW', 'Mercedes-Benz',
+               'Audi', 'Volkswagen', 'Ford', 'Chevrolet', 'Hyundai', 'Kia', 'Volvo', 'Porsche', 'Lexus']
+MODEL_WORDS = ['Aero', 'Nova', 'Strada', 'Vista', 'Terra', 'Pulse', 'Orbit', 'Crest', 'Ridge', 'Drift']
+# priceはDecimal(6, 2)なので9999.99まで
+MAX_PRICE = Decimal('9999.99')
+# 発売年の基準の年(実行した年によらず同じデータになるよう固定する)
+BASE_YEAR = 2024
+
+
+# 順位の逆数に比例する重み(少数の人気ブランド・ユーザーに偏る分布)
+def zipf_weights(n):
+    return [1 / rank for rank in range(1, n + 1)]
+
+
+def names(base, n, label):
+    return base[:n] + ['%s %d' % (label, i) for i in range(len(base) + 1, n + 1)]
+
+
+# ベンチマーク用に、実際に近い分布のユーザー・Segment・Brand・Vehicleを作るコマンド
+# --seedが同じなら同じデータになる
+#   python manage.py seed_data --users 100 --segments 10 --brands 50 --vehicles 100000
+class Command(BaseCommand):
+    help = 'Seed users, segments, brands and vehicles with realistic distributions for benchmarking.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--segments', type=int, default=len(SEGMENT_NAMES))
+        parser.add_argument('--brands', type=int, default=len(BRAND_NAMES))
+        parser.add_argument('--vehicles', type=int, default=10000)
+        parser.add_argument('--seed', type=int, default=0, help='random seed for reproducible data')
+        parser.add_argument('--password', default='bench_pw', help='password of the seeded users')
+        parser.add_argument('--batch-size', type=int, default=1000, help='rows per bulk INSERT')
+        parser.add_argument('--base-year', type=int, default=BASE_YEAR,
+                            help='latest release year of the seeded vehicles')
+        parser.add_argument('--clear', action='store_true',
+                            help='delete all vehicles, segments, brands and seeded users first')
+
+    def handle(self, *args, **options):
+        if min(options['users'], options['segments'], options['brands']) < 1 and options['vehicles']:
+            raise CommandError('--users, --segments and --brands must be positive to create vehicles.')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be a positive integer.')
+        rng = random.Random(options['seed'])
+        started = time.monotonic()
+        if options['clear']:
+            self.clear()
+
+        # ハッシュ計算は1回だけにして全ユーザーで同じパスワードを使う
+        password = make_password(options['password'])
+        try:
+            users = self.create(User, [
+                User(username='%s%d' % (USERNAME_PREFIX, i), password=password)
+                for i in range(1, options['users'] + 1)
+            ], options['batch_size'])
+        except IntegrityError:
+            # 前回作成したユーザーが残っている(ユーザー名の一意制約の違反)
+            raise CommandError('Seeded users already exist. Pass --clear to delete the previous data first.')
+        segments = self.create(Segment, [
+            Segment(segment_name=name) for name in names(SEGMENT_NAMES, options['segments'], 'Segment')
+        ], options['batch_size'])
+        brands = self.create(Brand, [
+            Brand(brand_name=name) for name in names(BRAND_NAMES, options['brands'], 'Brand')
+        ], options['batch_size'])
+        # idを返さないDBがあるので作り直したものを取得する
+        users = list(User.objects.filter(username__in=[user.username for user in users]).order_by('id'))
+        segments = list(Segment.objects.filter(segment_name__in=[s.segment_name for s in segments]).order_by('id'))
+        brands = list(Brand.objects.filter(brand_name__in=[b.brand_name for b in brands]).order_by('id'))
+        bump_version(Segment)
+        bump_version(Brand)
+
+        created = 0
+        batch = []
+        user_weights, brand_weights = zipf_weights(len(users)), zipf_weights(len(brands))
+        for _ in range(options['vehicles']):
+            batch.append(self.build_vehicle(rng, rng.choices(users, user_weights)[0], rng.choice(segments),
+                                            rng.choices(brands, brand_weights)[0], options['base_year']))
+            if len(batch) >= options['batch_size']:
+                created += self.flush(batch)
+                batch = []
+        created += self.flush(batch)
+
+        self.stdout.write(self.style.SUCCESS(
+            'Seeded %d users, %d segments, %d brands and %d vehicles in %.2fs'
+            % (len(users), len(segments), len(brands), created, time.monotonic() - started)
+        ))
+
+    def build_vehicle(self, rng, user, segment, brand, base_year=BASE_YEAR):
+        # 発売年は最近のものが多く、価格は対数正規分布(少数の高額車)
+        release_year = int(rng.triangular(base_year - 30, base_year, base_year - 2))
+        price = min(Decimal(rng.lognormvariate(7.5, 0.6)).quantize(Decimal('0.01')), MAX_PRICE)
+        return Vehicle(
+            user=user, segment=segment, brand=brand, release_year=release_year, price=price,
+            vehicle_name='%s %s %d' % (brand.brand_name, rng.choice(MODEL_WORDS), rng.randint(1, 9) * 100),
+        )
+
+    def create(self, model, objects, batch_size):
+        with transaction.atomic():
+            model.objects.bulk_create(objects, batch_size=batch_size)
+            if model is not User:
+                post_bulk_create.send(sender=model, instances=objects)
+        return objects
+
+    def flush(self, batch):
+        if not batch:
+            return 0
+        # バッチ単位でコミットし、長時間のロックを避ける
+        with transaction.atomic():
+            Vehicle.objects.bulk_create(batch, batch_size=len(batch))
+            post_bulk_create.send(sender=Vehicle, instances=batch)
+        return len(batch)
+
+    def clear(self):
+        with transaction.atomic():
+            with batch_delete():
+                Vehicle.objects.all().delete()
+            Segment.objects.all().delete()
+            Brand.objects.all().delete()
+            User.objects.filter(username__startswith=USERNAME_PREFIX).delete()
@@ -0,0 +1,196 @@
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+from django.conf import settings
+
+# 複数のワーカープロセスの値を集計するためのディレクトリ(未設定ならこのプロセスの値のみ)
+# 各プロセスがバックグラウンドのスレッドで定期的に(と終了時に)自分の値をファイルに書き出し、
+# /metricsでは全てのファイルを合計する
+METRICS_DIR = getattr(settings, 'API_METRICS_DIR', None)
+# ファイルに書き出す間隔(秒)
+FLUSH_SECONDS = getattr(settings, 'API_METRICS_FLUSH_SECONDS', 1)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+# メトリクスの種類と説明
+METRICS = {
+    'api_requests_total': ('counter', 'Total HTTP requests.'),
+    'api_request_duration_seconds': ('histogram', 'HTTP request latency in seconds.'),
+    'api_response_size_bytes': ('histogram', 'HTTP response body size in bytes.'),
+    'api_requests_in_flight': ('gauge', 'HTTP requests currently being processed.'),
+    'api_db_queries_total': ('counter', 'Total database queries executed by requests.'),
+}
+
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+# プロセス内のメトリクスの値
+# ヒストグラムは記録時に_bucket/_sum/_countのサンプルに展開し、全ての値を(サンプル名, ラベル)の辞書で持つ
+# (プロセス間の集計はサンプルごとの合計になる)
+class Registry:
+    def __init__(self):
+        self.samples = {}
+        self.lock = threading.Lock()
+        # 書き出し(一時ファイル)を同時に行わないためのロック
+        self.flush_lock = threading.Lock()
+        self.flushed = 0
+        self.started = time.time_ns()
+        # 前回の書き出しの後に値が変わったか
+        self.dirty = False
+        # 書き出しのスレッドを起動したプロセス(fork後の子プロセスでは親のスレッドは動いていない)
+        self.flusher_pid = None
+
+    def inc(self, name, labels, value=1):
+        key = (name, label_key(labels))
+        with self.lock:
+            self.samples[key] = self.samples.get(key, 0) + value
+            self.dirty = True
+        self.start_flusher()
+
+    def observe(self, name, labels, value, buckets):
+        self.start_flusher()
+        with self.lock:
+            self.dirty = True
+            # バケットは累積(le以下の件数)
+            for bound in buckets + (float('inf'),):
+                key = (name + '_bucket', label_key(dict(labels, le=format_value(float(bound)))))
+                self.samples[key] = self.samples.get(key, 0) + (1 if value <= bound else 0)
+            for suffix, amount in (('_sum', value), ('_count', 1)):
+                key = (name + suffix, label_key(labels))
+                self.samples[key] = self.samples.get(key, 0) + amount
+
+    def snapshot(self):
+        with self.lock:
+            return [[name, dict(labels), value] for (name, labels), value in self.samples.items()]
+
+    # FLUSH_SECONDSごとに変わった値を書き出すスレッドをプロセスごとに1つ起動する
+    # (リクエストが来なくなったワーカーの最後の値も他のプロセスから見えるようにする)
+    def start_flusher(self):
+        if not METRICS_DIR or self.flusher_pid == os.getpid():
+            return
+        with self.lock:
+            if self.flusher_pid == os.getpid():
+                return
+            self.flusher_pid = os.getpid()
+        threading.Thread(target=self.run_flusher, name='metrics-flush', daemon=True).start()
+
+    def run_flusher(self):
+        while True:
+            time.sleep(FLUSH_SECONDS)
+            if self.dirty:
+                self.flush(force=True)
+
+    def path(self):
+        return os.path.join(METRICS_DIR, '%d-%d.json' % (os.getpid(), self.started))
+
+    # 自分の値をファイルに書き出す(途中の状態を読まれないよう、一時ファイルから置き換える)
+    def flush(self, force=False):
+        if not METRICS_DIR or (not force and time.monotonic() - self.flushed < FLUSH_SECONDS):
+            return
+        self.flushed = time.monotonic()
+        with self.flush_lock:
+            os.makedirs(METRICS_DIR, exist_ok=True)
+            with self.lock:
+                self.dirty = False
+            temp = '%s.tmp' % self.path()
+            with open(temp, 'w') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(temp, self.path())
+
+
+registry = Registry()
+# 終了時(gunicornのmax_requestsによる再起動など)にも最後の値を書き出す
+atexit.register(lambda: registry.flush(force=True))
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+# 全プロセスの値を合計する
+# カウンター・ヒストグラムは終了したプロセスの分も含め(値が減らないように)、ゲージは動いているプロセスの分のみ
+def collect():
+    totals = {}
+
+    def add(samples, alive):
+        for name, labels, value in samples:
+            if not alive and METRICS.get(name, ('',))[0] == 'gauge':
+                continue
+            key = (name, label_key(labels))
+            totals[key] = totals.get(key, 0) + value
+
+    add(registry.snapshot(), True)
+    if METRICS_DIR:
+        registry.flush(force=True)
+        for path in glob.glob(os.path.join(METRICS_DIR, '*.json')):
+            if path == registry.path():
+                continue
+            try:
+                with open(path) as f:
+                    samples = json.load(f)
+            except (OSError, ValueError):
+                continue
+            add(samples, process_alive(int(os.path.basename(path).split('-')[0])))
+    return totals
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for name, value in labels
+    )
+
+
+# Prometheusのテキスト形式で出力する
+def render():
+    totals = collect()
+    lines = []
+    for metric, (kind, help_text) in METRICS.items():
+        lines.append('# HELP %s %s' % (metric, help_text))
+        lines.append('# TYPE %s %s' % (metric, kind))
+        names = (metric + '_bucket', metric + '_sum', metric + '_count') if kind == 'histogram' else (metric,)
+        for name in names:
+            for (sample, labels), value in sorted(totals.items(), key=sort_key):
+                if sample == name:
+                    lines.append('%s%s %s' % (name, format_labels(labels), format_value(value)))
+    return '\n'.join(lines) + '\n'
+
+
+# ヒストグラムのバケットはleの数値順に並べる
+def sort_key(item):
+    (name, labels), value = item
+    le = dict(labels).get('le')
+    return (name, tuple(label for label in labels if label[0] != 'le'),
+            float('inf') if le == '+Inf' else float(le or 0))
+
+
+# リクエストのルート名(routerのbasenameまたはURLの名前)
+def route_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None or not match.url_name:
+        return 'unmatched'
+    basename = match.url_name.rpartition('-')[0]
+    # routerが付けた名前(segment-list/vehicle-detail/vehicle-bulkなど)はbasenameにまとめる
+    if basename and hasattr(match.func, 'actions'):
+        return basename
+    return match.url_name
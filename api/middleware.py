@@ -0,0 +1,127 @@
+import asyncio
+import time
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse
+from django.utils.deprecation import MiddlewareMixin
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.permissions import SAFE_METHODS
+from . import metrics, profiling, stats
+from .authentication import CachedTokenAuthentication
+from .routers import is_sticky, mark_sticky, read_from_replica
+
+
+# ASGIで動いている場合、読み取りのリクエストとパスワードのハッシュ計算をするリクエストを
+# 非同期のView(rest_api.async_urls)で処理する
+# WSGIではリクエストごとにイベントループを作ることになるので同期のViewのままにする
+class AsyncReadMiddleware(MiddlewareMixin):
+    # GET/HEAD以外でも非同期のViewで処理するパス(ユーザー登録・ログイン)
+    offloaded_paths = ('/api/create/', '/api/auth/')
+
+    def process_request(self, request):
+        if (getattr(settings, 'API_ASYNC_READS', True) and isinstance(request, ASGIRequest)
+                and (request.method in ('GET', 'HEAD') or request.path in self.offloaded_paths)):
+            request.urlconf = 'rest_api.async_urls'
+
+
+# GET/HEAD/OPTIONSのリクエストは読み取り用のレプリカから読む(ReplicaRouter)
+# 書き込みが成功した後はDATABASE_REPLICA_STICKY_SECONDS秒の間、同じクライアントはプライマリから読む
+class ReplicaMiddleware(MiddlewareMixin):
+    def process_request(self, request):
+        read_from_replica(request.method in SAFE_METHODS and not is_sticky(request))
+
+    def process_response(self, request, response):
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            mark_sticky(request)
+        read_from_replica(False)
+        return response
+
+
+# リクエストごとのクエリ数・SQL/serializer/レンダリング/認証の時間を計測し、
+# Server-Timingヘッダーと1行のJSONのログ(api.stats)に出す(DEBUG=Falseでも動く)
+class StatsMiddleware(MiddlewareMixin):
+    def process_request(self, request):
+        if getattr(settings, 'API_STATS', True):
+            stats.start()
+
+    def process_template_response(self, request, response):
+        request_stats = stats.current()
+        if request_stats is not None and not response.is_rendered:
+            started = time.perf_counter()
+            response.add_post_render_callback(
+                lambda rendered: request_stats.add('render', time.perf_counter() - started)
+            )
+        return response
+
+    def process_response(self, request, response):
+        request_stats = stats.finish()
+        if request_stats is not None:
+            if getattr(settings, 'API_SERVER_TIMING', True):
+                response['Server-Timing'] = request_stats.server_timing()
+            stats.log_request(request, response, request_stats)
+        return response
+
+
+# ルート(routerのbasenameやURLの名前)ごとのリクエスト数・レイテンシ・レスポンスサイズ・
+# 処理中のリクエスト数・クエリ数を記録する(GET /metrics で出力する)
+# StatsMiddlewareより後に置き、StatsMiddlewareが計測したクエリ数を使う
+class MetricsMiddleware(MiddlewareMixin):
+    def process_request(self, request):
+        if getattr(settings, 'API_METRICS', True):
+            request._metrics_started = time.perf_counter()
+            metrics.registry.inc('api_requests_in_flight', {'method': request.method})
+
+    def process_response(self, request, response):
+        started = getattr(request, '_metrics_started', None)
+        if started is None:
+            return response
+        registry = metrics.registry
+        route = metrics.route_name(request)
+        registry.inc('api_requests_in_flight', {'method': request.method}, -1)
+        registry.inc('api_requests_total', {'route': route, 'method': request.method,
+                                            'status': str(response.status_code)})
+        registry.observe('api_request_duration_seconds', {'route': route, 'method': request.method},
+                         time.perf_counter() - started, metrics.LATENCY_BUCKETS)
+        if not response.streaming:
+            registry.observe('api_response_size_bytes', {'route': route}, len(response.content), metrics.SIZE_BUCKETS)
+        request_stats = stats.current()
+        if request_stats is not None:
+            registry.inc('api_db_queries_total', {'route': route}, request_stats.queries)
+        return response
+
+
+# スタッフユーザーのリクエストを1件だけプロファイルする
+#   ?profile=cprofile(または1) / ?profile=sampling、もしくはヘッダー X-Profile: cprofile
+# プロファイルはレスポンスとして返す。API_PROFILE_DIRが設定されていればファイルに保存し、
+# 通常のレスポンスにファイル名(X-Profile-File)を付けて返す
+class ProfilingMiddleware(MiddlewareMixin):
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        mode = request.GET.get('profile') or request.META.get('HTTP_X_PROFILE')
+        if not mode or not getattr(settings, 'API_PROFILING', True):
+            return None
+        profiler_class = profiling.PROFILERS.get('cprofile' if mode == '1' else mode)
+        if profiler_class is None or not self.is_staff(request):
+            return None
+
+        # 非同期のView(api.async_views)はこのスレッドで計測できるよう元の同期のViewを呼ぶ
+        if asyncio.iscoroutinefunction(view_func):
+            view_func = view_func.__wrapped__
+        with profiler_class() as profiler:
+            response = view_func(request, *view_args, **view_kwargs)
+            if hasattr(response, 'render') and not response.is_rendered:
+                response.render()
+
+        if profiling.PROFILE_DIR:
+            response['X-Profile-File'] = profiling.save_profile(profiler, request)
+            return response
+        return HttpResponse(profiler.text(), content_type='text/plain; charset=utf-8')
+
+    # セッションまたはトークンで認証されたユーザーがスタッフか(DRFの認証より前なのでここで認証する)
+    def is_staff(self, request):
+        user = getattr(request, 'user', None)
+        if user is None or not user.is_authenticated:
+            try:
+                user = (CachedTokenAuthentication().authenticate(request) or (None,))[0]
+            except AuthenticationFailed:
+                return False
+        return user is not None and user.is_active and user.is_staff
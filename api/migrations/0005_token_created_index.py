@@ -0,0 +1,18 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_change'),
+        ('authtoken', '0003_tokenproxy'),
+    ]
+
+    # 期限切れのトークンの検索・削除のため、authtoken_token.createdにインデックスを作る
+    # (authtokenはDRFのアプリなので、こちらのマイグレーションでSQLで作成する)
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX api_token_created_idx ON authtoken_token (created)',
+            reverse_sql='DROP INDEX api_token_created_idx',
+        ),
+    ]
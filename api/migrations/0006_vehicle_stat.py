@@ -0,0 +1,48 @@
+# Generated by Django 3.2.25 on 2026-10-17 21:30
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Sum
+
+
+# 既存のVehicleから集計テーブルを作成する
+def build_vehicle_stats(apps, schema_editor):
+    Vehicle = apps.get_model('api', 'Vehicle')
+    VehicleStat = apps.get_model('api', 'VehicleStat')
+    for dimension, field in (('segment', 'segment_id'), ('brand', 'brand_id')):
+        rows = Vehicle.objects.order_by().values(field, 'release_year').annotate(
+            count=Count('id'), price_sum=Sum('price'), price_min=Min('price'), price_max=Max('price'),
+        )
+        VehicleStat.objects.bulk_create([
+            VehicleStat(dimension=dimension, group_id=row[field], release_year=row['release_year'],
+                        count=row['count'], price_sum=row['price_sum'],
+                        price_min=row['price_min'], price_max=row['price_max'])
+            for row in rows
+        ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_token_created_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VehicleStat',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dimension', models.CharField(choices=[('segment', 'segment'), ('brand', 'brand')], max_length=10)),
+                ('group_id', models.IntegerField()),
+                ('release_year', models.IntegerField()),
+                ('count', models.IntegerField()),
+                ('price_sum', models.DecimalField(decimal_places=2, max_digits=16)),
+                ('price_min', models.DecimalField(decimal_places=2, max_digits=6)),
+                ('price_max', models.DecimalField(decimal_places=2, max_digits=6)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='vehiclestat',
+            constraint=models.UniqueConstraint(fields=('dimension', 'group_id', 'release_year'), name='vehicle_stat_group_year_uniq'),
+        ),
+        migrations.RunPython(build_vehicle_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-17 21:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_vehicle_stat'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='change',
+            index=models.Index(fields=['model_name', 'action', 'created_at'], name='change_model_action_idx'),
+        ),
+    ]
@@ -2,9 +2,33 @@ from django.db import models
 from django.contrib.auth.models import User
 
 
+# Segment/Brandの削除はapi.summary.cascade_scope()の中で実行する
+# (カスケード削除されるVehicleの集計を削除後にまとめて作り直すための状態を、削除が失敗しても残さない)
+# api.summaryがこのモジュールをimportするので、使うときにimportする
+class GroupQuerySet(models.QuerySet):
+    def delete(self):
+        from .summary import cascade_scope
+        with cascade_scope():
+            return super().delete()
+
+
+class GroupModel(models.Model):
+    class Meta:
+        abstract = True
+
+    def delete(self, *args, **kwargs):
+        from .summary import cascade_scope
+        with cascade_scope():
+            return super().delete(*args, **kwargs)
+
+
 # Create your models here.
-class Segment(models.Model):
+class Segment(GroupModel):
     segment_name = models.CharField(max_length=100)
+    # 条件付きGET(Last-Modified/ETag)のための更新日時
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = GroupQuerySet.as_manager()
 
     # モデルをインスタンス化した際に、インスタンスに対してprintなどを
     # 実行した際に文字列（ここではsegmant_name）を返す特殊なメソッド
@@ -12,8 +36,11 @@ class Segment(models.Model):
         return self.segment_name
 
 
-class Brand(models.Model):
+class Brand(GroupModel):
     brand_name = models.CharField(max_length=100)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = GroupQuerySet.as_manager()
 
     def __str__(self):
         return self.brand_name
@@ -41,6 +68,80 @@ class Vehicle(models.Model):
         # 紐付いたSegmentオブジェクト削除時にはこちらも削除される
         on_delete=models.CASCADE
     )
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        # api.filters.VehicleFilterBackendで使う絞り込みの組み合わせに合わせた複合インデックス
+        # (segment/brand/userの単独検索は外部キーのインデックスを使う)
+        indexes = [
+            models.Index(fields=['segment', 'release_year'], name='vehicle_segment_year_idx'),
+            models.Index(fields=['segment', 'price'], name='vehicle_segment_price_idx'),
+            models.Index(fields=['brand', 'release_year'], name='vehicle_brand_year_idx'),
+            models.Index(fields=['brand', 'price'], name='vehicle_brand_price_idx'),
+            models.Index(fields=['release_year', 'price'], name='vehicle_year_price_idx'),
+            models.Index(fields=['price'], name='vehicle_price_idx'),
+        ]
 
     def __str__(self):
         return self.vehicle_name
+
+
+# 差分同期(/api/changes/)のための変更履歴
+# idが単調増加するカーソルになる。古い履歴はprune_changesコマンドで削除する
+class Change(models.Model):
+    ACTION_CREATE = 'create'
+    ACTION_UPDATE = 'update'
+    ACTION_DELETE = 'delete'
+    # 一括登録などで個別のidを記録できない場合。クライアントはそのモデルを全件取得し直す
+    ACTION_RESET = 'reset'
+    ACTION_CHOICES = [
+        (ACTION_CREATE, 'create'),
+        (ACTION_UPDATE, 'update'),
+        (ACTION_DELETE, 'delete'),
+        (ACTION_RESET, 'reset'),
+    ]
+
+    # 'segment', 'brand', 'vehicle'
+    model_name = models.CharField(max_length=20)
+    object_id = models.IntegerField(null=True)
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    # 古い履歴の削除で使う
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            # 一覧のLast-Modifiedで使う、モデルごとの最後の削除日時
+            models.Index(fields=['model_name', 'action', 'created_at'], name='change_model_action_idx'),
+        ]
+
+    def __str__(self):
+        return '%s %s %s' % (self.action, self.model_name, self.object_id)
+
+
+# /api/vehicles/stats/ のための集計テーブル
+# Segment/Brandごと・発売年ごとの台数と価格の合計・最小・最大を持ち、Vehicleの作成・更新・削除に合わせて
+# api.summaryで差分を反映する(全件の再集計はrebuild_vehicle_statsコマンド)
+class VehicleStat(models.Model):
+    DIMENSION_SEGMENT = 'segment'
+    DIMENSION_BRAND = 'brand'
+    DIMENSION_CHOICES = [
+        (DIMENSION_SEGMENT, 'segment'),
+        (DIMENSION_BRAND, 'brand'),
+    ]
+
+    dimension = models.CharField(max_length=10, choices=DIMENSION_CHOICES)
+    # SegmentまたはBrandのid
+    group_id = models.IntegerField()
+    release_year = models.IntegerField()
+    count = models.IntegerField()
+    price_sum = models.DecimalField(max_digits=16, decimal_places=2)
+    price_min = models.DecimalField(max_digits=6, decimal_places=2)
+    price_max = models.DecimalField(max_digits=6, decimal_places=2)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['dimension', 'group_id', 'release_year'], name='vehicle_stat_group_year_uniq'),
+        ]
+
+    def __str__(self):
+        return '%s %s %s' % (self.dimension, self.group_id, self.release_year)
@@ -0,0 +1,28 @@
+from rest_framework.pagination import CursorPagination
+
+
+# 主キー(または安定したソートカラム)をキーにしたカーソル(keyset)ページネーション
+# OFFSETを使わずに「前ページ最後の値より大きい/小さい」で絞り込むため、
+# テーブルが大きくなってもレスポンスサイズとレイテンシが一定になる
+class KeysetCursorPagination(CursorPagination):
+    # デフォルトは主キー順
+    ordering = 'id'
+    # ?page_size=で1ページの件数をクライアントから指定できるようにする
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    # オプトイン方式: cursorかpage_sizeが指定されたリクエストのみページネーションし、
+    # それ以外は従来通り全件をリストで返す(既存クライアントとの互換性のため)
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+    # 並び替えのフィールドが一意でない(?ordering=segmentなど)場合に、同じ値の行の順序が
+    # クエリごとに変わってページの境界で重複・欠落しないよう、主キーを最後のソートキーに加える
+    def get_ordering(self, request, queryset, view):
+        ordering = tuple(super().get_ordering(request, queryset, view))
+        if not any(field.lstrip('-') in ('id', 'pk') for field in ordering):
+            ordering += ('id',)
+        return ordering
@@ -0,0 +1,100 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from django.conf import settings
+
+# サンプリングの間隔(秒)
+SAMPLE_INTERVAL = getattr(settings, 'API_PROFILE_SAMPLE_INTERVAL', 0.001)
+# プロファイルを保存するディレクトリ(未設定ならレスポンスとして返す)
+PROFILE_DIR = getattr(settings, 'API_PROFILE_DIR', None)
+# レスポンスとして返すcProfileの結果の行数
+PRINT_LIMIT = 50
+
+
+# cProfileで関数ごとの実行時間を計測する(オーバーヘッドは大きいが正確な呼び出し回数が分かる)
+class CProfileProfiler:
+    extension = 'prof'
+
+    def __init__(self):
+        self.profiler = cProfile.Profile()
+
+    def __enter__(self):
+        self.profiler.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.disable()
+
+    def text(self):
+        out = io.StringIO()
+        pstats.Stats(self.profiler, stream=out).sort_stats('cumulative').print_stats(PRINT_LIMIT)
+        return out.getvalue()
+
+    def save(self, path):
+        self.profiler.dump_stats(path)
+
+
+# 別スレッドから一定間隔で対象スレッドのスタックを記録するサンプリングプロファイラー(低オーバーヘッド)
+# 結果はフレームグラフのツール(flamegraph.pl, speedscopeなど)で読めるcollapsed stacks形式
+class SamplingProfiler:
+    extension = 'collapsed'
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.target = threading.get_ident()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+    def sample(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.target)
+            if frame is not None:
+                self.stacks[collapse(frame)] += 1
+
+    def text(self):
+        return ''.join('%s %d\n' % (stack, count) for stack, count in sorted(self.stacks.items()))
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            f.write(self.text())
+
+
+# フレームを呼び出し元から順に;区切りで並べる
+def collapse(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+PROFILERS = {
+    'cprofile': CProfileProfiler,
+    'sampling': SamplingProfiler,
+}
+
+
+# プロファイルをPROFILE_DIRに保存し、ファイル名を返す
+def save_profile(profiler, request):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    name = '%s-%s-%s.%s' % (
+        time.strftime('%Y%m%d-%H%M%S'), request.method,
+        request.path.strip('/').replace('/', '_') or 'root', profiler.extension,
+    )
+    profiler.save(os.path.join(PROFILE_DIR, name))
+    return name
@@ -0,0 +1,64 @@
+import decimal
+from rest_framework import renderers
+from rest_framework.settings import api_settings
+from rest_framework.utils import encoders
+
+# orjson/msgpackはオプションの依存パッケージ
+# (orjsonがなければ標準のjsonで出力し、msgpackがなければMessagePackは使えない)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+# Decimalをfloatにせず文字列にして、誤差なく出力するエンコーダー
+# (それ以外の型はDRFのJSONEncoderと同じ変換をする)
+class LosslessJSONEncoder(encoders.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, decimal.Decimal):
+            return str(obj)
+        return super().default(obj)
+
+
+# orjson/msgpackで扱えない型を変換する関数
+encode_default = LosslessJSONEncoder().default
+
+
+# orjsonで高速にJSONを出力するレンダラー
+# 出力はDRFのJSONRendererと同じ(orjsonがない場合や、インデント指定時は標準のjsonを使う)
+class FastJSONRenderer(renderers.JSONRenderer):
+    encoder_class = LosslessJSONEncoder
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        use_orjson = (
+            orjson is not None and data is not None and not self.ensure_ascii and self.compact
+            and self.get_indent(accepted_media_type, renderer_context or {}) is None
+        )
+        if not use_orjson:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # datetimeはDRFと同じ表記('+00:00'ではなく'Z')にするためencode_defaultで変換する
+        ret = orjson.dumps(data, default=encode_default,
+                           option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME)
+        # JSONRendererと同様に\u2028と\u2029はエスケープする
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+
+# MessagePackで出力するレンダラー(Accept: application/msgpack または ?format=msgpack)
+class MessagePackRenderer(renderers.BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=encode_default, use_bin_type=True, datetime=False)
+
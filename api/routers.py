@@ -0,0 +1,58 @@
+import hashlib
+import random
+from asgiref.local import Local
+from django.conf import settings
+from django.core.cache import cache
+
+# リクエストごとの読み取り先の状態(非同期のViewのスレッドプールにも引き継がれる)
+state = Local()
+
+
+def read_from_replica(enabled):
+    state.read_from_replica = enabled
+
+
+# 今のリクエストの読み取りがレプリカに向けられているか
+def reading_from_replica():
+    return bool(getattr(settings, 'DATABASE_REPLICAS', [])) and getattr(state, 'read_from_replica', False)
+
+
+# 書き込みをしたクライアントの識別子(トークン、セッション、なければIPアドレス)
+def client_key(request):
+    identity = (
+        request.META.get('HTTP_AUTHORIZATION')
+        or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+        or request.META.get('REMOTE_ADDR', '')
+    )
+    return 'api:sticky:%s' % hashlib.md5(identity.encode()).hexdigest()
+
+
+# 書き込みの後しばらくは同じクライアントの読み取りをプライマリに向ける(read-your-writes)
+# ワーカープロセス間で共有するため、キャッシュに記録する
+def mark_sticky(request):
+    cache.set(client_key(request), True, getattr(settings, 'DATABASE_REPLICA_STICKY_SECONDS', 5))
+
+
+def is_sticky(request):
+    return cache.get(client_key(request), False)
+
+
+# 常にプライマリから読むアプリ
+# 認証(ユーザーとトークン)は発行・再発行の直後のリクエストでも使えるよう、複製の遅延のないプライマリから読む
+PRIMARY_APP_LABELS = ('auth', 'authtoken')
+
+
+# 読み取りのリクエストのクエリをレプリカに、それ以外をプライマリ(default)に向けるルーター
+# 読み取り先はReplicaMiddlewareが決め、リクエストの外(コマンドなど)では常にプライマリを使う
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if reading_from_replica() and model._meta.app_label not in PRIMARY_APP_LABELS:
+            return random.choice(settings.DATABASE_REPLICAS)
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    # レプリカはプライマリの複製なので、どのDBから読んだオブジェクト同士でも関連付けられる
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
@@ -1,10 +1,17 @@
 from rest_framework import serializers
+from rest_framework.relations import RelatedField
+from rest_framework.utils.serializer_helpers import ReturnDict, ReturnList
+from django.db import connections, router, transaction
+from django.db.models import F, QuerySet
+from django.utils import timezone
 from .models import Segment, Brand, Vehicle
+from .stats import TimedListSerializer, TimedSerializerMixin, timer
 from django.contrib.auth.models import User
 
 
 # DBの内容をJSONに変換する際に、serializerが作用する
-class UserSerializer(serializers.ModelSerializer):
+# (TimedSerializerMixin/TimedListSerializerで変換にかかった時間を計測する)
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         # modelの割当
         model = User
@@ -20,29 +27,192 @@ class UserSerializer(serializers.ModelSerializer):
         return user
 
 
-class SegmentSerializer(serializers.ModelSerializer):
+class SegmentSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         # modelの割当
         model = Segment
+        list_serializer_class = TimedListSerializer
         # serializerで取り扱う属性
         fields = ['id', 'segment_name']
 
 
-class BrandSerializer(serializers.ModelSerializer):
+class BrandSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         # modelの割当
         model = Brand
+        list_serializer_class = TimedListSerializer
         # serializerで取り扱う属性
         fields = ['id', 'brand_name']
 
 
-class VehicleSerializer(serializers.ModelSerializer):
+class VehicleSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     segment_name = serializers.ReadOnlyField(source='segment.segment_name', read_only=True)
     brand_name = serializers.ReadOnlyField(source='brand.brand_name', read_only=True)
 
     class Meta:
         # modelの割当
         model = Vehicle
+        list_serializer_class = TimedListSerializer
         # serializerで取り扱う属性
         fields = ['id', 'vehicle_name', 'release_year', 'price', 'segment', 'brand', 'segment_name', 'brand_name']
         extra_kwargs = {'user': {'read_only': True}}
+
+
+# 読み取り専用の高速なVehicleSerializer
+# ModelSerializerのフィールドごとの処理を通さずに、.values()で取得した辞書から
+# VehicleSerializerと全く同じ形のデータを作る(書き込みは従来のVehicleSerializerを使う)
+class FastVehicleSerializer:
+    serializer_class = VehicleSerializer
+    # DBから取得した値がそのまま出力になるフィールド(変換処理を省略する)
+    passthrough_fields = (serializers.ReadOnlyField, RelatedField, serializers.IntegerField, serializers.CharField)
+
+    def __init__(self, instance=None, many=False, **kwargs):
+        self.instance = instance
+        self.many = many
+        self.context = kwargs.get('context', {})
+
+    @classmethod
+    def get_fields(cls):
+        # (出力のキー, ORMのlookup, 変換関数またはNone)のリストをフィールド定義から一度だけ作る
+        if '_fields' not in cls.__dict__:
+            cls._fields = [
+                (name, field.source.replace('.', '__'),
+                 None if isinstance(field, cls.passthrough_fields) else field.to_representation)
+                for name, field in cls.serializer_class().fields.items() if not field.write_only
+            ]
+        return cls._fields
+
+    @classmethod
+    def values_queryset(cls, queryset, extra=()):
+        # 'segment.segment_name'のようなsourceはJOINしたカラムをフィールド名のキーで取得する
+        # extra: 出力しないが辞書に含めるフィールド(カーソルページネーションの並び替えのキーなど)
+        names = [name for name, lookup, accessor in cls.get_fields() if name == lookup]
+        names += [name for name in extra if name not in names]
+        expressions = {name: F(lookup) for name, lookup, accessor in cls.get_fields() if name != lookup}
+        return queryset.values(*names, **expressions)
+
+    def to_representation(self, row):
+        return {
+            name: row[name] if accessor is None else accessor(row[name])
+            for name, lookup, accessor in self.get_fields()
+        }
+
+    @property
+    def data(self):
+        with timer('serializer'):
+            if self.many:
+                rows = self.instance
+                # ページネーションしない場合はモデルのQuerySetがそのまま渡される
+                if isinstance(rows, QuerySet):
+                    rows = self.values_queryset(rows)
+                return ReturnList([self.to_representation(row) for row in rows], serializer=self)
+            return ReturnDict(self.to_representation(self.instance), serializer=self)
+
+
+# 一括処理時に、ListSerializerがまとめて取得しておいたオブジェクトから外部キーを解決するフィールド
+# (1件ずつのSELECTによる存在確認をしない)
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    def to_internal_value(self, data):
+        prefetched = getattr(self.root, 'prefetched_objects', {}).get(self.field_name)
+        if prefetched is None:
+            return super().to_internal_value(data)
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            pk = int(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if pk not in prefetched:
+            self.fail('does_not_exist', pk_value=data)
+        return prefetched[pk]
+
+
+# Vehicleの一括作成・更新用のListSerializer
+class BulkVehicleListSerializer(TimedListSerializer):
+    # bulk_create/bulk_updateで1回のSQLに含める件数
+    batch_size = 500
+    # 外部キーの存在確認をまとめて行うフィールド
+    related_fields = ('segment', 'brand')
+
+    def to_internal_value(self, data):
+        # 配列内で参照されているsegment/brandをそれぞれ1クエリでまとめて取得しておく
+        self.prefetched_objects = {}
+        # 一括更新で同じidが複数回指定されていないか確認するため、検証済みのidを記録する
+        self.validated_ids = set()
+        if isinstance(data, list):
+            for name in self.related_fields:
+                pks = set()
+                for item in data:
+                    try:
+                        pks.add(int(item[name]))
+                    except (TypeError, ValueError, KeyError):
+                        # 不正な値はフィールドのバリデーションでエラーにする
+                        pass
+                queryset = self.child.fields[name].get_queryset()
+                self.prefetched_objects[name] = queryset.in_bulk(pks)
+        return super().to_internal_value(data)
+
+    def run_child_validation(self, data):
+        if self.instance is None:
+            return super().run_child_validation(data)
+        # 一括更新ではself.instanceが{id: Vehicle}の辞書になっている
+        if not isinstance(data, dict) or data.get('id') is None:
+            raise serializers.ValidationError({'id': ['This field is required.']})
+        try:
+            pk = int(data['id'])
+        except (TypeError, ValueError):
+            raise serializers.ValidationError({'id': ['A valid integer is required.']})
+        if pk not in self.instance:
+            raise serializers.ValidationError({'id': ['Invalid pk "%s" - object does not exist.' % pk]})
+        # 同じVehicleを2回更新すると変更履歴や集計テーブルに重複して反映されるので受け付けない
+        if pk in self.validated_ids:
+            raise serializers.ValidationError({'id': ['Duplicate pk "%s" in the list.' % pk]})
+        self.validated_ids.add(pk)
+        self.child.instance = self.instance[pk]
+        validated = super().run_child_validation(data)
+        self.child.instance = None
+        return {**validated, 'id': pk}
+
+    def create(self, validated_data):
+        vehicles = [Vehicle(**attrs) for attrs in validated_data]
+        using = router.db_for_write(Vehicle)
+        with transaction.atomic(using=using):
+            Vehicle.objects.using(using).bulk_create(vehicles, batch_size=self.batch_size)
+            # DBが対応していればbulk_createで作成したオブジェクトにidが設定される
+            # (Django 3.2のSQLiteでは設定されないので、作成した行のidを取得し直す)
+            connection = connections[using]
+            if connection.vendor == 'sqlite' and not connection.features.can_return_rows_from_bulk_insert:
+                self.assign_ids(using, vehicles)
+        return vehicles
+
+    @staticmethod
+    def assign_ids(using, vehicles):
+        # SQLiteでは最初のINSERTからコミットまで書き込みのロックを持っていて他の接続は追加できず、
+        # idは(AUTOINCREMENTで)挿入順に増えるので、idの大きい方からの件数分が作成した行になる
+        ids = Vehicle.objects.using(using).order_by('-id').values_list('id', flat=True)[:len(vehicles)]
+        for vehicle, pk in zip(vehicles, reversed(list(ids))):
+            vehicle.pk = pk
+
+    def update(self, instance, validated_data):
+        vehicles = []
+        fields = {'updated_at'}
+        now = timezone.now()
+        for attrs in validated_data:
+            vehicle = instance[attrs.pop('id')]
+            for name, value in attrs.items():
+                setattr(vehicle, name, value)
+            fields.update(attrs)
+            # bulk_updateではauto_nowが効かないので明示的に更新日時を設定する
+            vehicle.updated_at = now
+            vehicles.append(vehicle)
+        Vehicle.objects.bulk_update(vehicles, fields, batch_size=self.batch_size)
+        return vehicles
+
+
+# 一括処理用のVehicleSerializer(JSON配列を受け取る)
+class BulkVehicleSerializer(VehicleSerializer):
+    segment = BulkPrimaryKeyRelatedField(queryset=Segment.objects.all())
+    brand = BulkPrimaryKeyRelatedField(queryset=Brand.objects.all())
+
+    class Meta(VehicleSerializer.Meta):
+        list_serializer_class = BulkVehicleListSerializer
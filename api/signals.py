@@ -0,0 +1,163 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_init, pre_save, post_save, pre_delete, post_delete
+from django.dispatch import receiver, Signal
+from rest_framework.authtoken.models import Token
+from .authentication import token_cache
+from .cache import bump_version
+from .events import publish_change
+from .changes import TRACKED_MODELS, record_change, record_bulk_changes
+from . import summary
+from .models import Segment, Brand, Vehicle, Change
+
+# bulk_create/bulk_updateではpost_saveが送られないため、一括処理の後に送るsignal
+# post_bulk_create: instances(作成したオブジェクトのリスト)
+# post_bulk_update: instances(更新したオブジェクトのリスト)
+post_bulk_create = Signal()
+post_bulk_update = Signal()
+
+
+# Segment/Brand/Vehicleが保存・削除されたらキャッシュのバージョンを上げて無効化する
+# (API経由だけでなく管理画面からの更新も対象)
+@receiver(post_save, sender=Segment)
+@receiver(post_delete, sender=Segment)
+@receiver(post_save, sender=Brand)
+@receiver(post_delete, sender=Brand)
+@receiver(post_save, sender=Vehicle)
+@receiver(post_delete, sender=Vehicle)
+@receiver(post_bulk_create, sender=Vehicle)
+@receiver(post_bulk_update, sender=Vehicle)
+def invalidate_lookup_cache(sender, **kwargs):
+    bump_version(sender)
+    # トランザクション中に別リクエストが古いデータを新しいバージョンでキャッシュした場合に備え、
+    # コミット後にもう一度バージョンを上げる
+    transaction.on_commit(lambda: bump_version(sender))
+
+
+# トークンが削除・再発行されたら認証のキャッシュから消す
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def invalidate_token_cache(sender, instance, **kwargs):
+    token_cache.invalidate(instance.key)
+
+
+# ユーザーが更新(無効化を含む)・削除されたらそのユーザーの認証のキャッシュを消す
+@receiver(post_save, sender=get_user_model())
+@receiver(post_delete, sender=get_user_model())
+def invalidate_user_token_cache(sender, instance, **kwargs):
+    token_cache.invalidate_user(instance.pk)
+
+
+# 差分同期のための変更履歴を記録し、SSEの購読者に配信する
+# (Segment/Brandの削除による関連Vehicleのカスケード削除もVehicleごとにpost_deleteが送られる)
+def record_saved(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        action = Change.ACTION_CREATE if created else Change.ACTION_UPDATE
+        record_change(sender, instance.pk, action)
+        publish_change(sender, [instance.pk], action)
+
+
+def record_deleted(sender, instance, **kwargs):
+    record_change(sender, instance.pk, Change.ACTION_DELETE)
+    publish_change(sender, [instance.pk], Change.ACTION_DELETE)
+
+
+def record_bulk_created(sender, instances, **kwargs):
+    record_bulk_changes(sender, instances, Change.ACTION_CREATE)
+    publish_bulk_changes(sender, instances, Change.ACTION_CREATE)
+
+
+def record_bulk_updated(sender, instances, **kwargs):
+    record_bulk_changes(sender, instances, Change.ACTION_UPDATE)
+    publish_bulk_changes(sender, instances, Change.ACTION_UPDATE)
+
+
+# 一括処理は1つのイベントにまとめて配信する(idが分からない場合はreset)
+def publish_bulk_changes(model, instances, action):
+    if any(instance.pk is None for instance in instances):
+        publish_change(model, [], Change.ACTION_RESET)
+    else:
+        publish_change(model, [instance.pk for instance in instances], action)
+
+
+for model in TRACKED_MODELS:
+    post_save.connect(record_saved, sender=model)
+    post_delete.connect(record_deleted, sender=model)
+    post_bulk_create.connect(record_bulk_created, sender=model)
+    post_bulk_update.connect(record_bulk_updated, sender=model)
+
+
+# /api/vehicles/stats/ の集計テーブル(api.summary)に差分を反映する
+# 更新・削除では変更前の値が必要なので、読み込んだ時点の値をインスタンスに保持しておく
+@receiver(post_init, sender=Vehicle)
+def remember_stat_values(sender, instance, **kwargs):
+    instance._stat_values = summary.stat_values(instance)
+
+
+# .only()などで変更前の値が分からない場合は保存・削除の前に取得する
+@receiver(pre_save, sender=Vehicle)
+@receiver(pre_delete, sender=Vehicle)
+def load_stat_values(sender, instance, raw=False, **kwargs):
+    if not raw and not instance._state.adding and instance._stat_values is None:
+        instance._stat_values = sender.objects.filter(pk=instance.pk).values_list(*summary.STAT_FIELDS).first()
+
+
+@receiver(post_save, sender=Vehicle)
+def update_stats_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    values = summary.stat_values(instance)
+    removed = [] if created or instance._stat_values is None else [instance._stat_values]
+    if values is None:
+        # update_fieldsで一部だけ保存した場合などは保存後の値を取得する
+        values = sender.objects.filter(pk=instance.pk).values_list(*summary.STAT_FIELDS).first()
+    if removed != [values]:
+        summary.apply_changes([values], removed)
+    instance._stat_values = values
+
+
+@receiver(post_delete, sender=Vehicle)
+def update_stats_deleted(sender, instance, **kwargs):
+    values = instance._stat_values
+    # Segment/Brandの削除によるカスケード削除は削除後に、summary.batch_delete()の中の削除は最後にまとめて集計し直す
+    if values is not None and not summary.in_cascade(values) and not summary.defer_removed(values):
+        summary.apply_changes(removed=[values])
+
+
+@receiver(post_bulk_create, sender=Vehicle)
+def update_stats_bulk_created(sender, instances, **kwargs):
+    added = [summary.stat_values(instance) for instance in instances]
+    summary.apply_changes(added)
+    for instance, values in zip(instances, added):
+        instance._stat_values = values
+
+
+@receiver(post_bulk_update, sender=Vehicle)
+def update_stats_bulk_updated(sender, instances, **kwargs):
+    # 同じVehicleが複数回含まれていても差分は1回だけ反映する
+    # (bulk_updateのCASE WHENでも最初に指定したものの値になる)
+    unique = {}
+    for instance in instances:
+        unique.setdefault(instance.pk, instance)
+    instances = list(unique.values())
+    removed = [instance._stat_values for instance in instances]
+    added = [summary.stat_values(instance) for instance in instances]
+    if None in removed or None in added:
+        # 変更前後の値が分からない場合は全て集計し直す
+        summary.rebuild()
+    else:
+        summary.apply_changes(added, removed)
+    for instance, values in zip(instances, added):
+        instance._stat_values = values
+
+
+@receiver(pre_delete, sender=Segment)
+@receiver(pre_delete, sender=Brand)
+def begin_stats_cascade(sender, instance, **kwargs):
+    summary.begin_cascade(sender, instance)
+
+
+@receiver(post_delete, sender=Segment)
+@receiver(post_delete, sender=Brand)
+def end_stats_cascade(sender, instance, **kwargs):
+    summary.end_cascade(sender, instance)
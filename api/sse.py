@@ -0,0 +1,92 @@
+import asyncio
+import json
+from urllib.parse import parse_qs
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from rest_framework.exceptions import AuthenticationFailed
+from .authentication import CachedTokenAuthentication
+from .events import broadcaster
+
+# 接続を維持するためのコメント行を送る間隔(秒)
+HEARTBEAT_SECONDS = getattr(settings, 'SSE_HEARTBEAT_SECONDS', 15)
+
+
+# Authorizationヘッダー(Token xxx)またはクエリパラメータ(?token=xxx)のトークンでユーザーを取得する
+# (ブラウザのEventSourceはヘッダーを指定できないため、クエリパラメータにも対応する)
+def get_token_key(scope):
+    for name, value in scope.get('headers', []):
+        if name == b'authorization':
+            keyword, _, key = value.decode('latin1').partition(' ')
+            if keyword.lower() == 'token' and key:
+                return key.strip()
+    return parse_qs(scope.get('query_string', b'').decode()).get('token', [None])[0]
+
+
+@sync_to_async
+def authenticate(key):
+    if not key:
+        return None
+    try:
+        return CachedTokenAuthentication().authenticate_credentials(key)[0]
+    except AuthenticationFailed:
+        return None
+
+
+def format_event(event):
+    return ('event: %s\ndata: %s\n\n' % (event['action'], json.dumps(event))).encode()
+
+
+async def send_error(send, status, message):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json')]})
+    await send({'type': 'http.response.body', 'body': json.dumps({'detail': message}).encode()})
+
+
+# GET /api/events/ Segment/Brand/Vehicleの作成・更新・削除をServer-Sent Eventsで配信するASGIアプリ
+# Djangoのビューを通さずに接続ごとに1つのコルーチンで待機するので、
+# 待機中の接続はスレッドを使わず、1プロセスで多数の接続を保持できる
+async def events_application(scope, receive, send):
+    if scope['method'] != 'GET':
+        await send_error(send, 405, 'Method "%s" not allowed.' % scope['method'])
+        return
+    user = await authenticate(get_token_key(scope))
+    if user is None:
+        await send_error(send, 401, 'Authentication credentials were not provided.')
+        return
+
+    subscriber = broadcaster.subscribe()
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+        ]})
+        await send({'type': 'http.response.body', 'body': b': connected\n\n', 'more_body': True})
+        while not disconnected.done():
+            next_event = asyncio.ensure_future(subscriber.queue.get())
+            done, pending = await asyncio.wait(
+                {next_event, disconnected}, timeout=HEARTBEAT_SECONDS, return_when=asyncio.FIRST_COMPLETED
+            )
+            if next_event not in done:
+                next_event.cancel()
+                if not disconnected.done():
+                    await send({'type': 'http.response.body', 'body': b': heartbeat\n\n', 'more_body': True})
+                continue
+            event = next_event.result()
+            if event is None:
+                # キューがあふれた場合はresetを送って切断する(クライアントは/api/changes/で追いつく)
+                await send({'type': 'http.response.body', 'body': b'event: reset\ndata: {}\n\n', 'more_body': True})
+                break
+            await send({'type': 'http.response.body', 'body': format_event(event), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+    finally:
+        broadcaster.unsubscribe(subscriber)
+        disconnected.cancel()
+
+
+async def wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
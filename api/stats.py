@@ -0,0 +1,120 @@
+import json
+import logging
+import time
+from contextlib import contextmanager
+from asgiref.local import Local
+from django.conf import settings
+from rest_framework import serializers
+
+logger = logging.getLogger('api.stats')
+
+# 実行時間がこのミリ秒を超えたSQLを記録してログに出す(0で記録しない)
+SLOW_SQL_MS = getattr(settings, 'API_SLOW_SQL_MS', 0)
+# ログに出す遅いSQLの件数(遅い順)
+SLOW_SQL_LOG_COUNT = getattr(settings, 'API_SLOW_SQL_LOG_COUNT', 5)
+
+# 処理中のリクエストの計測値(非同期のViewのスレッドプールにも引き継がれる)
+state = Local()
+
+
+# 1リクエストの計測値
+class RequestStats:
+    # Server-Timingとログに出す区間
+    timers = ('db', 'serializer', 'render', 'auth')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.durations = dict.fromkeys(self.timers, 0.0)
+        # 入れ子になった同じ区間を二重に数えないための深さ
+        self.depths = dict.fromkeys(self.timers, 0)
+        self.slow_queries = []
+
+    def add(self, name, seconds):
+        self.durations[name] += seconds
+
+    def add_query(self, sql, seconds):
+        self.queries += 1
+        self.durations['db'] += seconds
+        if SLOW_SQL_MS and seconds * 1000 >= SLOW_SQL_MS:
+            self.slow_queries.append((seconds, sql))
+
+    def total(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        metrics = ['db;dur=%.1f;desc="%d queries"' % (self.durations['db'] * 1000, self.queries)]
+        metrics += ['%s;dur=%.1f' % (name, self.durations[name] * 1000) for name in self.timers[1:]]
+        metrics.append('total;dur=%.1f' % (self.total() * 1000))
+        return ', '.join(metrics)
+
+    def as_dict(self):
+        data = {'queries': self.queries}
+        data.update(('%s_ms' % name, round(value * 1000, 2)) for name, value in self.durations.items())
+        data['total_ms'] = round(self.total() * 1000, 2)
+        return data
+
+
+def start():
+    state.stats = RequestStats()
+    return state.stats
+
+
+def finish():
+    stats = getattr(state, 'stats', None)
+    state.stats = None
+    return stats
+
+
+def current():
+    return getattr(state, 'stats', None)
+
+
+# 区間の処理時間を計測する(リクエストの外では何もしない)
+@contextmanager
+def timer(name):
+    stats = current()
+    if stats is None or stats.depths[name]:
+        yield
+        return
+    stats.depths[name] += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.depths[name] -= 1
+        stats.add(name, time.perf_counter() - started)
+
+
+# 全てのDB接続に設定するexecute_wrapper(api/db.py)
+def record_query(execute, sql, params, many, context):
+    stats = current()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.add_query(sql, time.perf_counter() - started)
+
+
+# 計測値をログに1行のJSONで出す(遅いSQLがあればそれも出す)
+def log_request(request, response, stats):
+    data = {'method': request.method, 'path': request.path, 'status': response.status_code}
+    data.update(stats.as_dict())
+    logger.info(json.dumps(data))
+    for seconds, sql in sorted(stats.slow_queries, key=lambda query: query[0], reverse=True)[:SLOW_SQL_LOG_COUNT]:
+        logger.warning(json.dumps({'method': request.method, 'path': request.path,
+                                   'sql_ms': round(seconds * 1000, 2), 'sql': sql}))
+
+
+# .dataの作成時間をserializerの区間として計測するSerializer
+class TimedSerializerMixin:
+    @property
+    def data(self):
+        with timer('serializer'):
+            return super().data
+
+
+class TimedListSerializer(TimedSerializerMixin, serializers.ListSerializer):
+    pass
@@ -0,0 +1,254 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from decimal import Decimal
+from asgiref.local import Local
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Max, Min, Subquery, Sum, Value
+from django.db.models.functions import Cast, Coalesce, Greatest, Least
+from .models import Segment, Brand, Vehicle, VehicleStat
+
+# 集計の単位(VehicleStat.dimension)ごとのVehicleの外部キー
+DIMENSIONS = {
+    VehicleStat.DIMENSION_SEGMENT: 'segment_id',
+    VehicleStat.DIMENSION_BRAND: 'brand_id',
+}
+# 集計に使うVehicleのフィールド
+STAT_FIELDS = ('segment_id', 'brand_id', 'release_year', 'price')
+
+# Segment/Brandの削除によるカスケード削除と、batch_delete()による複数のVehicleの削除の状態
+# (Vehicleごとに差分を反映せず、削除後にまとめて集計し直す)
+state = Local()
+
+
+def stat_values(vehicle):
+    # .only()などで読み込まれていないフィールドがあれば不明とする(読み込みのクエリを発生させない)
+    if any(field not in vehicle.__dict__ for field in STAT_FIELDS):
+        return None
+    return tuple(getattr(vehicle, field) for field in STAT_FIELDS)
+
+
+def buckets(values):
+    segment_id, brand_id, release_year, price = values
+    return [
+        (VehicleStat.DIMENSION_SEGMENT, segment_id, release_year),
+        (VehicleStat.DIMENSION_BRAND, brand_id, release_year),
+    ]
+
+
+# 追加・削除されたVehicleの値(stat_values)を集計テーブルに反映する
+# 追加のみの(dimension, group_id, release_year)は差分を加え、削除を含むものは
+# 最小・最大が変わる可能性があるので、その発売年の分だけ(複合インデックスで)集計し直す
+def apply_changes(added=(), removed=()):
+    additions = defaultdict(list)
+    for values in added:
+        for bucket in buckets(values):
+            # floatで代入された値もDecimalとして合計する
+            additions[bucket].append(Decimal(str(values[3])))
+    recompute = {bucket for values in removed for bucket in buckets(values)}
+
+    with transaction.atomic():
+        for bucket in recompute:
+            recompute_bucket(*bucket)
+        additions = {bucket: prices for bucket, prices in additions.items() if bucket not in recompute}
+        if additions:
+            add_to_buckets(additions)
+
+
+# 複数のVehicleを削除する間(QuerySet.deleteなど)は削除されたVehicleの値をためておき、
+# 最後に(dimension, group_id, release_year)ごとに1回だけ集計し直す
+# (Vehicleごとに集計し直すとクエリ数が件数に比例して増える)
+@contextmanager
+def batch_delete():
+    if getattr(state, 'removed', None) is not None:
+        # 入れ子の場合は外側でまとめて反映する
+        yield
+        return
+    state.removed = []
+    try:
+        yield
+        removed = state.removed
+    finally:
+        state.removed = None
+    if removed:
+        apply_changes(removed=removed)
+
+
+# batch_delete()の中ならVehicleの削除を後でまとめて反映するためにためておく
+def defer_removed(values):
+    removed = getattr(state, 'removed', None)
+    if removed is None:
+        return False
+    removed.append(values)
+    return True
+
+
+def price_value(price):
+    # SQLiteではDecimalが文字列として渡され、MIN/MAXで数値と比較できないのでCASTする
+    return Cast(Value(price), output_field=VehicleStat._meta.get_field('price_min'))
+
+
+# 既存の行はF式で更新し、ない行はまとめて作成する
+# SQLiteでは読み取りから始めたトランザクションが書き込みに移ると競合時にロック待ちせずエラーになるので、
+# 読み取りより先に書き込む
+def add_to_buckets(additions):
+    created = []
+    for bucket, prices in additions.items():
+        if not update_bucket(bucket, prices):
+            created.append(bucket)
+    if not created:
+        return
+    try:
+        with transaction.atomic():
+            VehicleStat.objects.bulk_create([new_stat(bucket, additions[bucket]) for bucket in created])
+    except IntegrityError:
+        # 同時に同じ行を作成された場合(一意制約の違反)は1行ずつ更新・作成する
+        for bucket in created:
+            if not update_bucket(bucket, additions[bucket]):
+                new_stat(bucket, additions[bucket]).save()
+
+
+def update_bucket(bucket, prices):
+    dimension, group_id, release_year = bucket
+    return VehicleStat.objects.filter(dimension=dimension, group_id=group_id, release_year=release_year).update(
+        count=F('count') + len(prices),
+        price_sum=F('price_sum') + sum(prices),
+        price_min=Least(F('price_min'), price_value(min(prices))),
+        price_max=Greatest(F('price_max'), price_value(max(prices))),
+    )
+
+
+def new_stat(bucket, prices):
+    dimension, group_id, release_year = bucket
+    return VehicleStat(dimension=dimension, group_id=group_id, release_year=release_year,
+                       count=len(prices), price_sum=sum(prices), price_min=min(prices), price_max=max(prices))
+
+
+# 1つの(dimension, group_id, release_year)をVehicleから集計し直す
+# 既存の行はサブクエリで集計した値に更新し(読み取りより先に書き込む)、台数が0になれば削除する
+def recompute_bucket(dimension, group_id, release_year):
+    field = DIMENSIONS[dimension]
+    vehicles = Vehicle.objects.filter(**{field: group_id, 'release_year': release_year})
+    aggregates = {'count': Count('id'), 'price_sum': Sum('price'), 'price_min': Min('price'), 'price_max': Max('price')}
+    grouped = vehicles.order_by().values(field)
+    rows = VehicleStat.objects.filter(dimension=dimension, group_id=group_id, release_year=release_year)
+    updated = rows.update(**{
+        name: Coalesce(Subquery(grouped.annotate(value=function).values('value')), Value(0),
+                       output_field=VehicleStat._meta.get_field(name))
+        for name, function in aggregates.items()
+    })
+    if updated:
+        rows.filter(count=0).delete()
+        return
+    aggregate = vehicles.aggregate(**aggregates)
+    if aggregate['count']:
+        VehicleStat.objects.create(dimension=dimension, group_id=group_id, release_year=release_year, **aggregate)
+
+
+# 指定したグループ(dimension, group_id)の集計を作り直す(groupsがNoneなら全て)
+def rebuild(groups=None):
+    created = 0
+    with transaction.atomic():
+        for dimension, field in DIMENSIONS.items():
+            vehicles = Vehicle.objects.all()
+            rows = VehicleStat.objects.filter(dimension=dimension)
+            if groups is not None:
+                ids = [group_id for group_dimension, group_id in groups if group_dimension == dimension]
+                vehicles = vehicles.filter(**{'%s__in' % field: ids})
+                rows = rows.filter(group_id__in=ids)
+            rows.delete()
+            stats = VehicleStat.objects.bulk_create([
+                VehicleStat(dimension=dimension, group_id=row[field], release_year=row['release_year'],
+                            count=row['count'], price_sum=row['price_sum'],
+                            price_min=row['price_min'], price_max=row['price_max'])
+                for row in vehicles.order_by().values(field, 'release_year').annotate(
+                    count=Count('id'), price_sum=Sum('price'), price_min=Min('price'), price_max=Max('price'),
+                )
+            ], batch_size=1000)
+            created += len(stats)
+    return created
+
+
+# Segment/Brandの削除(Model.delete/QuerySet.delete)全体をこの中で実行する
+# 削除が例外で終わるとpost_deleteが送られずend_cascadeが呼ばれないので、終了時に必ずカスケード削除の状態を消す
+# (スレッドに状態が残ると、以降のVehicleの削除が集計テーブルに反映されなくなる)
+@contextmanager
+def cascade_scope():
+    if getattr(state, 'in_cascade_scope', False):
+        # 入れ子の場合は外側で消す
+        yield
+        return
+    state.in_cascade_scope = True
+    try:
+        yield
+    finally:
+        state.in_cascade_scope = False
+        state.cascading, state.affected = set(), set()
+
+
+# Segment/Brandの削除前に、カスケード削除されるVehicleが含まれる他のグループを記録する
+def begin_cascade(model, instance):
+    dimension = model._meta.model_name
+    other = VehicleStat.DIMENSION_BRAND if dimension == VehicleStat.DIMENSION_SEGMENT else VehicleStat.DIMENSION_SEGMENT
+    affected = Vehicle.objects.filter(**{DIMENSIONS[dimension]: instance.pk}).values_list(DIMENSIONS[other], flat=True)
+    if not hasattr(state, 'cascading'):
+        state.cascading, state.affected = set(), set()
+    state.cascading.add((dimension, instance.pk))
+    state.affected.update((other, group_id) for group_id in set(affected))
+
+
+def in_cascade(values):
+    cascading = getattr(state, 'cascading', set())
+    return any((dimension, group_id) in cascading for dimension, group_id, _ in buckets(values))
+
+
+# Segment/Brandの削除後に、そのグループの集計を消して影響のあったグループを集計し直す
+def end_cascade(model, instance):
+    dimension = model._meta.model_name
+    VehicleStat.objects.filter(dimension=dimension, group_id=instance.pk).delete()
+    cascading = getattr(state, 'cascading', set())
+    cascading.discard((dimension, instance.pk))
+    if not cascading and getattr(state, 'affected', None):
+        affected, state.affected = state.affected, set()
+        rebuild(affected)
+
+
+def format_price(value):
+    return None if value is None else str(value.quantize(Decimal('0.01')))
+
+
+# Segment/Brandごとの台数・平均/最小/最大価格・発売年ごとの台数
+# 集計テーブルとSegment/Brandの名前だけを読むので、Vehicleの件数によらずグループ数に比例する
+def get_stats():
+    groups = {dimension: defaultdict(lambda: {'count': 0, 'price_sum': 0, 'price_min': None, 'price_max': None,
+                                              'release_years': []})
+              for dimension in DIMENSIONS}
+    rows = VehicleStat.objects.order_by('release_year').values_list(
+        'dimension', 'group_id', 'release_year', 'count', 'price_sum', 'price_min', 'price_max',
+    )
+    for dimension, group_id, release_year, count, price_sum, price_min, price_max in rows:
+        group = groups[dimension][group_id]
+        group['count'] += count
+        group['price_sum'] += price_sum
+        group['price_min'] = price_min if group['price_min'] is None else min(group['price_min'], price_min)
+        group['price_max'] = price_max if group['price_max'] is None else max(group['price_max'], price_max)
+        group['release_years'].append({'release_year': release_year, 'count': count})
+
+    def build(dimension, model, name_field):
+        result = []
+        for group_id, name in model.objects.order_by('id').values_list('id', name_field):
+            group = groups[dimension][group_id]
+            result.append({
+                'id': group_id,
+                name_field: name,
+                'count': group['count'],
+                'price_avg': format_price(group['price_sum'] / group['count']) if group['count'] else None,
+                'price_min': format_price(group['price_min']),
+                'price_max': format_price(group['price_max']),
+                'release_years': group['release_years'],
+            })
+        return result
+
+    return {
+        'segments': build(VehicleStat.DIMENSION_SEGMENT, Segment, 'segment_name'),
+        'brands': build(VehicleStat.DIMENSION_BRAND, Brand, 'brand_name'),
+    }
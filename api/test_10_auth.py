@@ -0,0 +1,198 @@
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.contrib.auth.hashers import get_hasher
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from . import hashers, tokens
+from .authentication import TokenCache, token_cache
+
+CREATE_URL = '/api/create/'
+PROFILE_URL = '/api/profile/'
+TOKEN_URL = '/api/auth/'
+ROTATE_URL = '/api/auth/rotate/'
+
+
+# 認証のキャッシュのテスト
+class CachedTokenAuthenticationTests(TestCase):
+    def setUp(self):
+        token_cache.clear()
+        self.user = get_user_model().objects.create_user(username='dummy', password='dummy_pw')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def get_profile(self):
+        return self.client.get(PROFILE_URL)
+
+    # 2回目以降のリクエストは認証のクエリを実行しない
+    def test_10_1_should_cache_authentication(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get_profile().status_code, status.HTTP_200_OK)
+        with self.assertNumQueries(0):
+            res = self.get_profile()
+        self.assertEqual(res.data['username'], 'dummy')
+
+    # トークンを削除(再発行)すると認証できなくなる
+    def test_10_2_should_invalidate_on_token_delete(self):
+        self.get_profile()
+        self.token.delete()
+        self.assertEqual(self.get_profile().status_code, status.HTTP_401_UNAUTHORIZED)
+
+    # ユーザーを無効化・削除すると認証できなくなる
+    def test_10_3_should_invalidate_on_user_deactivate_and_delete(self):
+        self.get_profile()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get_profile().status_code, status.HTTP_401_UNAUTHORIZED)
+
+        self.user.is_active = True
+        self.user.save()
+        self.get_profile()
+        self.user.delete()
+        self.assertEqual(self.get_profile().status_code, status.HTTP_401_UNAUTHORIZED)
+
+    # ユーザー名の変更はキャッシュ済みのリクエストにも反映される
+    def test_10_4_should_invalidate_on_user_update(self):
+        self.get_profile()
+        self.user.username = 'renamed'
+        self.user.save()
+        self.assertEqual(self.get_profile().data['username'], 'renamed')
+
+    # キャッシュはプロセス間で共有され(別のインスタンスでの無効化が反映され)、有効期間を過ぎたものは返さない
+    def test_10_5_should_share_cache_and_expire(self):
+        worker_a, worker_b = TokenCache(ttl=60), TokenCache(ttl=60)
+        worker_a.set('a', (self.user, self.token))
+        worker_a.set(self.token.key, (self.user, self.token))
+        self.assertEqual(worker_b.get('a')[0].pk, self.user.pk)
+        worker_b.invalidate('a')
+        self.assertIsNone(worker_a.get('a'))
+        worker_b.invalidate_user(self.user.pk)
+        self.assertIsNone(worker_a.get(self.token.key))
+
+        worker_a.set('a', (self.user, self.token))
+        with mock.patch('django.core.cache.backends.locmem.time.time', return_value=time.time() + 61):
+            self.assertIsNone(worker_a.get('a'))
+
+    # 有効期限はオプトインで、デフォルトでは古いトークンも失効しない
+    def test_10_15_should_not_expire_tokens_by_default(self):
+        self.assertEqual(settings.API_TOKEN_TTL, 0)
+        self.assertEqual(tokens.TOKEN_TTL, 0)
+        Token.objects.filter(pk=self.token.pk).update(created=timezone.now() - timedelta(days=365))
+        token_cache.clear()
+        self.assertEqual(self.get_profile().status_code, status.HTTP_200_OK)
+
+
+# トークンの有効期限・再発行・失効のテスト
+@mock.patch('api.tokens.TOKEN_TTL', 60 * 60)
+class TokenExpiryTests(TestCase):
+    def setUp(self):
+        token_cache.clear()
+        self.user = get_user_model().objects.create_user(username='dummy', password='dummy_pw')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def age_tokens(self, seconds, **filters):
+        Token.objects.filter(**filters).update(created=timezone.now() - timedelta(seconds=seconds))
+        token_cache.clear()
+
+    # 期限切れのトークンでは認証できない
+    def test_10_6_should_reject_expired_token(self):
+        self.assertEqual(self.client.get(PROFILE_URL).status_code, status.HTTP_200_OK)
+        self.age_tokens(2 * 60 * 60)
+        res = self.client.get(PROFILE_URL)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(res.data['detail'], 'Token has expired.')
+
+    # スライディング方式では使われたトークンの有効期限が延長される
+    @mock.patch('api.tokens.TOKEN_SLIDING', True)
+    @mock.patch('api.tokens.TOKEN_REFRESH_INTERVAL', 60)
+    def test_10_7_should_refresh_token_when_sliding(self):
+        self.age_tokens(30 * 60)
+        self.assertEqual(self.client.get(PROFILE_URL).status_code, status.HTTP_200_OK)
+        self.token.refresh_from_db()
+        self.assertLess(timezone.now() - self.token.created, timedelta(seconds=60))
+        # 延長の間隔内は書き込みをしない
+        with self.assertNumQueries(0):
+            self.client.get(PROFILE_URL)
+
+    # ログイン時、有効なトークンはそのまま、期限切れのトークンは再発行して返す
+    def test_10_8_should_reissue_expired_token_on_login(self):
+        payload = {'username': 'dummy', 'password': 'dummy_pw'}
+        res = self.client.post(TOKEN_URL, payload)
+        self.assertEqual(res.data['token'], self.token.key)
+        self.assertIsNotNone(res.data['expires'])
+
+        self.age_tokens(2 * 60 * 60)
+        res = self.client.post(TOKEN_URL, payload)
+        self.assertNotEqual(res.data['token'], self.token.key)
+        self.assertFalse(Token.objects.filter(key=self.token.key).exists())
+
+    # トークンを再発行すると古いトークンは使えなくなる
+    def test_10_9_should_rotate_token(self):
+        res = self.client.post(ROTATE_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(PROFILE_URL).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + res.data['token'])
+        self.assertEqual(self.client.get(PROFILE_URL).status_code, status.HTTP_200_OK)
+
+    # コマンドで期限切れのトークンを一括削除し、指定したユーザーのトークンを失効させる
+    def test_10_10_should_purge_and_revoke_tokens(self):
+        users = [get_user_model().objects.create_user(username='user%d' % i, password='pw') for i in range(3)]
+        for user in users:
+            Token.objects.create(user=user)
+        self.age_tokens(2 * 60 * 60, user__in=users[:2])
+
+        out = StringIO()
+        call_command('purge_tokens', '--batch-size', '1', stdout=out)
+        self.assertIn('Deleted 2 tokens', out.getvalue())
+        self.assertCountEqual(Token.objects.values_list('user__username', flat=True), ['dummy', 'user2'])
+
+        call_command('purge_tokens', '--user', 'dummy', stdout=out)
+        self.assertEqual(self.client.get(PROFILE_URL).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(list(Token.objects.values_list('user__username', flat=True)), ['user2'])
+
+    # 期限切れのトークンの検索にインデックスを使う
+    def test_10_11_should_index_token_created(self):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, Token._meta.db_table)
+        self.assertEqual(constraints['api_token_created_idx']['columns'], ['created'])
+
+
+# パスワードのハッシュのテスト
+class PasswordHashingTests(TestCase):
+    # テストランナーは高速なハッシャーを使う
+    def test_10_12_should_use_fast_hasher_in_tests(self):
+        self.assertEqual(get_hasher().algorithm, 'md5')
+
+    # プールでハッシュを計算してユーザー登録・ログインができる
+    @override_settings(PASSWORD_HASHERS=['api.hashers.TunablePBKDF2PasswordHasher'])
+    @mock.patch('api.hashers.HASH_WORKERS', 2)
+    @mock.patch('api.hashers.TunablePBKDF2PasswordHasher.iterations', 1000)
+    def test_10_13_should_hash_in_worker_pool(self):
+        with mock.patch('api.hashers.get_executor', wraps=hashers.get_executor) as executor:
+            res = self.client.post(CREATE_URL, {'username': 'dummy', 'password': 'dummy_pw'})
+            self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+            res = self.client.post(TOKEN_URL, {'username': 'dummy', 'password': 'dummy_pw'})
+            self.assertIn('token', res.data)
+        self.assertEqual(executor.call_count, 2)
+        self.assertTrue(get_user_model().objects.get().password.startswith('pbkdf2_sha256$1000$'))
+
+    # 反復回数を変更すると、ログイン時に新しい回数で再ハッシュされる
+    @override_settings(PASSWORD_HASHERS=['api.hashers.TunablePBKDF2PasswordHasher'])
+    def test_10_14_should_rehash_when_iterations_change(self):
+        with mock.patch('api.hashers.TunablePBKDF2PasswordHasher.iterations', 1000):
+            user = get_user_model().objects.create_user(username='dummy', password='dummy_pw')
+        with mock.patch('api.hashers.TunablePBKDF2PasswordHasher.iterations', 2000):
+            self.client.post(TOKEN_URL, {'username': 'dummy', 'password': 'dummy_pw'})
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith('pbkdf2_sha256$2000$'))
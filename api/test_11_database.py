@@ -0,0 +1,79 @@
+import importlib
+import os
+import threading
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import SimpleTestCase, TransactionTestCase
+from rest_framework import status
+from rest_framework.test import APIClient
+from rest_api import settings as settings_module
+from .models import Segment, Brand, Vehicle
+
+VEHICLES_URL = '/api/vehicles/'
+
+
+# DBの設定(WAL・複数スレッドからの書き込み)のテスト
+class DatabaseConcurrencyTests(TransactionTestCase):
+    threads = 8
+    requests_per_thread = 10
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='dummy', password='dummy_pw')
+        self.segment = Segment.objects.create(segment_name='Sedan')
+        self.brand = Brand.objects.create(brand_name='Tesla')
+
+    # SQLiteはWALで動く
+    def test_11_1_should_use_wal(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite only')
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+
+    # 複数スレッドから同時に作成しても"database is locked"にならない
+    def test_11_2_should_handle_concurrent_writes(self):
+        statuses = []
+        barrier = threading.Barrier(self.threads)
+
+        def create_vehicles(n):
+            client = APIClient()
+            client.force_authenticate(user=self.user)
+            try:
+                barrier.wait()
+                for i in range(self.requests_per_thread):
+                    res = client.post(VEHICLES_URL, {
+                        'vehicle_name': 'car-%d-%d' % (n, i), 'release_year': 2020, 'price': 100,
+                        'segment': self.segment.id, 'brand': self.brand.id,
+                    })
+                    statuses.append(res.status_code)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=create_vehicles, args=(n,)) for n in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(statuses, [status.HTTP_201_CREATED] * self.threads * self.requests_per_thread)
+        self.assertEqual(Vehicle.objects.count(), self.threads * self.requests_per_thread)
+
+
+# 環境変数によるDBの設定のテスト
+class DatabaseSettingsTests(SimpleTestCase):
+    def setUp(self):
+        # 環境変数を変えて読み込み直したsettingsモジュールを最後に元に戻す
+        self.addCleanup(importlib.reload, settings_module)
+
+    def load_settings(self, **environ):
+        with mock.patch.dict(os.environ, environ):
+            return importlib.reload(settings_module)
+
+    # 接続を使い回す秒数はNone(無制限)・空(デフォルト)・数値を指定できる
+    def test_11_3_should_parse_conn_max_age(self):
+        for value, expected in (('None', None), ('none', None), ('', 60), ('0', 0), ('300', 300)):
+            with self.subTest(value=value):
+                settings = self.load_settings(DJANGO_DB_CONN_MAX_AGE=value)
+                self.assertEqual(settings.DB_CONN_MAX_AGE, expected)
+                self.assertEqual(settings.DATABASES['default']['CONN_MAX_AGE'], expected)
@@ -0,0 +1,109 @@
+import shutil
+import time
+from unittest import mock
+import tempfile
+from pathlib import Path
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connections
+from django.test import TransactionTestCase, override_settings
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from .authentication import token_cache
+from .models import Segment
+
+SEGMENTS_URL = '/api/segments/'
+
+
+# 読み取り用レプリカへの振り分けのテスト
+# プライマリ(default)とは別のSQLiteのファイルをレプリカとして使い、どちらから読んだかを内容で確認する
+@override_settings(DATABASE_REPLICAS=['replica'], DATABASE_REPLICA_STICKY_SECONDS=60)
+class ReplicaRouterTests(TransactionTestCase):
+    # replicaはsetUpClassで追加するので、その時点の全てのDBを対象にする
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        cls.replica_dir = tempfile.mkdtemp()
+        connections.databases['replica'] = dict(
+            connections.databases['default'], NAME=str(Path(cls.replica_dir) / 'replica.sqlite3'),
+        )
+        call_command('migrate', database='replica', verbosity=0)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['replica'].close()
+        del connections.databases['replica']
+        shutil.rmtree(cls.replica_dir)
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        # ユーザーとトークンはプライマリから読むので、レプリカには複製しない
+        self.user = get_user_model().objects.create_user(username='dummy', password='dummy_pw')
+        self.token = Token.objects.create(user=self.user)
+        Segment.objects.using('replica').create(segment_name='Replica')
+        self.client = self.client_for(self.token)
+
+    def client_for(self, token):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        return client
+
+    def segment_names(self, client):
+        res = client.get(SEGMENTS_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return [segment['segment_name'] for segment in res.data]
+
+    # 読み取りはレプリカ、書き込みはプライマリに向けられる
+    def test_12_1_should_route_reads_to_replica_and_writes_to_primary(self):
+        self.assertEqual(self.segment_names(self.client), ['Replica'])
+        res = self.client.post(SEGMENTS_URL, {'segment_name': 'Primary'})
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(list(Segment.objects.using('default').values_list('segment_name', flat=True)), ['Primary'])
+        self.assertEqual(list(Segment.objects.using('replica').values_list('segment_name', flat=True)), ['Replica'])
+
+    # 書き込みをしたクライアントはしばらくプライマリから読み、他のクライアントはレプリカから読む
+    # (他のクライアントがレプリカから読んでキャッシュされた古い一覧は、書き込んだクライアントには返らない)
+    def test_12_2_should_read_own_writes(self):
+        other = get_user_model().objects.create_user(username='other', password='dummy_pw')
+        other_token = Token.objects.create(user=other)
+        other_client = self.client_for(other_token)
+
+        self.client.post(SEGMENTS_URL, {'segment_name': 'Primary'})
+        self.assertEqual(self.segment_names(other_client), ['Replica'])
+        self.assertEqual(self.segment_names(self.client), ['Primary'])
+        self.assertEqual(self.segment_names(other_client), ['Replica'])
+
+    # レプリカから読んでキャッシュしたレスポンスは複製の遅延の上限で期限切れになる
+    def test_12_4_should_expire_responses_cached_from_replica(self):
+        self.assertEqual(self.segment_names(self.client), ['Replica'])
+        Segment.objects.using('replica').update(segment_name='Replicated')
+        self.assertEqual(self.segment_names(self.client), ['Replica'])
+        with mock.patch('django.core.cache.backends.locmem.time.time', return_value=time.time() + 61):
+            self.assertEqual(self.segment_names(self.client), ['Replicated'])
+
+    # 一定時間が経つとレプリカからの読み取りに戻り、失敗した書き込みではプライマリに固定されない
+    def test_12_3_should_return_to_replica(self):
+        with override_settings(DATABASE_REPLICA_STICKY_SECONDS=0):
+            self.client.post(SEGMENTS_URL, {'segment_name': 'Primary'})
+        self.assertEqual(self.segment_names(self.client), ['Replica'])
+
+        res = self.client.post(SEGMENTS_URL, {'segment_name': ''})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.segment_names(self.client), ['Replica'])
+
+    # 発行・再発行したばかりのトークンは、レプリカに複製される前でも次の読み取りで使える
+    def test_12_5_should_authenticate_new_tokens_from_primary(self):
+        res = APIClient().post('/api/create/', {'username': 'new', 'password': 'new_pw'})
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        res = APIClient().post('/api/auth/', {'username': 'new', 'password': 'new_pw'})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + res.data['token'])
+        self.assertEqual(self.segment_names(client), ['Replica'])
+        self.assertFalse(get_user_model().objects.using('replica').exists())
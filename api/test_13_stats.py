@@ -0,0 +1,68 @@
+import json
+import re
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from .authentication import token_cache
+from .models import Segment, Brand, Vehicle
+
+VEHICLES_URL = '/api/vehicles/'
+
+
+# リクエストごとの計測(Server-Timing・ログ)のテスト
+class StatsMiddlewareTests(TestCase):
+    def setUp(self):
+        token_cache.clear()
+        self.user = get_user_model().objects.create_user(username='dummy', password='dummy_pw')
+        token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        segment = Segment.objects.create(segment_name='Sedan')
+        brand = Brand.objects.create(brand_name='Tesla')
+        Vehicle.objects.create(user=self.user, segment=segment, brand=brand,
+                               vehicle_name='MODEL S', release_year=2019, price=500)
+
+    def server_timing(self, res):
+        return {
+            name: (float(duration), desc)
+            for name, duration, desc in re.findall(r'(\w+);dur=([\d.]+)(?:;desc="([^"]*)")?', res['Server-Timing'])
+        }
+
+    # Server-Timingヘッダーとログにクエリ数と区間ごとの時間が出る
+    def test_13_1_should_report_server_timing_and_log(self):
+        with self.assertLogs('api.stats', 'INFO') as logs, CaptureQueriesContext(connection) as queries:
+            res = self.client.get(VEHICLES_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        timing = self.server_timing(res)
+        self.assertEqual(list(timing), ['db', 'serializer', 'render', 'auth', 'total'])
+        self.assertEqual(timing['db'][1], '%d queries' % len(queries))
+        self.assertGreater(timing['serializer'][0] + timing['render'][0] + timing['auth'][0], 0)
+
+        data = json.loads(logs.records[0].getMessage())
+        self.assertEqual((data['method'], data['path'], data['status']), ('GET', VEHICLES_URL, 200))
+        self.assertEqual(data['queries'], len(queries))
+        self.assertEqual(set(data), {'method', 'path', 'status', 'queries', 'db_ms', 'serializer_ms',
+                                     'render_ms', 'auth_ms', 'total_ms'})
+
+    # しきい値を超えたSQLを遅い順に指定の件数までログに出す
+    @mock.patch('api.stats.SLOW_SQL_MS', 0.000001)
+    @mock.patch('api.stats.SLOW_SQL_LOG_COUNT', 1)
+    def test_13_2_should_log_slow_sql(self):
+        with self.assertLogs('api.stats', 'INFO') as logs:
+            self.client.get(VEHICLES_URL)
+        slow = [json.loads(record.getMessage()) for record in logs.records if record.levelname == 'WARNING']
+        self.assertEqual(len(slow), 1)
+        self.assertIn('SELECT', slow[0]['sql'])
+        self.assertGreater(slow[0]['sql_ms'], 0)
+
+    # 計測を無効にできる
+    @override_settings(API_STATS=False)
+    def test_13_3_should_disable_stats(self):
+        res = self.client.get(VEHICLES_URL)
+        self.assertNotIn('Server-Timing', res)
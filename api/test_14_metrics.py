@@ -0,0 +1,125 @@
+import glob
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from unittest import mock
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from rest_framework import status
+from rest_framework.test import APIClient
+from .metrics import Registry, collect, render
+from .models import Segment
+
+METRICS_URL = '/metrics'
+
+
+# メトリクス(/metrics)のテスト
+@mock.patch('api.metrics.registry', new_callable=Registry)
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='dummy', password='dummy_pw', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def get_metrics(self):
+        res = self.client.get(METRICS_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(res['Content-Type'].startswith('text/plain; version=0.0.4'))
+        return res.content.decode().splitlines()
+
+    # routerのbasenameやURLの名前ごとにリクエスト数・レイテンシ・サイズ・クエリ数が記録される
+    def test_14_1_should_expose_metrics_by_route(self, registry):
+        segment = Segment.objects.create(segment_name='Sedan')
+        self.client.get('/api/segments/')
+        self.client.get('/api/segments/%s/' % segment.id)
+        self.client.get('/api/vehicles/')
+        self.client.get('/api/profile/')
+        APIClient().post('/api/auth/', {'username': 'dummy', 'password': 'wrong'})
+
+        lines = self.get_metrics()
+        self.assertIn('api_requests_total{method="GET",route="segment",status="200"} 2', lines)
+        self.assertIn('api_requests_total{method="GET",route="vehicle",status="200"} 1', lines)
+        self.assertIn('api_requests_total{method="GET",route="profile",status="200"} 1', lines)
+        self.assertIn('api_requests_total{method="POST",route="auth",status="400"} 1', lines)
+        self.assertIn('api_request_duration_seconds_count{method="GET",route="segment"} 2', lines)
+        self.assertIn('api_request_duration_seconds_bucket{le="+Inf",method="GET",route="segment"} 2', lines)
+        self.assertIn('api_response_size_bytes_count{route="segment"} 2', lines)
+        # /metrics自身のリクエストは処理中
+        self.assertIn('api_requests_in_flight{method="GET"} 1', lines)
+        self.assertIn('# TYPE api_request_duration_seconds histogram', lines)
+        self.assertTrue(any(line.startswith('api_db_queries_total{route="vehicle"} ') for line in lines))
+
+    # ヒストグラムのバケットは累積で、leの順に並ぶ
+    def test_14_2_should_render_cumulative_buckets(self, registry):
+        for value in (0.003, 0.2, 20):
+            registry.observe('api_request_duration_seconds', {'route': 'vehicle', 'method': 'GET'}, value,
+                             (0.01, 1.0))
+        buckets = [line for line in render().splitlines() if line.startswith('api_request_duration_seconds_bucket')]
+        self.assertEqual(buckets, [
+            'api_request_duration_seconds_bucket{le="0.01",method="GET",route="vehicle"} 1',
+            'api_request_duration_seconds_bucket{le="1.0",method="GET",route="vehicle"} 2',
+            'api_request_duration_seconds_bucket{le="+Inf",method="GET",route="vehicle"} 3',
+        ])
+
+    # 複数プロセスの値をファイル経由で合計し、終了したプロセスのゲージは含めない
+    def test_14_3_should_aggregate_processes(self, registry):
+        dead = subprocess.Popen(['true'])
+        dead.wait()
+        with tempfile.TemporaryDirectory() as directory, mock.patch('api.metrics.METRICS_DIR', directory):
+            for pid in (dead.pid, os.getppid()):
+                with open(os.path.join(directory, '%d-1.json' % pid), 'w') as f:
+                    json.dump([
+                        ['api_requests_total', {'route': 'brand', 'method': 'GET', 'status': '200'}, 3],
+                        ['api_requests_in_flight', {'method': 'GET'}, 2],
+                    ], f)
+            registry.inc('api_requests_total', {'route': 'brand', 'method': 'GET', 'status': '200'})
+            totals = collect()
+            self.assertTrue(os.path.exists(registry.path()))
+
+        self.assertEqual(totals[('api_requests_total', (('method', 'GET'), ('route', 'brand'), ('status', '200')))], 7)
+        self.assertEqual(totals[('api_requests_in_flight', (('method', 'GET'),))], 2)
+
+    # リクエストが来なくてもバックグラウンドのスレッドが値を書き出す
+    def test_14_4_should_flush_in_background(self, registry):
+        with tempfile.TemporaryDirectory() as directory, mock.patch('api.metrics.METRICS_DIR', directory), \
+                mock.patch('api.metrics.FLUSH_SECONDS', 0.05):
+            registry.inc('api_requests_total', {'route': 'brand', 'method': 'GET', 'status': '200'}, 5)
+            for _ in range(100):
+                if os.path.exists(registry.path()):
+                    break
+                time.sleep(0.05)
+            with open(registry.path()) as f:
+                samples = json.load(f)
+
+        self.assertEqual(samples, [['api_requests_total', {'method': 'GET', 'route': 'brand', 'status': '200'}, 5]])
+
+    # プロセスの終了時にも最後の値を書き出す
+    def test_14_5_should_flush_at_exit(self, registry):
+        with tempfile.TemporaryDirectory() as directory:
+            env = dict(os.environ, API_METRICS_DIR=directory, API_METRICS_FLUSH_SECONDS='3600')
+            subprocess.run([sys.executable, 'manage.py', 'shell', '-c',
+                            "from api.metrics import registry; registry.inc('api_requests_total', {'route': 'brand'})"],
+                           env=env, check=True, cwd=settings.BASE_DIR)
+            paths = glob.glob(os.path.join(directory, '*.json'))
+            with open(paths[0]) as f:
+                samples = json.load(f)
+
+        self.assertEqual(len(paths), 1)
+        self.assertEqual(samples, [['api_requests_total', {'route': 'brand'}, 1]])
+
+    # スタッフユーザーと許可したアドレス以外には公開しない
+    def test_14_6_should_not_expose_metrics_by_default(self, registry):
+        self.assertEqual(APIClient().get(METRICS_URL).status_code, status.HTTP_401_UNAUTHORIZED)
+        user = get_user_model().objects.create_user(username='other', password='dummy_pw')
+        client = APIClient()
+        client.force_authenticate(user=user)
+        self.assertEqual(client.get(METRICS_URL).status_code, status.HTTP_403_FORBIDDEN)
+        with override_settings(API_METRICS_ALLOWED_IPS=['10.0.0.5']):
+            self.assertEqual(APIClient().get(METRICS_URL, REMOTE_ADDR='10.0.0.5').status_code, status.HTTP_200_OK)
+            self.assertEqual(APIClient().get(METRICS_URL).status_code, status.HTTP_401_UNAUTHORIZED)
+        with override_settings(API_METRICS_PUBLIC=True):
+            self.assertEqual(APIClient().get(METRICS_URL).status_code, status.HTTP_200_OK)
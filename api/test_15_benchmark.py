@@ -0,0 +1,80 @@
+import json
+import os
+import tempfile
+from decimal import Decimal
+from io import StringIO
+from django.contrib.auth import get_user_model
+from django.core.management import call_command, CommandError
+from django.db.models import Count, Max, Min
+from django.test import TestCase
+from .benchmark import percentile, compare
+from .models import Segment, Brand, Vehicle
+
+
+# seed_data/benchmarkコマンドのテスト
+class BenchmarkCommandTests(TestCase):
+    def seed(self, *args):
+        out = StringIO()
+        call_command('seed_data', '--users', '3', '--segments', '12', '--brands', '4', '--vehicles', '300',
+                     *args, stdout=out)
+        return out.getvalue()
+
+    # 指定した件数のデータが、範囲内の値と偏った分布で作られる
+    def test_15_1_should_seed_data(self):
+        self.assertIn('Seeded 3 users, 12 segments, 4 brands and 300 vehicles', self.seed())
+        self.assertEqual(get_user_model().objects.filter(username__startswith='bench_user_').count(), 3)
+        self.assertEqual(Segment.objects.count(), 12)
+        self.assertTrue(Segment.objects.filter(segment_name='Segment 12').exists())
+        self.assertEqual(Vehicle.objects.count(), 300)
+
+        stats = Vehicle.objects.aggregate(Min('price'), Max('price'), Min('release_year'), Max('release_year'))
+        self.assertGreater(stats['price__min'], 0)
+        self.assertLessEqual(stats['price__max'], Decimal('9999.99'))
+        self.assertGreaterEqual(stats['release_year__min'], 2024 - 30)
+        self.assertLessEqual(stats['release_year__max'], 2024)
+        # 1番目のブランドが最も多い
+        counts = dict(Brand.objects.annotate(n=Count('vehicle')).values_list('brand_name', 'n'))
+        self.assertEqual(max(counts, key=counts.get), 'Toyota')
+
+    # 同じseedなら同じデータになる
+    def test_15_2_should_be_reproducible(self):
+        self.seed('--seed', '42')
+        first = list(Vehicle.objects.order_by('id').values_list('vehicle_name', 'release_year', 'price'))
+        self.seed('--seed', '42', '--clear')
+        second = list(Vehicle.objects.order_by('id').values_list('vehicle_name', 'release_year', 'price'))
+        self.assertEqual(first, second)
+        self.assertEqual(Segment.objects.count(), 12)
+        # --clearなしで再実行すると作成済みのデータを残したままエラーになる
+        with self.assertRaisesMessage(CommandError, 'Pass --clear'):
+            self.seed('--seed', '42')
+        self.assertEqual(Vehicle.objects.count(), 300)
+        # 発売年の基準は実行した年によらず、--base-yearで変えられる
+        self.seed('--seed', '42', '--clear', '--base-year', '2000')
+        self.assertLessEqual(Vehicle.objects.aggregate(Max('release_year'))['release_year__max'], 2000)
+
+    # プロセス内でシナリオを実行し、比較できるJSONを出力する
+    def test_15_3_should_run_benchmark(self):
+        self.seed()
+        fd, path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        out = StringIO()
+        call_command('benchmark', '--requests', '3', '--warmup', '1', '--writes', '--output', path, stdout=out)
+
+        with open(path) as f:
+            results = json.load(f)
+        self.assertEqual(results['meta']['mode'], 'in-process')
+        self.assertEqual(results['meta']['dataset']['vehicles'], 300)
+        vehicle_list = results['results']['vehicle-list']
+        self.assertEqual((vehicle_list['requests'], vehicle_list['errors']), (3, 0))
+        self.assertLessEqual(vehicle_list['p50_ms'], vehicle_list['p99_ms'])
+        self.assertGreater(vehicle_list['queries_per_request'], 0)
+        self.assertEqual(results['results']['vehicle-create']['errors'], 0)
+        self.assertEqual(compare(results, results)['vehicle-list'], 0)
+
+    # パーセンタイルは線形補間で計算する
+    def test_15_4_should_calculate_percentiles(self):
+        values = [1, 2, 3, 4]
+        self.assertEqual(percentile(values, 50), 2.5)
+        self.assertEqual(percentile(values, 99), 3.97)
+        self.assertEqual(percentile([5], 95), 5)
@@ -0,0 +1,66 @@
+import os
+import pstats
+import re
+import tempfile
+import time
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from .authentication import token_cache
+from .profiling import SamplingProfiler
+
+VEHICLES_URL = '/api/vehicles/'
+
+
+# リクエストのプロファイルのテスト
+class ProfilingMiddlewareTests(TestCase):
+    def setUp(self):
+        token_cache.clear()
+        self.staff = get_user_model().objects.create_user(username='staff', password='dummy_pw', is_staff=True)
+        self.user = get_user_model().objects.create_user(username='dummy', password='dummy_pw')
+
+    def client_for(self, user):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=user).key)
+        return client
+
+    # スタッフユーザーはcProfileの結果を受け取れる
+    def test_16_1_should_return_cprofile_for_staff(self):
+        res = self.client_for(self.staff).get(VEHICLES_URL, {'profile': 'cprofile'})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(res['Content-Type'].startswith('text/plain'))
+        self.assertIn('function calls', res.content.decode())
+        self.assertIn('cumulative', res.content.decode())
+
+    # ヘッダーでサンプリングプロファイラーを指定でき、結果はcollapsed stacks形式
+    @mock.patch('api.profiling.SAMPLE_INTERVAL', 0.0001)
+    def test_16_2_should_return_collapsed_stacks(self):
+        res = self.client_for(self.staff).get(VEHICLES_URL, HTTP_X_PROFILE='sampling')
+        self.assertTrue(res['Content-Type'].startswith('text/plain'))
+        for line in res.content.decode().splitlines():
+            self.assertRegex(line, r'^\S.* \d+$')
+
+    # スタッフ以外はプロファイルされず、通常のレスポンスになる
+    def test_16_3_should_ignore_non_staff(self):
+        res = self.client_for(self.user).get(VEHICLES_URL, {'profile': '1'})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, [])
+
+    # API_PROFILE_DIRが設定されていればpstatsのファイルに保存し、通常のレスポンスを返す
+    def test_16_4_should_store_profile(self):
+        with tempfile.TemporaryDirectory() as directory, mock.patch('api.profiling.PROFILE_DIR', directory):
+            res = self.client_for(self.staff).get(VEHICLES_URL, {'profile': 'cprofile'})
+            self.assertEqual(res.data, [])
+            self.assertRegex(res['X-Profile-File'], r'^\d{8}-\d{6}-GET-api_vehicles\.prof$')
+            stats = pstats.Stats(os.path.join(directory, res['X-Profile-File']))
+        self.assertGreater(stats.total_calls, 0)
+
+    # サンプリングプロファイラーは対象スレッドのスタックを記録する
+    def test_16_5_should_sample_stacks(self):
+        with SamplingProfiler(interval=0.001) as profiler:
+            time.sleep(0.05)
+        self.assertTrue(any(re.search(r';test_16_5_should_sample_stacks \(test_16_profiling\.py:\d+\)$', stack)
+                            for stack in profiler.stacks))
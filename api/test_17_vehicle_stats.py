@@ -0,0 +1,226 @@
+from decimal import Decimal
+from io import StringIO
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import Count, Max, Min, Sum
+from django.db.models.signals import pre_delete
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+from rest_framework.test import APIClient
+from .models import Segment, Vehicle, VehicleStat
+from .signals import post_bulk_update
+from .test_4_vehicle import create_segment, create_brand, create_vehicle, detail_vehicle_url, detail_seg_url
+
+STATS_URL = '/api/vehicles/stats/'
+BULK_VEHICLES_URL = '/api/vehicles/bulk/'
+
+
+# Vehicleから直接集計した値(集計テーブルの期待値)
+def expected_stats():
+    rows = set()
+    for dimension, field in (('segment', 'segment_id'), ('brand', 'brand_id')):
+        for row in Vehicle.objects.order_by().values(field, 'release_year').annotate(
+                count=Count('id'), price_sum=Sum('price'), price_min=Min('price'), price_max=Max('price')):
+            rows.add((dimension, row[field], row['release_year'], row['count'],
+                      row['price_sum'], row['price_min'], row['price_max']))
+    return rows
+
+
+def current_stats():
+    return set(VehicleStat.objects.values_list(
+        'dimension', 'group_id', 'release_year', 'count', 'price_sum', 'price_min', 'price_max',
+    ))
+
+
+# /api/vehicles/stats/ と集計テーブルの差分更新のテスト
+class VehicleStatsTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='dummy', password='dummy_pw')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.sedan = create_segment(segment_name='Sedan')
+        self.suv = create_segment(segment_name='SUV')
+        self.tesla = create_brand(brand_name='Tesla')
+        self.toyota = create_brand(brand_name='Toyota')
+
+    def assert_stats_consistent(self):
+        self.assertEqual(current_stats(), expected_stats())
+
+    # Segment/Brandごとの台数・平均/最小/最大価格・発売年ごとの台数を返す
+    def test_17_1_should_get_stats_per_segment_and_brand(self):
+        create_vehicle(user=self.user, segment=self.sedan, brand=self.tesla, release_year=2019, price=500)
+        create_vehicle(user=self.user, segment=self.sedan, brand=self.toyota, release_year=2020, price=300.5)
+        create_vehicle(user=self.user, segment=self.suv, brand=self.tesla, release_year=2019, price=800)
+        res = self.client.get(STATS_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['segments'], [
+            {'id': self.sedan.id, 'segment_name': 'Sedan', 'count': 2, 'price_avg': '400.25',
+             'price_min': '300.50', 'price_max': '500.00',
+             'release_years': [{'release_year': 2019, 'count': 1}, {'release_year': 2020, 'count': 1}]},
+            {'id': self.suv.id, 'segment_name': 'SUV', 'count': 1, 'price_avg': '800.00',
+             'price_min': '800.00', 'price_max': '800.00',
+             'release_years': [{'release_year': 2019, 'count': 1}]},
+        ])
+        self.assertEqual(res.data['brands'][0]['count'], 2)
+        self.assertEqual(res.data['brands'][0]['release_years'], [{'release_year': 2019, 'count': 2}])
+        self.assertEqual(res.data['brands'][1]['price_avg'], '300.50')
+        self.assert_stats_consistent()
+
+    # Vehicleのないグループは台数0で返す
+    def test_17_2_should_return_empty_groups(self):
+        res = self.client.get(STATS_URL)
+        self.assertEqual(res.data['segments'][0], {
+            'id': self.sedan.id, 'segment_name': 'Sedan', 'count': 0, 'price_avg': None,
+            'price_min': None, 'price_max': None, 'release_years': [],
+        })
+
+    # 更新でグループ・発売年・価格が変わると、変更前と変更後の両方に反映される(最小・最大も)
+    def test_17_3_should_update_stats_on_vehicle_update(self):
+        cheap = create_vehicle(user=self.user, segment=self.sedan, brand=self.tesla, price=100)
+        create_vehicle(user=self.user, segment=self.sedan, brand=self.tesla, price=500)
+        res = self.client.patch(detail_vehicle_url(cheap.id), {'price': '900.00'})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        stat = VehicleStat.objects.get(dimension='segment', group_id=self.sedan.id, release_year=2019)
+        self.assertEqual((stat.count, stat.price_min, stat.price_max), (2, Decimal('500.00'), Decimal('900.00')))
+        res = self.client.patch(detail_vehicle_url(cheap.id), {'segment': self.suv.id, 'release_year': 2021})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assert_stats_consistent()
+        # .only()で価格などを読み込まずに保存した場合も反映される
+        vehicle = Vehicle.objects.only('id', 'vehicle_name').get(pk=cheap.id)
+        vehicle.vehicle_name = 'RENAMED'
+        vehicle.save(update_fields=['vehicle_name'])
+        Vehicle.objects.only('id').get(pk=cheap.id).delete()
+        self.assert_stats_consistent()
+
+    # 削除で台数が0になった発売年の行は消える
+    def test_17_4_should_update_stats_on_vehicle_delete(self):
+        vehicle = create_vehicle(user=self.user, segment=self.sedan, brand=self.tesla, price=100)
+        create_vehicle(user=self.user, segment=self.sedan, brand=self.toyota, price=200, release_year=2020)
+        res = self.client.delete(detail_vehicle_url(vehicle.id))
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(VehicleStat.objects.filter(dimension='brand', group_id=self.tesla.id).exists())
+        self.assert_stats_consistent()
+
+    # 一括作成・更新・削除も反映される
+    def test_17_5_should_update_stats_on_bulk_operations(self):
+        data = [
+            {'vehicle_name': 'CAR %d' % i, 'release_year': 2018 + i % 3, 'price': '%d.50' % (100 + i),
+             'segment': self.sedan.id if i % 2 else self.suv.id, 'brand': self.tesla.id}
+            for i in range(10)
+        ]
+        res = self.client.post(BULK_VEHICLES_URL, data, format='json')
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assert_stats_consistent()
+        ids = [item['id'] for item in res.data]
+        res = self.client.patch(BULK_VEHICLES_URL, [
+            {'id': pk, 'brand': self.toyota.id, 'price': '999.00'} for pk in ids[:4]
+        ], format='json')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assert_stats_consistent()
+        res = self.client.delete(BULK_VEHICLES_URL, ids[3:7], format='json')
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        self.assert_stats_consistent()
+
+    # Segmentの削除によるカスケード削除では、Brand側の集計も作り直される
+    def test_17_6_should_update_stats_on_cascade_delete(self):
+        create_vehicle(user=self.user, segment=self.sedan, brand=self.tesla, price=100)
+        create_vehicle(user=self.user, segment=self.suv, brand=self.tesla, price=300)
+        create_vehicle(user=self.user, segment=self.sedan, brand=self.toyota, price=200)
+        res = self.client.delete(detail_seg_url(self.sedan.id))
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(VehicleStat.objects.filter(dimension='segment', group_id=self.sedan.id).exists())
+        self.assert_stats_consistent()
+        self.toyota.delete()
+        self.tesla.delete()
+        self.assertFalse(VehicleStat.objects.exists())
+
+    # 取得のクエリ数はVehicleの件数によらない
+    def test_17_7_should_get_stats_without_scanning_vehicles(self):
+        create_vehicle(user=self.user, segment=self.sedan, brand=self.tesla)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(STATS_URL)
+        for year in range(2000, 2020):
+            create_vehicle(user=self.user, segment=self.suv, brand=self.toyota, release_year=year)
+        with CaptureQueriesContext(connection) as many:
+            res = self.client.get(STATS_URL)
+        self.assertEqual(len(few), len(many))
+        self.assertFalse(any('"api_vehicle"' in query['sql'] for query in many.captured_queries))
+        self.assertEqual(res.data['segments'][1]['count'], 20)
+
+    # ?group_by= で一方だけ取得でき、不正な値は400
+    def test_17_8_should_filter_stats_by_group(self):
+        res = self.client.get(STATS_URL, {'group_by': 'brand'})
+        self.assertEqual(list(res.data), ['brands'])
+        res = self.client.get(STATS_URL, {'group_by': 'user'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    # 未認証では取得できない
+    def test_17_9_should_not_get_stats_unauthorized(self):
+        res = APIClient().get(STATS_URL)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    # SQLで直接更新した場合はrebuild_vehicle_statsコマンドで作り直せる
+    def test_17_10_should_rebuild_stats_by_command(self):
+        vehicle = create_vehicle(user=self.user, segment=self.sedan, brand=self.tesla, price=100)
+        Vehicle.objects.filter(pk=vehicle.pk).update(price=250)
+        self.assertNotEqual(current_stats(), expected_stats())
+        out = StringIO()
+        call_command('rebuild_vehicle_stats', stdout=out)
+        self.assertIn('Rebuilt 2 stat rows', out.getvalue())
+        self.assert_stats_consistent()
+
+    # 一括削除では集計テーブルのクエリ数が削除する件数によらない
+    def test_17_11_should_not_recompute_stats_per_deleted_vehicle(self):
+        def delete_vehicles(count):
+            ids = [create_vehicle(user=self.user, segment=self.sedan, brand=self.tesla, price=100 + i).id
+                   for i in range(count)]
+            with CaptureQueriesContext(connection) as context:
+                res = self.client.delete(BULK_VEHICLES_URL, ids, format='json')
+            self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+            self.assert_stats_consistent()
+            return [query for query in context.captured_queries if 'api_vehiclestat' in query['sql']]
+
+        self.assertEqual(len(delete_vehicles(50)), len(delete_vehicles(5)))
+        create_vehicle(user=self.user, segment=self.suv, brand=self.toyota, price=300)
+        vehicles = [create_vehicle(user=self.user, segment=self.suv, brand=self.toyota, price=100 + i)
+                    for i in range(3)]
+        res = self.client.delete(BULK_VEHICLES_URL, [vehicle.id for vehicle in vehicles], format='json')
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        self.assert_stats_consistent()
+
+    # seed_data --clearでもVehicleごとに集計し直さない
+    def test_17_12_should_clear_stats_with_seed_data(self):
+        for i in range(20):
+            create_vehicle(user=self.user, segment=self.sedan, brand=self.tesla, price=100 + i)
+        with CaptureQueriesContext(connection) as context:
+            call_command('seed_data', '--clear', '--vehicles', '0', stdout=StringIO())
+        self.assertLess(len([query for query in context.captured_queries if 'api_vehiclestat' in query['sql']]), 10)
+        self.assertFalse(VehicleStat.objects.exists())
+
+    # bulk_updateに同じVehicleが複数回渡されても差分は1回だけ反映される
+    def test_17_13_should_update_stats_once_per_vehicle_on_bulk_update(self):
+        vehicle = create_vehicle(user=self.user, segment=self.sedan, brand=self.tesla, price=100)
+        vehicle.segment = self.suv
+        Vehicle.objects.bulk_update([vehicle, vehicle], ['segment'])
+        post_bulk_update.send(sender=Vehicle, instances=[vehicle, vehicle])
+        self.assertEqual(VehicleStat.objects.get(dimension='segment', group_id=self.suv.id).count, 1)
+        self.assert_stats_consistent()
+
+    # Segmentの削除が失敗してもカスケード削除の状態が残らず、以降のVehicleの削除が反映される
+    def test_17_14_should_reset_cascade_state_after_failed_delete(self):
+        vehicle = create_vehicle(user=self.user, segment=self.sedan, brand=self.tesla, price=100)
+        create_vehicle(user=self.user, segment=self.sedan, brand=self.toyota, price=200)
+
+        def fail(sender, instance, **kwargs):
+            raise RuntimeError('delete failed')
+
+        pre_delete.connect(fail, sender=Segment)
+        self.addCleanup(pre_delete.disconnect, fail, sender=Segment)
+        for delete in (self.sedan.delete, Segment.objects.filter(pk=self.sedan.pk).delete):
+            with self.subTest(delete=delete), self.assertRaises(RuntimeError), transaction.atomic():
+                delete()
+        pre_delete.disconnect(fail, sender=Segment)
+        vehicle.delete()
+        self.assert_stats_consistent()
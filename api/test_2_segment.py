@@ -93,6 +93,31 @@ class AuthorizedSegmentApiTests(TestCase):
         self.client.delete(url)
         self.assertEqual(0, Segment.objects.count())
 
+    # page_sizeを指定した場合のみページネーションされることの確認
+    def test_2_9_should_paginate_segments_only_when_requested(self):
+        for name in ['SUV', 'Sedan', 'K-Car']:
+            create_segment(segment_name=name)
+        res = self.client.get(SEGMENTS_URL)
+        self.assertEqual(len(res.data), 3)
+
+        res = self.client.get(SEGMENTS_URL, {'page_size': 2})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([s['segment_name'] for s in res.data['results']], ['SUV', 'Sedan'])
+        self.assertIsNotNone(res.data['next'])
+
+    # キャッシュから返す場合もETagが一致すれば304が返ることの確認
+    def test_2_10_should_respond_not_modified_by_etag(self):
+        segment = create_segment(segment_name='SUV')
+        etag = self.client.get(SEGMENTS_URL)['ETag']
+        with self.assertNumQueries(0):
+            res = self.client.get(SEGMENTS_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.client.patch(detail_url(segment.id), {'segment_name': 'Compact SUV'})
+        res = self.client.get(SEGMENTS_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data[0]['segment_name'], 'Compact SUV')
+
 
 # Token未承認ユーザーでのAPIアクセスのテスト
 class UnauthorizedSegmentApiTests(TestCase):
@@ -1,8 +1,12 @@
+import tempfile
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.cache.backends.filebased import FileBasedCache
 from django.urls import reverse
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from rest_framework import status
 from rest_framework.test import APIClient
+from .cache import get_version, version_key
 from .models import Brand
 from .serializers import BrandSerializer
 
@@ -93,6 +97,69 @@ class AuthorizedBrandApiTests(TestCase):
         self.assertEqual(0, Brand.objects.count())
 
 
+# Brandのレスポンスキャッシュのテスト
+class BrandCacheApiTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(username='dummy', password='dummy_pw')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    # 2回目以降の一覧・詳細取得はDBにアクセスしない
+    def test_3_9_should_get_brands_from_cache(self):
+        brand = create_brand(brand_name='Toyota')
+        res = self.client.get(BRANDS_URL)
+        with self.assertNumQueries(0):
+            cached = self.client.get(BRANDS_URL)
+        self.assertEqual(cached.status_code, status.HTTP_200_OK)
+        self.assertEqual(cached.data, res.data)
+
+        res = self.client.get(detail_url(brand.id))
+        with self.assertNumQueries(0):
+            cached = self.client.get(detail_url(brand.id))
+        self.assertEqual(cached.data, res.data)
+
+    # APIでの更新・削除後はすぐに新しい内容が返る
+    def test_3_10_should_invalidate_cache_on_api_write(self):
+        brand = create_brand(brand_name='Toyota')
+        self.client.get(BRANDS_URL)
+        self.client.get(detail_url(brand.id))
+        self.client.patch(detail_url(brand.id), {'brand_name': 'Lexus'})
+        self.assertEqual(self.client.get(BRANDS_URL).data[0]['brand_name'], 'Lexus')
+        self.assertEqual(self.client.get(detail_url(brand.id)).data['brand_name'], 'Lexus')
+
+        self.client.delete(detail_url(brand.id))
+        self.assertEqual(self.client.get(BRANDS_URL).data, [])
+        res = self.client.get(detail_url(brand.id))
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    # 管理画面などAPI以外からの更新でもキャッシュが無効化される
+    def test_3_11_should_invalidate_cache_on_model_save(self):
+        brand = create_brand(brand_name='Toyota')
+        self.client.get(BRANDS_URL)
+        brand.brand_name = 'Lexus'
+        brand.save()
+        self.assertEqual(self.client.get(BRANDS_URL).data[0]['brand_name'], 'Lexus')
+
+    # ファイルベースのキャッシュでは、別プロセスのワーカーともキャッシュとバージョンが共有される
+    def test_3_12_should_share_cache_between_workers(self):
+        with tempfile.TemporaryDirectory() as location:
+            backend = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location}
+            with override_settings(CACHES={'default': backend}):
+                # 別ワーカーから同じ場所を参照するキャッシュ
+                other_worker = FileBasedCache(location, {})
+                brand = create_brand(brand_name='Toyota')
+                self.client.get(BRANDS_URL)
+                version = other_worker.get(version_key(Brand))
+                self.assertEqual(version, get_version(Brand))
+
+                brand.brand_name = 'Lexus'
+                brand.save()
+                self.assertGreater(other_worker.get(version_key(Brand)), version)
+                res = self.client.get(BRANDS_URL)
+                self.assertEqual(res.data[0]['brand_name'], 'Lexus')
+
+
 # Token未承認ユーザーでのAPIアクセスのテスト
 class UnauthorizedBrandApiTests(TestCase):
     def setUp(self):
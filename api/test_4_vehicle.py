@@ -1,15 +1,32 @@
+import csv
+import datetime
+import io
+import json
+import unittest
+from unittest import mock
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.urls import reverse
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from rest_framework import status
-from rest_framework.test import APIClient
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework.request import Request
 from .models import Vehicle, Brand, Segment
-from .serializers import VehicleSerializer
+from .renderers import FastJSONRenderer, msgpack
+from .serializers import VehicleSerializer, FastVehicleSerializer, SegmentSerializer, BrandSerializer
+from .views import VehicleViewSet
 from decimal import Decimal
 
 SEGMENTS_URL = '/api/segments/'
 BRANDS_URL = '/api/brands/'
 VEHICLES_URL = '/api/vehicles/'
+BULK_VEHICLES_URL = '/api/vehicles/bulk/'
+EXPORT_VEHICLES_URL = '/api/vehicles/export/'
+BOOTSTRAP_URL = '/api/bootstrap/'
 
 
 # segmentを作成する関数
@@ -178,6 +195,517 @@ class AuthorizedVehicleApiTests(TestCase):
         self.client.delete(url)
         self.assertEqual(0, Vehicle.objects.count())
 
+    # 件数に関わらずVehicle一覧取得のクエリ数が一定であること(N+1が起きない)の確認
+    # (一覧はETag/Last-Modified計算用の集計クエリ + 取得クエリの2回)
+    def test_4_11_should_get_vehicles_with_fixed_number_of_queries(self):
+        segment = create_segment(segment_name='Sedan')
+        brand = create_brand(brand_name='Tesla')
+        create_vehicle(user=self.user, segment=segment, brand=brand)
+        with self.assertNumQueries(2):
+            self.client.get(VEHICLES_URL)
+
+        for i in range(20):
+            create_vehicle(user=self.user, segment=create_segment(segment_name='SUV%d' % i),
+                           brand=create_brand(brand_name='Brand%d' % i))
+        with self.assertNumQueries(2):
+            res = self.client.get(VEHICLES_URL)
+        self.assertEqual(len(res.data), 21)
+        self.assertEqual(res.data[-1]['segment_name'], 'SUV19')
+        self.assertEqual(res.data[-1]['brand_name'], 'Brand19')
+
+        vehicle = Vehicle.objects.last()
+        with self.assertNumQueries(1):
+            self.client.get(detail_vehicle_url(vehicle.id))
+
+    # page_sizeを指定した場合はカーソルでページ送りできることの確認
+    def test_4_12_should_paginate_vehicles_by_cursor(self):
+        segment = create_segment(segment_name='Sedan')
+        brand = create_brand(brand_name='Tesla')
+        vehicles = [create_vehicle(user=self.user, segment=segment, brand=brand) for _ in range(5)]
+
+        res = self.client.get(VEHICLES_URL, {'page_size': 2})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([v['id'] for v in res.data['results']], [vehicles[0].id, vehicles[1].id])
+        self.assertIsNone(res.data['previous'])
+
+        # nextのURLをたどって最後のページまで取得する
+        res = self.client.get(res.data['next'])
+        self.assertEqual([v['id'] for v in res.data['results']], [vehicles[2].id, vehicles[3].id])
+        res = self.client.get(res.data['next'])
+        self.assertEqual([v['id'] for v in res.data['results']], [vehicles[4].id])
+        self.assertIsNone(res.data['next'])
+
+        # previousで前のページに戻れる
+        res = self.client.get(res.data['previous'])
+        self.assertEqual([v['id'] for v in res.data['results']], [vehicles[2].id, vehicles[3].id])
+
+    # 並び替えできる全てのフィールドでカーソルによるページ送りができる
+    def test_4_13_should_paginate_vehicles_by_cursor_with_ordering(self):
+        other = get_user_model().objects.create_user(username='other', password='dummy_pw')
+        segments = [create_segment(segment_name='Sedan'), create_segment(segment_name='SUV')]
+        brands = [create_brand(brand_name='Tesla'), create_brand(brand_name='Toyota')]
+        for i in range(5):
+            create_vehicle(user=(self.user, other)[i % 2], segment=segments[i % 2], brand=brands[i // 3],
+                           release_year=2015 + i, price=100 * (5 - i))
+        for field in VehicleViewSet.ordering_fields:
+            for ordering in (field, '-' + field):
+                ids = []
+                url, params = VEHICLES_URL, {'ordering': ordering, 'page_size': 2}
+                while url:
+                    res = self.client.get(url, params)
+                    self.assertEqual(res.status_code, status.HTTP_200_OK, ordering)
+                    ids += [v['id'] for v in res.data['results']]
+                    url, params = res.data['next'], None
+                self.assertCountEqual(ids, Vehicle.objects.values_list('id', flat=True), ordering)
+
+    # ETagが一致すれば304が返り、更新後は200で新しい内容が返ることの確認
+    def test_4_14_should_respond_not_modified_by_etag(self):
+        segment = create_segment(segment_name='Sedan')
+        brand = create_brand(brand_name='Tesla')
+        vehicle = create_vehicle(user=self.user, segment=segment, brand=brand)
+        res = self.client.get(VEHICLES_URL)
+        etag = res['ETag']
+        res = self.client.get(VEHICLES_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # 一覧に含まれるbrand_nameが変わった場合もETagが変わる
+        brand.brand_name = 'TESLA'
+        brand.save()
+        res = self.client.get(VEHICLES_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(res['ETag'], etag)
+
+        # 詳細も同様に304を返す
+        url = detail_vehicle_url(vehicle.id)
+        etag = self.client.get(url)['ETag']
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.client.patch(url, {'vehicle_name': 'MODEL X'})
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['vehicle_name'], 'MODEL X')
+
+        # 削除した場合もETagが変わる
+        etag = self.client.get(VEHICLES_URL)['ETag']
+        self.client.delete(url)
+        res = self.client.get(VEHICLES_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    # Last-Modified以降に変更がなければIf-Modified-Sinceで304が返ることの確認
+    def test_4_15_should_respond_not_modified_by_last_modified(self):
+        segment = create_segment(segment_name='Sedan')
+        brand = create_brand(brand_name='Tesla')
+        create_vehicle(user=self.user, segment=segment, brand=brand)
+        res = self.client.get(VEHICLES_URL)
+        last_modified = res['Last-Modified']
+        res = self.client.get(VEHICLES_URL, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+        res = self.client.get(VEHICLES_URL, HTTP_IF_MODIFIED_SINCE='Mon, 01 Jan 2001 00:00:00 GMT')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    # 削除した後はIf-Modified-Sinceだけでも304にならない
+    def test_4_16_should_not_respond_not_modified_after_delete(self):
+        segment = create_segment(segment_name='Sedan')
+        brand = create_brand(brand_name='Tesla')
+        vehicles = [create_vehicle(user=self.user, segment=segment, brand=brand) for _ in range(2)]
+        # 削除より前の時刻に更新されたことにする(Last-Modifiedは秒単位のため)
+        past = timezone.now() - datetime.timedelta(minutes=5)
+        for model in (Segment, Brand, Vehicle):
+            model.objects.update(updated_at=past)
+        last_modified = self.client.get(VEHICLES_URL)['Last-Modified']
+        res = self.client.get(VEHICLES_URL, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.client.delete(detail_vehicle_url(vehicles[0].id))
+        res = self.client.get(VEHICLES_URL, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data), 1)
+        res = self.client.get(VEHICLES_URL, HTTP_IF_MODIFIED_SINCE=res['Last-Modified'])
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    # 一覧の検証子は絞り込んだ一覧を集計せず、インデックスの先頭を読む1クエリで計算する
+    def test_4_17_should_compute_list_validators_without_aggregating_rows(self):
+        segment = create_segment(segment_name='Sedan')
+        brand = create_brand(brand_name='Tesla')
+        for _ in range(3):
+            create_vehicle(user=self.user, segment=segment, brand=brand)
+        url = VEHICLES_URL + '?page_size=2&segment=%s' % segment.id
+        etag = self.client.get(url)['ETag']
+        with CaptureQueriesContext(connection) as context:
+            res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(len(context.captured_queries), 1)
+        sql = context.captured_queries[0]['sql']
+        self.assertNotIn('COUNT(', sql)
+        self.assertNotIn('"segment_id" =', sql)
+
+        # 空になった一覧でも削除後はLast-Modifiedが返る
+        Vehicle.objects.all().delete()
+        res = self.client.get(VEHICLES_URL)
+        self.assertEqual(res.data, [])
+        self.assertTrue(res.has_header('Last-Modified'))
+
+
+# Vehicleの一括作成・更新・削除のテスト
+class BulkVehicleApiTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='dummy', password='dummy_pw')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.segment = create_segment(segment_name='Sedan')
+        self.brand = create_brand(brand_name='Tesla')
+
+    def payload(self, count):
+        return [{
+            'vehicle_name': 'MODEL %d' % i,
+            'release_year': 2019,
+            'price': '500.12',
+            'segment': self.segment.id,
+            'brand': self.brand.id,
+        } for i in range(count)]
+
+    # 件数に関わらず一定のクエリ数で一括作成され、ログインユーザーが割り当てられる
+    def test_4_18_should_bulk_create_vehicles(self):
+        # 外部キーの確認(segment, brand)と一括INSERTの3回 + 変更履歴のINSERT
+        # + トランザクション(SAVEPOINT)の開始・終了
+        # + 集計テーブル(segment/brandの2行)の更新と作成(更新対象がないので一括INSERT)とそのSAVEPOINT 7回
+        # + (SQLiteのみ)作成した行のidの取得とそのSAVEPOINT 3回
+        expected = 16 if connection.vendor == 'sqlite' else 13
+        with self.assertNumQueries(expected):
+            res = self.client.post(BULK_VEHICLES_URL, self.payload(50), format='json')
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(res.data), 50)
+        # 作成した行のidが作成した順に返る
+        ids = [item['id'] for item in res.data]
+        self.assertEqual(ids, list(Vehicle.objects.order_by('id').values_list('id', flat=True)))
+        self.assertEqual(Vehicle.objects.get(pk=ids[49]).vehicle_name, 'MODEL 49')
+        self.assertEqual(res.data[0]['segment_name'], 'Sedan')
+        self.assertEqual(Vehicle.objects.filter(user=self.user).count(), 50)
+        self.assertEqual(Vehicle.objects.get(vehicle_name='MODEL 49').price, Decimal('500.12'))
+
+    # バリデーションエラーは配列の位置ごとに返り、1件も作成されない
+    def test_4_19_should_not_bulk_create_vehicles_invalid(self):
+        payload = self.payload(3)
+        payload[1]['segment'] = 9999
+        payload[2]['release_year'] = ''
+        res = self.client.post(BULK_VEHICLES_URL, payload, format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data[0], {})
+        self.assertIn('segment', res.data[1])
+        self.assertIn('release_year', res.data[2])
+        self.assertEqual(Vehicle.objects.count(), 0)
+
+        res = self.client.post(BULK_VEHICLES_URL, [], format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    # PUT/PATCHでidを指定して一括更新できる
+    def test_4_20_should_bulk_update_vehicles(self):
+        v1 = create_vehicle(user=self.user, segment=self.segment, brand=self.brand)
+        v2 = create_vehicle(user=self.user, segment=self.segment, brand=self.brand)
+        suv = create_segment(segment_name='SUV')
+        payload = [{'id': v1.id, 'vehicle_name': 'MODEL X'}, {'id': v2.id, 'segment': suv.id, 'price': '650.00'}]
+        res = self.client.patch(BULK_VEHICLES_URL, payload, format='json')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data[1]['segment_name'], 'SUV')
+        v1.refresh_from_db()
+        v2.refresh_from_db()
+        self.assertEqual(v1.vehicle_name, 'MODEL X')
+        self.assertEqual(v2.segment, suv)
+        self.assertEqual(v2.price, Decimal('650.00'))
+
+        # PUTでは全項目が必須、存在しないidは位置ごとのエラー
+        payload = [{'id': v1.id, 'vehicle_name': 'MODEL 3'}, {'id': 9999, **self.payload(1)[0]}]
+        res = self.client.put(BULK_VEHICLES_URL, payload, format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('release_year', res.data[0])
+        self.assertIn('id', res.data[1])
+        v1.refresh_from_db()
+        self.assertEqual(v1.vehicle_name, 'MODEL X')
+
+        # 同じidを複数回指定すると2回目以降の位置がエラーになる
+        payload = [{'id': v2.id, 'segment': self.segment.id}, {'id': v1.id}, {'id': v2.id, 'segment': self.segment.id}]
+        res = self.client.patch(BULK_VEHICLES_URL, payload, format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data[:2], [{}, {}])
+        self.assertIn('id', res.data[2])
+        v2.refresh_from_db()
+        self.assertEqual(v2.segment, suv)
+
+    # idの配列で一括削除できる
+    def test_4_21_should_bulk_delete_vehicles(self):
+        vehicles = [create_vehicle(user=self.user, segment=self.segment, brand=self.brand) for _ in range(3)]
+        res = self.client.delete(BULK_VEHICLES_URL, [vehicles[0].id, 9999], format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data[0], {})
+        self.assertIn('id', res.data[1])
+        self.assertEqual(Vehicle.objects.count(), 3)
+
+        res = self.client.delete(BULK_VEHICLES_URL, [vehicles[0].id, vehicles[2].id], format='json')
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(list(Vehicle.objects.values_list('id', flat=True)), [vehicles[1].id])
+
+
+# Vehicleのストリーミングエクスポートのテスト
+class ExportVehicleApiTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='dummy', password='dummy_pw')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        segment = create_segment(segment_name='Sedan')
+        brand = create_brand(brand_name='Tesla')
+        self.vehicles = [
+            create_vehicle(user=self.user, segment=segment, brand=brand, price=500),
+            create_vehicle(user=self.user, segment=create_segment(segment_name='SUV'), brand=brand,
+                           vehicle_name='MODEL X', price=812.5),
+        ]
+
+    def expected_data(self):
+        return VehicleSerializer(Vehicle.objects.order_by('id'), many=True).data
+
+    # NDJSONは1行1件で一覧と同じ内容になる
+    def test_4_22_should_export_vehicles_as_ndjson(self):
+        res = self.client.get(EXPORT_VEHICLES_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(res.streaming)
+        self.assertTrue(res['Content-Type'].startswith('application/x-ndjson'))
+        lines = b''.join(res.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], self.expected_data())
+
+    # CSVはヘッダー行 + 1行1件
+    def test_4_23_should_export_vehicles_as_csv(self):
+        res = self.client.get(EXPORT_VEHICLES_URL, {'type': 'csv'})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        rows = list(csv.DictReader(io.StringIO(b''.join(res.streaming_content).decode())))
+        expected = [{key: str(value) for key, value in item.items()} for item in self.expected_data()]
+        self.assertEqual(rows, expected)
+
+    # 一覧と同じ絞り込みが使え、未対応の形式は400になる
+    def test_4_24_should_export_filtered_vehicles(self):
+        res = self.client.get(EXPORT_VEHICLES_URL, {'price_min': 600})
+        lines = b''.join(res.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], [self.vehicles[1].id])
+
+        res = self.client.get(EXPORT_VEHICLES_URL, {'type': 'xml'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+# 読み取り専用の高速なSerializerのテスト
+class FastVehicleSerializerTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='dummy', password='dummy_pw')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        segment = create_segment(segment_name='セダン')
+        brand = create_brand(brand_name='Tesla "Motors"')
+        for price in [0.1, 500, 9999.99, '123.45', 0]:
+            create_vehicle(user=self.user, segment=segment, brand=brand, price=price, vehicle_name='MODEL %s' % price)
+
+    # 従来のVehicleSerializerとJSONがバイト単位で一致する
+    def test_4_25_should_render_same_json_as_vehicle_serializer(self):
+        queryset = VehicleViewSet.queryset.order_by('id')
+        expected = JSONRenderer().render(VehicleSerializer(queryset, many=True).data)
+        self.assertEqual(JSONRenderer().render(FastVehicleSerializer(queryset, many=True).data), expected)
+
+    # APIのレスポンスも高速なSerializerの有無でバイト単位で一致する(ページネーションを含む)
+    def test_4_26_should_respond_same_content_with_fast_serializer(self):
+        for params in [{}, {'page_size': 2, 'ordering': '-price'}, {'price_max': 500}]:
+            with self.subTest(params=params):
+                with override_settings(API_FAST_READ_SERIALIZER=False):
+                    expected = self.client.get(VEHICLES_URL, params).content
+                with override_settings(API_FAST_READ_SERIALIZER=True):
+                    res = self.client.get(VEHICLES_URL, params)
+                self.assertEqual(res.status_code, status.HTTP_200_OK)
+                self.assertEqual(res.content, expected)
+
+
+# orjson/MessagePackのレンダラー・パーサーのテスト
+class VehicleRendererParserTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='dummy', password='dummy_pw')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.segment = create_segment(segment_name='Sedan')
+        self.brand = create_brand(brand_name='Tesla')
+        create_vehicle(user=self.user, segment=self.segment, brand=self.brand, price=500.12)
+
+    # orjsonでもDRFのJSONRendererと同じJSONになる(orjsonがない場合も同様)
+    def test_4_27_should_render_same_json_as_drf(self):
+        data = {
+            'vehicles': VehicleSerializer(Vehicle.objects.all(), many=True).data,
+            'price': Decimal('500.10'),
+            'updated_at': datetime.datetime(2022, 3, 27, 15, 50, 0, 123456, tzinfo=datetime.timezone.utc),
+            'name': 'モデル\u2028S',
+        }
+        expected = JSONRenderer().render({**data, 'price': '500.10'})
+        self.assertEqual(FastJSONRenderer().render(data), expected)
+        with mock.patch('api.renderers.orjson', None):
+            self.assertEqual(FastJSONRenderer().render(data), expected)
+
+    # JSONの作成リクエストと不正なJSON
+    def test_4_28_should_parse_json_request(self):
+        payload = {'vehicle_name': 'MODEL 3', 'release_year': 2021, 'price': 399.99,
+                   'segment': self.segment.id, 'brand': self.brand.id}
+        res = self.client.post(VEHICLES_URL, payload, format='json')
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Vehicle.objects.get(id=res.data['id']).price, Decimal('399.99'))
+        res = self.client.post(VEHICLES_URL, '{"vehicle_name": ', content_type='application/json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    # Acceptヘッダーに応じてMessagePackで返し、MessagePackのリクエストも受け付ける
+    @unittest.skipUnless(msgpack, 'msgpack is not installed')
+    def test_4_29_should_respond_and_parse_msgpack(self):
+        res = self.client.get(VEHICLES_URL, HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(res.content), json.loads(self.client.get(VEHICLES_URL).content))
+        self.assertEqual(msgpack.unpackb(res.content)[0]['price'], '500.12')
+
+        payload = {'vehicle_name': 'MODEL 3', 'release_year': 2021, 'price': '399.99',
+                   'segment': self.segment.id, 'brand': self.brand.id}
+        res = self.client.post(VEHICLES_URL, msgpack.packb(payload), content_type='application/msgpack',
+                               HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(msgpack.unpackb(res.content)['vehicle_name'], 'MODEL 3')
+        res = self.client.post(VEHICLES_URL, b'\xc1', content_type='application/msgpack')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+# 初期表示用のbootstrapエンドポイントのテスト
+class BootstrapApiTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(username='dummy', password='dummy_pw')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        segment = create_segment(segment_name='Sedan')
+        brand = create_brand(brand_name='Tesla')
+        for _ in range(3):
+            create_vehicle(user=self.user, segment=segment, brand=brand)
+
+    # profile, segments, brands, vehiclesが個別のエンドポイントと同じ内容で返る
+    def test_4_30_should_get_all_sections(self):
+        res = self.client.get(BOOTSTRAP_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['profile'], {'id': self.user.id, 'username': 'dummy'})
+        self.assertEqual(res.data['segments'], SegmentSerializer(Segment.objects.all(), many=True).data)
+        self.assertEqual(res.data['brands'], BrandSerializer(Brand.objects.all(), many=True).data)
+        self.assertEqual(res.data['vehicles'], VehicleSerializer(Vehicle.objects.order_by('id'), many=True).data)
+
+    # クエリ数は件数に関わらず一定で、各セクションはキャッシュから返る
+    def test_4_31_should_get_all_sections_with_fixed_number_of_queries(self):
+        with self.assertNumQueries(3):
+            self.client.get(BOOTSTRAP_URL)
+        with self.assertNumQueries(0):
+            self.client.get(BOOTSTRAP_URL)
+        # Segmentの更新後はsegmentsと(segment_nameを含む)vehiclesが再取得される
+        create_segment(segment_name='SUV')
+        with self.assertNumQueries(2):
+            res = self.client.get(BOOTSTRAP_URL)
+        self.assertEqual(len(res.data['segments']), 2)
+        # Vehicleの更新後はvehiclesのみ再取得される
+        vehicle = Vehicle.objects.first()
+        self.client.patch(detail_vehicle_url(vehicle.id), {'vehicle_name': 'MODEL X'})
+        with self.assertNumQueries(1):
+            res = self.client.get(BOOTSTRAP_URL)
+        self.assertEqual(res.data['vehicles'][0]['vehicle_name'], 'MODEL X')
+        Vehicle.objects.get(pk=vehicle.id).delete()
+        self.assertEqual(len(self.client.get(BOOTSTRAP_URL).data['vehicles']), 2)
+        # 更新のたびに作り直した一覧は上書きされ、古い一覧はキャッシュに残らない(LocMemCacheの中身を確認する)
+        self.assertEqual(len([key for key in cache._cache if ':api:data:primary:api.vehicle:' in key]), 1)
+
+    # ?sections=で一部だけ取得できる
+    def test_4_32_should_get_requested_sections(self):
+        with self.assertNumQueries(1):
+            res = self.client.get(BOOTSTRAP_URL, {'sections': 'profile,brands'})
+        self.assertEqual(list(res.data), ['profile', 'brands'])
+        res = self.client.get(BOOTSTRAP_URL, {'sections': 'profile,users'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+# Vehicleの絞り込み・並び替えのテスト
+class VehicleFilterApiTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='dummy', password='dummy_pw')
+        self.other_user = get_user_model().objects.create_user(username='other', password='dummy_pw')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.sedan = create_segment(segment_name='Sedan')
+        self.suv = create_segment(segment_name='SUV')
+        self.tesla = create_brand(brand_name='Tesla')
+        self.toyota = create_brand(brand_name='Toyota')
+        self.v1 = create_vehicle(user=self.user, segment=self.sedan, brand=self.tesla,
+                                 release_year=2015, price=300.00)
+        self.v2 = create_vehicle(user=self.user, segment=self.suv, brand=self.tesla,
+                                 release_year=2019, price=800.00)
+        self.v3 = create_vehicle(user=self.other_user, segment=self.sedan, brand=self.toyota,
+                                 release_year=2021, price=450.50)
+
+    def get_ids(self, params):
+        res = self.client.get(VEHICLES_URL, params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return [v['id'] for v in res.data]
+
+    # segment/brand/userでの絞り込み
+    def test_4_33_should_filter_vehicles_by_foreign_keys(self):
+        self.assertEqual(self.get_ids({'segment': self.sedan.id}), [self.v1.id, self.v3.id])
+        self.assertEqual(self.get_ids({'brand': self.tesla.id}), [self.v1.id, self.v2.id])
+        self.assertEqual(self.get_ids({'user': self.other_user.id}), [self.v3.id])
+        self.assertEqual(self.get_ids({'segment': self.sedan.id, 'brand': self.toyota.id}), [self.v3.id])
+
+    # release_year/priceの範囲指定での絞り込み
+    def test_4_34_should_filter_vehicles_by_range(self):
+        self.assertEqual(self.get_ids({'release_year_min': 2016, 'release_year_max': 2020}), [self.v2.id])
+        # ORDER BYなしの場合は使われたインデックス順で返るため順不同で比較する
+        self.assertCountEqual(self.get_ids({'price_min': '450.50'}), [self.v2.id, self.v3.id])
+        self.assertEqual(self.get_ids({'segment': self.sedan.id, 'price_max': 400}), [self.v1.id])
+
+    # ?ordering=での並び替え
+    def test_4_35_should_order_vehicles(self):
+        self.assertEqual(self.get_ids({'ordering': '-price'}), [self.v2.id, self.v3.id, self.v1.id])
+        self.assertEqual(self.get_ids({'ordering': 'release_year'}), [self.v1.id, self.v2.id, self.v3.id])
+
+    # 数値でない値は400になる
+    def test_4_36_should_not_filter_vehicles_with_invalid_value(self):
+        res = self.client.get(VEHICLES_URL, {'price_min': 'cheap'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('price_min', res.data)
+        # NaN/Infinityも数値として扱わない
+        for value in ('NaN', 'sNaN', 'Infinity', '-inf'):
+            res = self.client.get(VEHICLES_URL, {'price_max': value})
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST, value)
+        # DBの整数の範囲外の値も500にならない
+        for param in ('segment', 'release_year_min'):
+            res = self.client.get(VEHICLES_URL, {param: 10 ** 30})
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST, param)
+            self.assertIn(param, res.data)
+        for value in ('1e30', '-1e400'):
+            res = self.client.get(VEHICLES_URL, {'price_min': value})
+            self.assertEqual(res.status_code, status.HTTP_200_OK, value)
+
+    # 対応する絞り込みの組み合わせがインデックスを使い、全件スキャンにならないことを実行計画で確認
+    def test_4_37_should_use_index_for_supported_filters(self):
+        factory = APIRequestFactory()
+        view = VehicleViewSet()
+        combinations = [
+            # 外部キー単独の場合は外部キーのインデックスか、それを先頭に持つ複合インデックスのどちらか
+            ({'segment': 1}, None),
+            ({'brand': 1}, None),
+            ({'user': 1}, 'api_vehicle_user_id'),
+            ({'segment': 1, 'release_year_min': 2000, 'release_year_max': 2010}, 'vehicle_segment_year_idx'),
+            ({'segment': 1, 'price_max': 500}, 'vehicle_segment_price_idx'),
+            ({'brand': 1, 'release_year_min': 2000}, 'vehicle_brand_year_idx'),
+            ({'brand': 1, 'price_min': 100, 'price_max': 500}, 'vehicle_brand_price_idx'),
+            ({'release_year_min': 2000, 'release_year_max': 2010}, 'vehicle_year_price_idx'),
+            ({'price_min': 100}, 'vehicle_price_idx'),
+        ]
+        for params, index_name in combinations:
+            view.request = Request(factory.get(VEHICLES_URL, params))
+            plan = view.filter_queryset(view.get_queryset()).explain()
+            with self.subTest(params=params):
+                self.assertIn('SEARCH api_vehicle USING INDEX', plan)
+                self.assertNotIn('SCAN api_vehicle', plan)
+                if index_name:
+                    self.assertIn(index_name, plan)
+
 
 # Token未承認ユーザーでのAPIアクセスのテスト
 class UnauthorizedBrandApiTests(TestCase):
@@ -188,3 +716,8 @@ class UnauthorizedBrandApiTests(TestCase):
     def test_4_10_should_not_get_vehicle_when_unauthorized(self):
         res = self.client.get(VEHICLES_URL)
         self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    # 未承認ユーザーではbootstrapも取得できない
+    def test_4_38_should_not_get_bootstrap_when_unauthorized(self):
+        res = self.client.get(BOOTSTRAP_URL)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
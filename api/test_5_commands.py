@@ -0,0 +1,96 @@
+import os
+import tempfile
+from decimal import Decimal
+from io import StringIO
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from .models import Vehicle, Brand, Segment
+
+
+# 一時ファイルにテスト用のデータを書き込む関数
+def write_file(content, suffix):
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(content)
+    return path
+
+
+# import_vehiclesコマンドのテスト
+class ImportVehiclesCommandTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='dummy', password='dummy_pw')
+        Segment.objects.create(segment_name='Sedan')
+
+    def import_file(self, content, suffix, *args):
+        path = write_file(content, suffix)
+        self.addCleanup(os.remove, path)
+        out = StringIO()
+        call_command('import_vehicles', path, '--user', 'dummy', *args, stdout=out)
+        return out.getvalue()
+
+    # CSVを取り込み、Segment/Brandは名前で解決または作成される
+    def test_5_1_should_import_vehicles_from_csv(self):
+        content = (
+            'vehicle_name,release_year,price,segment_name,brand_name\n'
+            'MODEL S,2019,500.12,Sedan,Tesla\n'
+            'MODEL X,2020,800.00,SUV,Tesla\n'
+            'PRIUS,2018,300.5,Sedan,Toyota\n'
+        )
+        out = self.import_file(content, '.csv', '--batch-size', '2')
+        self.assertIn('Imported 3 vehicles', out)
+        self.assertIn('rows/s', out)
+        self.assertEqual(Segment.objects.count(), 2)
+        self.assertEqual(Brand.objects.count(), 2)
+        vehicle = Vehicle.objects.get(vehicle_name='PRIUS')
+        self.assertEqual(vehicle.user, self.user)
+        self.assertEqual(vehicle.price, Decimal('300.50'))
+        self.assertEqual(vehicle.segment.segment_name, 'Sedan')
+        self.assertEqual(vehicle.brand.brand_name, 'Toyota')
+
+    # NDJSONを取り込み、priceは誤差なく保存される
+    def test_5_2_should_import_vehicles_from_ndjson(self):
+        content = (
+            '{"vehicle_name": "MODEL S", "release_year": 2019, "price": 500.12, '
+            '"segment_name": "Sedan", "brand_name": "Tesla"}\n'
+            '\n'
+            '{"vehicle_name": "MODEL 3", "release_year": 2021, "price": "399.99", '
+            '"segment_name": "Sedan", "brand_name": "Tesla"}\n'
+        )
+        self.import_file(content, '.ndjson')
+        self.assertEqual(Vehicle.objects.count(), 2)
+        self.assertEqual(Vehicle.objects.get(vehicle_name='MODEL S').price, Decimal('500.12'))
+
+    # 不正な行があれば行番号付きでエラーになり、--skip-invalidで読み飛ばせる
+    def test_5_3_should_not_import_invalid_rows(self):
+        content = (
+            'vehicle_name,release_year,price,segment_name,brand_name\n'
+            'MODEL S,2019,500.12,Sedan,Tesla\n'
+            'MODEL X,unknown,800.00,SUV,Tesla\n'
+        )
+        with self.assertRaisesMessage(CommandError, 'line 3'):
+            self.import_file(content, '.csv')
+        out = self.import_file(content, '.csv', '--skip-invalid')
+        self.assertIn('1 skipped', out)
+
+    # NDJSONの解析できない行・オブジェクトでない行も行番号付きのエラーになり、--skip-invalidで読み飛ばせる
+    def test_5_3_should_not_import_malformed_ndjson_lines(self):
+        content = (
+            '{"vehicle_name": "MODEL S", "release_year": 2019, "price": 500.12, '
+            '"segment_name": "Sedan", "brand_name": "Tesla"}\n'
+            '{"vehicle_name": "MODEL X",\n'
+            '[1, 2, 3]\n'
+            '{"vehicle_name": "MODEL 3", "release_year": 2021, "price": "399.99", '
+            '"segment_name": ["Sedan"], "brand_name": "Tesla"}\n'
+        )
+        with self.assertRaisesMessage(CommandError, 'line 2'):
+            self.import_file(content, '.ndjson')
+        out = self.import_file(content, '.ndjson', '--skip-invalid')
+        self.assertIn('Imported 1 vehicles (3 skipped)', out)
+        self.assertEqual(Vehicle.objects.count(), 1)
+
+    # 存在しないユーザーは指定できない
+    def test_5_4_should_not_import_with_non_exist_user(self):
+        with self.assertRaises(CommandError):
+            call_command('import_vehicles', 'vehicles.csv', '--user', 'nobody', stdout=StringIO())
@@ -0,0 +1,98 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from .models import Segment, Brand, Vehicle
+
+BATCH_URL = '/api/batch/'
+
+
+# バッチエンドポイントのテスト
+class BatchApiTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='dummy', password='dummy_pw')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def post(self, requests, atomic=False):
+        return self.client.post(BATCH_URL, {'atomic': atomic, 'requests': requests}, format='json')
+
+    # 複数のサブリクエストを順番に実行し、結果を順番通りに返す
+    def test_6_1_should_run_subrequests_in_order(self):
+        segment = Segment.objects.create(segment_name='Sedan')
+        res = self.post([
+            {'method': 'POST', 'path': '/api/brands/', 'body': {'brand_name': 'Tesla'}},
+            {'method': 'GET', 'path': '/api/segments/'},
+            {'method': 'PATCH', 'path': '/api/segments/%d/' % segment.id, 'body': {'segment_name': 'SUV'}},
+            {'method': 'GET', 'path': '/api/segments/999/'},
+        ])
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        results = res.data['results']
+        self.assertEqual([r['status'] for r in results], [201, 200, 200, 404])
+        self.assertEqual(results[0]['body']['brand_name'], 'Tesla')
+        self.assertEqual(results[1]['body'], [{'id': segment.id, 'segment_name': 'Sedan'}])
+        self.assertEqual(results[2]['body']['segment_name'], 'SUV')
+        self.assertTrue(Brand.objects.filter(brand_name='Tesla').exists())
+
+    # サブリクエストでもログインユーザーがVehicleに割り当てられ、クエリパラメータも使える
+    def test_6_2_should_run_subrequests_as_authenticated_user(self):
+        segment = Segment.objects.create(segment_name='Sedan')
+        brand = Brand.objects.create(brand_name='Tesla')
+        vehicle = {'vehicle_name': 'MODEL S', 'release_year': 2019, 'price': '500.12',
+                   'segment': segment.id, 'brand': brand.id}
+        res = self.post([
+            {'method': 'POST', 'path': '/api/vehicles/', 'body': vehicle},
+            {'method': 'GET', 'path': '/api/vehicles/?brand=%d' % brand.id},
+            {'method': 'GET', 'path': '/api/profile/'},
+        ])
+        results = res.data['results']
+        self.assertEqual(results[0]['status'], status.HTTP_201_CREATED)
+        self.assertEqual(Vehicle.objects.get().user, self.user)
+        self.assertEqual(len(results[1]['body']), 1)
+        self.assertEqual(results[2]['body']['username'], 'dummy')
+
+    # atomicの場合は失敗したサブリクエストで中断し、それまでの変更もロールバックされる
+    def test_6_3_should_rollback_atomic_batch_on_failure(self):
+        res = self.post([
+            {'method': 'POST', 'path': '/api/segments/', 'body': {'segment_name': 'Sedan'}},
+            {'method': 'POST', 'path': '/api/brands/', 'body': {'brand_name': ''}},
+            {'method': 'POST', 'path': '/api/brands/', 'body': {'brand_name': 'Tesla'}},
+        ], atomic=True)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertFalse(res.data['committed'])
+        self.assertEqual([r['status'] for r in res.data['results']], [201, 400])
+        self.assertEqual(Segment.objects.count(), 0)
+        self.assertEqual(Brand.objects.count(), 0)
+
+        res = self.post([{'method': 'POST', 'path': '/api/segments/', 'body': {'segment_name': 'Sedan'}}], atomic=True)
+        self.assertTrue(res.data['committed'])
+        self.assertEqual(Segment.objects.count(), 1)
+
+    # 不正なサブリクエストはそのサブリクエストのみ400になる
+    def test_6_4_should_reject_invalid_subrequests(self):
+        res = self.post([
+            {'method': 'TRACE', 'path': '/api/segments/'},
+            {'method': 'GET', 'path': '/admin/'},
+            {'method': 'POST', 'path': '/api/batch/', 'body': {'requests': []}},
+            {'method': 'GET', 'path': '/api/segments/'},
+        ])
+        self.assertEqual([r['status'] for r in res.data['results']], [400, 400, 400, 200])
+        res = self.client.post(BATCH_URL, {'requests': 'GET /api/segments/'}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    # Token認証の場合も認証はバッチのリクエストで1回のみ
+    def test_6_5_should_authenticate_once_with_token(self):
+        token = Token.objects.create(user=self.user)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        requests = [{'method': 'GET', 'path': '/api/profile/'}] * 5
+        # トークン認証の1クエリのみ
+        with self.assertNumQueries(1):
+            res = client.post(BATCH_URL, {'requests': requests}, format='json')
+        self.assertEqual([r['status'] for r in res.data['results']], [200] * 5)
+
+    # 未承認ユーザーではバッチを実行できない
+    def test_6_6_should_not_run_batch_when_unauthorized(self):
+        res = APIClient().post(BATCH_URL, {'requests': []}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
@@ -0,0 +1,123 @@
+from datetime import timedelta
+from io import StringIO
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+from .changes import record_bulk_changes
+from .models import Segment, Brand, Vehicle, Change
+
+CHANGES_URL = '/api/changes/'
+
+
+# 差分同期(changes)のテスト
+class ChangesApiTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='dummy', password='dummy_pw')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def get_changes(self, since, **params):
+        res = self.client.get(CHANGES_URL, {'since': since, **params})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return res.data
+
+    # カーソル以降の作成・更新・削除が返り、同じオブジェクトの変更は最後の1件になる
+    def test_7_1_should_get_changes_since_cursor(self):
+        cursor = self.get_changes(0)['cursor']
+        segment = Segment.objects.create(segment_name='Sedan')
+        brand = Brand.objects.create(brand_name='Tesla')
+        vehicle = Vehicle.objects.create(user=self.user, segment=segment, brand=brand,
+                                         vehicle_name='MODEL S', release_year=2019, price=500)
+        segment.segment_name = 'SUV'
+        segment.save()
+
+        data = self.get_changes(cursor)
+        self.assertFalse(data['has_more'])
+        self.assertEqual([(c['model'], c['id'], c['action']) for c in data['changes']], [
+            ('brand', brand.id, 'create'),
+            ('vehicle', vehicle.id, 'create'),
+            ('segment', segment.id, 'update'),
+        ])
+        self.assertEqual(data['changes'][1]['data']['segment_name'], 'SUV')
+        self.assertEqual(data['changes'][1]['data']['price'], '500.00')
+
+        # 変更がなければ空で、カーソルはそのまま
+        cursor = data['cursor']
+        self.assertEqual(self.get_changes(cursor), {'cursor': cursor, 'has_more': False, 'changes': []})
+
+        # Segmentの削除でカスケード削除されたVehicleも削除として返る
+        self.client.delete('/api/segments/%d/' % segment.id)
+        data = self.get_changes(cursor)
+        self.assertEqual([(c['model'], c['id'], c['action']) for c in data['changes']], [
+            ('vehicle', vehicle.id, 'delete'),
+            ('segment', segment.id, 'delete'),
+        ])
+
+    # limitごとにページングでき、一括作成は個別のidで記録される(idが分からない場合はreset)
+    def test_7_2_should_page_changes_and_record_bulk_operations(self):
+        for name in ['A', 'B', 'C']:
+            Brand.objects.create(brand_name=name)
+        data = self.get_changes(0, limit=2)
+        self.assertTrue(data['has_more'])
+        self.assertEqual(len(data['changes']), 2)
+        data = self.get_changes(data['cursor'], limit=2)
+        self.assertFalse(data['has_more'])
+        self.assertEqual(data['changes'][0]['data']['brand_name'], 'C')
+
+        segment = Segment.objects.create(segment_name='Sedan')
+        cursor = self.get_changes(data['cursor'])['cursor']
+        payload = [{'vehicle_name': 'MODEL S', 'release_year': 2019, 'price': '500.00',
+                    'segment': segment.id, 'brand': Brand.objects.first().id}]
+        res = self.client.post('/api/vehicles/bulk/', payload, format='json')
+        vehicle_ids = [v['id'] for v in res.data]
+        changes = self.get_changes(cursor)['changes']
+        self.assertNotIn(None, vehicle_ids)
+        self.assertEqual([c['id'] for c in changes], vehicle_ids)
+        # idが分からないオブジェクトの一括作成はresetになる
+        cursor = self.get_changes(cursor)['cursor']
+        record_bulk_changes(Vehicle, [Vehicle(vehicle_name='MODEL X')], Change.ACTION_CREATE)
+        changes = self.get_changes(cursor)['changes']
+        self.assertEqual(changes, [{'model': 'vehicle', 'id': None, 'action': 'reset', 'data': None}])
+
+    # 保持期間を過ぎた履歴は削除され、削除済みの範囲のカーソルは410になる
+    def test_7_3_should_prune_old_changes(self):
+        Brand.objects.create(brand_name='A')
+        Brand.objects.create(brand_name='B')
+        Change.objects.filter(id=Change.objects.order_by('id').first().id).update(
+            created_at=timezone.now() - timedelta(days=31))
+        out = StringIO()
+        call_command('prune_changes', '--days', '30', stdout=out)
+        self.assertIn('Deleted 1 change log entries', out.getvalue())
+        self.assertEqual(Change.objects.count(), 1)
+
+        res = self.client.get(CHANGES_URL, {'since': 0})
+        self.assertEqual(res.status_code, status.HTTP_410_GONE)
+        res = self.client.get(CHANGES_URL, {'since': 'abc'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    # 全ての履歴が保持期間を過ぎても最後に発行したidは残り、古いカーソルは410になる
+    def test_7_4_should_expire_cursor_after_pruning_everything(self):
+        for name in ('A', 'B', 'C'):
+            Brand.objects.create(brand_name=name)
+        stale = self.get_changes(0, limit=1)['cursor']
+        latest = self.get_changes(stale)['cursor']
+        Change.objects.update(created_at=timezone.now() - timedelta(days=31))
+        call_command('prune_changes', '--days', '30', stdout=StringIO())
+        self.assertEqual(list(Change.objects.values_list('id', flat=True)), [latest])
+
+        res = self.client.get(CHANGES_URL, {'since': stale})
+        self.assertEqual(res.status_code, status.HTTP_410_GONE)
+        data = self.get_changes(latest)
+        self.assertEqual((data['cursor'], data['changes']), (latest, []))
+        # 以降の変更は最後のカーソルから取得できる
+        Brand.objects.create(brand_name='D')
+        self.assertEqual(self.get_changes(latest)['changes'][0]['data']['brand_name'], 'D')
+
+    # 範囲外のカーソルは500にならず400になる
+    def test_7_5_should_reject_out_of_range_cursor(self):
+        for since in (10 ** 30, 2 ** 63):
+            res = self.client.get(CHANGES_URL, {'since': since})
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST, since)
@@ -0,0 +1,109 @@
+import asyncio
+import json
+from unittest import mock
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from rest_framework.authtoken.models import Token
+from .events import broadcaster
+from .models import Segment, Brand, Vehicle
+from .signals import post_bulk_create
+from .sse import events_application
+
+
+# ASGIアプリを実行し、条件を満たすまでに送られたレスポンスを返す
+async def run_events(query_string=b'', headers=(), until=None, on_connect=None):
+    messages = []
+    disconnect = asyncio.Event()
+
+    async def receive():
+        await disconnect.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        messages.append(message)
+        body = b''.join(m.get('body', b'') for m in messages)
+        if on_connect and body == b': connected\n\n':
+            on_connect()
+        if until is None or until(body):
+            disconnect.set()
+
+    scope = {'type': 'http', 'method': 'GET', 'path': '/api/events/',
+             'query_string': query_string, 'headers': list(headers)}
+    await asyncio.wait_for(events_application(scope, receive, send), timeout=5)
+    return messages
+
+
+# SSE(events)のテスト
+class EventsTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='dummy', password='dummy_pw')
+        self.token = Token.objects.create(user=self.user)
+
+    # 保存・削除・一括作成はコミット後に配信される
+    def test_8_1_should_publish_changes_on_commit(self):
+        with mock.patch.object(broadcaster, 'publish') as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                segment = Segment.objects.create(segment_name='Sedan')
+                brand = Brand.objects.create(brand_name='Tesla')
+                vehicles = [Vehicle(user=self.user, segment=segment, brand=brand,
+                                    vehicle_name='MODEL S', release_year=2019, price=500)]
+                post_bulk_create.send(sender=Vehicle, instances=vehicles)
+                segment_id = segment.id
+                segment.delete()
+        events = [c.args[0] for c in publish.call_args_list]
+        self.assertEqual(events, [
+            {'model': 'segment', 'action': 'create', 'ids': [segment_id]},
+            {'model': 'brand', 'action': 'create', 'ids': [brand.id]},
+            {'model': 'vehicle', 'action': 'reset', 'ids': []},
+            {'model': 'segment', 'action': 'delete', 'ids': [segment_id]},
+        ])
+
+    # 未コミットの変更は配信されない
+    def test_8_2_should_not_publish_before_commit(self):
+        with mock.patch.object(broadcaster, 'publish') as publish:
+            with self.captureOnCommitCallbacks(execute=False) as callbacks:
+                Segment.objects.create(segment_name='Sedan')
+            publish.assert_not_called()
+        self.assertEqual(len(callbacks), 2)
+
+    # キューがあふれた購読者には終了の合図だけが残る
+    def test_8_3_should_drop_slow_subscriber(self):
+        async def scenario():
+            subscriber = broadcaster.subscribe(queue_size=2)
+            try:
+                for i in range(3):
+                    broadcaster.publish({'model': 'segment', 'action': 'update', 'ids': [i]})
+                await asyncio.sleep(0)
+                return subscriber.overflowed, subscriber.queue.qsize(), subscriber.queue.get_nowait()
+            finally:
+                broadcaster.unsubscribe(subscriber)
+
+        self.assertEqual(async_to_sync(scenario)(), (True, 1, None))
+
+    # トークンで認証した接続にイベントがストリーミングされ、切断後は購読が解除される
+    def test_8_4_should_stream_events(self):
+        event = {'model': 'vehicle', 'action': 'update', 'ids': [1]}
+        messages = async_to_sync(run_events)(
+            query_string=('token=%s' % self.token.key).encode(),
+            on_connect=lambda: broadcaster.publish(event),
+            until=lambda body: b'event: update' in body,
+        )
+        self.assertEqual(messages[0]['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream'), messages[0]['headers'])
+        body = b''.join(m.get('body', b'') for m in messages).decode()
+        self.assertIn('event: update\ndata: %s\n\n' % json.dumps(event), body)
+        self.assertEqual(broadcaster.subscribers, set())
+
+    # Authorizationヘッダーのトークンでも認証できる
+    def test_8_5_should_authenticate_by_header(self):
+        messages = async_to_sync(run_events)(
+            headers=[(b'authorization', ('Token %s' % self.token.key).encode())],
+        )
+        self.assertEqual(messages[0]['status'], 200)
+
+    # 認証されていない接続は401になる
+    def test_8_6_should_reject_unauthenticated(self):
+        messages = async_to_sync(run_events)(query_string=b'token=invalid')
+        self.assertEqual(messages[0]['status'], 401)
+        self.assertEqual(broadcaster.subscribers, set())
@@ -0,0 +1,143 @@
+import asyncio
+import json
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.test import AsyncClient, TransactionTestCase
+from django.urls import resolve
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from .models import Segment, Brand, Vehicle
+from rest_api.asgi import application
+
+READ_URLS = [
+    '/api/segments/',
+    '/api/brands/',
+    '/api/vehicles/',
+    '/api/vehicles/?segment=1&ordering=-price',
+    '/api/vehicles/?page_size=1',
+    '/api/profile/',
+]
+
+
+# ASGIでの非同期の読み取りViewのテスト
+# (非同期のViewはスレッドプールの別の接続でDBを読むため、コミット済みのデータを使う)
+class AsyncReadViewTests(TransactionTestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='dummy', password='dummy_pw')
+        self.token = Token.objects.create(user=self.user)
+        self.segment = Segment.objects.create(segment_name='Sedan')
+        self.brand = Brand.objects.create(brand_name='Tesla')
+        self.vehicle = Vehicle.objects.create(user=self.user, segment=self.segment, brand=self.brand,
+                                              vehicle_name='MODEL S', release_year=2019, price=500)
+        Vehicle.objects.create(user=self.user, segment=self.segment, brand=self.brand,
+                               vehicle_name='MODEL 3', release_year=2020, price=400)
+        self.authorization = 'Token ' + self.token.key
+
+    # 同期のView(APIClient)と非同期のView(AsyncClient)で同じリクエストを送る
+    async def get_both(self, url, authorization, **headers):
+        sync_client = APIClient()
+        sync_client.credentials(HTTP_AUTHORIZATION=authorization)
+        sync_res = await sync_to_async(sync_client.get)(url)
+        async_res = await AsyncClient().get(url, authorization=authorization, **headers)
+        return sync_res, async_res
+
+    # rest_api.asgi.applicationを直接呼び出し、送信された本文までを返す
+    # (AsyncClientはStreamingHttpResponseの本文をイテレートしないため)
+    async def asgi_get(self, path, query_string=''):
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': path, 'raw_path': path.encode(), 'query_string': query_string.encode(), 'root_path': '',
+            'headers': [(b'host', b'testserver'), (b'authorization', self.authorization.encode())],
+            'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+        }
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        await application(scope, receive, send)
+        start = messages[0]
+        body = b''.join(message.get('body', b'') for message in messages[1:])
+        return start['status'], dict(start['headers']), body
+
+    def assertSameResponse(self, sync_res, async_res):
+        self.assertEqual(async_res.asgi_request.urlconf, 'rest_api.async_urls')
+        self.assertEqual(async_res.status_code, sync_res.status_code)
+        self.assertEqual(async_res.content, sync_res.content)
+        for header in ('Content-Type', 'ETag', 'Last-Modified'):
+            self.assertEqual(async_res.get(header), sync_res.get(header))
+
+    # 一覧・詳細・プロフィールで同期のViewと同じレスポンスが返る
+    async def test_9_1_should_return_same_response_as_sync(self):
+        urls = READ_URLS + [
+            '/api/segments/%s/' % self.segment.id,
+            '/api/brands/%s/' % self.brand.id,
+            '/api/vehicles/%s/' % self.vehicle.id,
+            '/api/vehicles/0/',
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertSameResponse(*await self.get_both(url, self.authorization))
+
+    # 認証エラーも同期のViewと同じレスポンスになる
+    async def test_9_2_should_return_same_auth_errors(self):
+        for authorization in ('', 'Token invalid'):
+            for url in ('/api/vehicles/', '/api/profile/'):
+                with self.subTest(url=url, authorization=authorization):
+                    sync_res, async_res = await self.get_both(url, authorization)
+                    self.assertEqual(sync_res.status_code, status.HTTP_401_UNAUTHORIZED)
+                    self.assertSameResponse(sync_res, async_res)
+
+    # 条件付きGETも非同期のViewで304になる
+    async def test_9_3_should_return_not_modified(self):
+        etag = (await AsyncClient().get('/api/vehicles/', authorization=self.authorization))['ETag']
+        res = await AsyncClient().get('/api/vehicles/', authorization=self.authorization, if_none_match=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    # 書き込みは通常の(同期の)Viewで処理される
+    async def test_9_4_should_not_route_writes_to_async_views(self):
+        res = await AsyncClient().post('/api/segments/', {'segment_name': 'SUV'},
+                                       content_type='application/json', authorization=self.authorization)
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(hasattr(res.asgi_request, 'urlconf'))
+
+    # 一覧のaction(export/stats)は詳細のViewとして扱われず、通常のViewに渡される
+    async def test_9_5_should_not_route_list_actions_to_detail_views(self):
+        for url, name in (('/api/vehicles/export/', 'vehicle-export'), ('/api/vehicles/stats/', 'vehicle-stats')):
+            with self.subTest(url=url):
+                self.assertEqual(resolve(url, urlconf='rest_api.async_urls').url_name, name)
+        self.assertEqual(resolve('/api/vehicles/1/', urlconf='rest_api.async_urls').url_name, 'vehicle-detail')
+        status_code, headers, body = await self.asgi_get('/api/vehicles/export/')
+        self.assertEqual(status_code, status.HTTP_200_OK)
+        self.assertEqual(headers[b'Content-Type'], b'application/x-ndjson; charset=utf-8')
+        rows = [json.loads(line) for line in body.decode().splitlines()]
+        self.assertEqual([row['vehicle_name'] for row in rows], ['MODEL S', 'MODEL 3'])
+        self.assertEqual(rows[0]['id'], self.vehicle.id)
+
+    # ユーザー登録・ログインはパスワードのハッシュ計算を共通の同期スレッドで行わないよう非同期のViewで処理する
+    async def test_9_6_should_offload_password_hashing_views(self):
+        for url in ('/api/create/', '/api/auth/'):
+            with self.subTest(url=url):
+                self.assertTrue(asyncio.iscoroutinefunction(resolve(url, urlconf='rest_api.async_urls').func))
+        res = await AsyncClient().post('/api/create/', {'username': 'new', 'password': 'new_pw'},
+                                       content_type='application/json')
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(res.asgi_request.urlconf, 'rest_api.async_urls')
+        res = await AsyncClient().post('/api/auth/', {'username': 'new', 'password': 'new_pw'},
+                                       content_type='application/json')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.asgi_request.urlconf, 'rest_api.async_urls')
+        self.assertIn('token', json.loads(res.content))
+
+    # ASGIでもエクスポートの本文がストリーミングで送られる
+    async def test_9_7_should_stream_export_under_asgi(self):
+        status_code, headers, body = await self.asgi_get('/api/vehicles/export/', 'type=csv')
+        self.assertEqual(status_code, status.HTTP_200_OK)
+        self.assertEqual(headers[b'Content-Type'], b'text/csv; charset=utf-8')
+        lines = body.decode().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[1].startswith('%s,MODEL S,' % self.vehicle.id))
@@ -0,0 +1,72 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+# トークンの有効期間(秒)。0なら期限なし
+TOKEN_TTL = getattr(settings, 'API_TOKEN_TTL', 0)
+# 使われるたびに有効期限を延長するか(スライディング方式)
+TOKEN_SLIDING = getattr(settings, 'API_TOKEN_SLIDING', False)
+# スライディング方式で有効期限を延長する間隔(秒)。毎リクエストの書き込みを避ける
+TOKEN_REFRESH_INTERVAL = getattr(settings, 'API_TOKEN_REFRESH_INTERVAL', 60 * 60)
+
+
+# 有効期限はcreated(発行日時、スライディング方式では最終延長日時)+有効期間とし、
+# createdのインデックス(0005_token_created_index)で期限切れのトークンを検索する
+def expires_at(token):
+    if TOKEN_TTL <= 0:
+        return None
+    return token.created + timedelta(seconds=TOKEN_TTL)
+
+
+def is_expired(token, now=None):
+    expires = expires_at(token)
+    return expires is not None and expires <= (now or timezone.now())
+
+
+# スライディング方式の場合、前回の延長からTOKEN_REFRESH_INTERVAL秒以上経っていれば有効期限を延長する
+def needs_refresh(token, now=None):
+    return (TOKEN_TTL > 0 and TOKEN_SLIDING
+            and (now or timezone.now()) - token.created >= timedelta(seconds=TOKEN_REFRESH_INTERVAL))
+
+
+def refresh_token(token, now=None):
+    now = now or timezone.now()
+    if needs_refresh(token, now):
+        Token.objects.filter(pk=token.pk).update(created=now)
+        token.created = now
+
+
+# ユーザーのトークンを削除して新しいトークンを発行する
+def rotate_token(user):
+    with transaction.atomic():
+        Token.objects.filter(user=user).delete()
+        return Token.objects.create(user=user)
+
+
+# ユーザーの有効なトークンを返す(なければ発行し、期限切れなら再発行する)
+def get_valid_token(user):
+    token, created = Token.objects.get_or_create(user=user)
+    if not created and is_expired(token):
+        token = rotate_token(user)
+    return token
+
+
+# トークンをbatch_size件ずつ削除する(長時間のロックを避ける)
+# 1件ずつpost_deleteが送られるので、認証のキャッシュからも消える
+def delete_tokens(queryset, batch_size=1000):
+    deleted = 0
+    while True:
+        keys = list(queryset.order_by('created').values_list('key', flat=True)[:batch_size])
+        if not keys:
+            return deleted
+        deleted += Token.objects.filter(key__in=keys).delete()[0]
+
+
+# 期限切れのトークンを削除する
+def purge_expired_tokens(batch_size=1000, now=None):
+    if TOKEN_TTL <= 0:
+        return 0
+    cutoff = (now or timezone.now()) - timedelta(seconds=TOKEN_TTL)
+    return delete_tokens(Token.objects.filter(created__lte=cutoff), batch_size)
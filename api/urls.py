@@ -1,5 +1,4 @@
 from django.urls import path, include
-from rest_framework.authtoken.views import obtain_auth_token
 from . import views
 from rest_framework.routers import DefaultRouter
 
@@ -15,6 +14,10 @@ app_name = 'api'
 urlpatterns = [
     path('create/', views.CreateUserView.as_view(), name='create'),
     path('profile/', views.ProfileUserView.as_view(), name='profile'),
-    path('auth/', obtain_auth_token, name='auth'),
+    path('auth/', views.ObtainTokenView.as_view(), name='auth'),
+    path('auth/rotate/', views.RotateTokenView.as_view(), name='auth-rotate'),
+    path('bootstrap/', views.BootstrapView.as_view(), name='bootstrap'),
+    path('batch/', views.BatchView.as_view(), name='batch'),
+    path('changes/', views.ChangesView.as_view(), name='changes'),
     path('', include(router.urls)),
 ]
\ No newline at end of file
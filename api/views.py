@@ -1,6 +1,24 @@
-from rest_framework import generics, permissions, viewsets, status
-from .serializers import UserSerializer, SegmentSerializer, BrandSerializer, VehicleSerializer
+from django.conf import settings
+from django.db import transaction
+from django.http import HttpResponse, StreamingHttpResponse
+from rest_framework.authtoken.views import ObtainAuthToken
+from rest_framework import generics, permissions, viewsets, status, filters, views
+from rest_framework.decorators import action
+from .batch import SubRequestError, dispatch
+from .cache import CachedResponseMixin, get_or_build
+from .changes import get_changes
+from .metrics import render as render_metrics
+from .conditional import ConditionalGetMixin
+from .export import iter_csv, iter_ndjson
+from .filters import VehicleFilterBackend
+from .serializers import (
+    UserSerializer, SegmentSerializer, BrandSerializer, VehicleSerializer, BulkVehicleSerializer,
+    FastVehicleSerializer,
+)
 from .models import Segment, Brand, Vehicle
+from .summary import batch_delete, get_stats
+from .signals import post_bulk_create, post_bulk_update
+from .tokens import expires_at, get_valid_token, rotate_token
 from rest_framework.response import Response
 
 
@@ -11,6 +29,27 @@ class CreateUserView(generics.CreateAPIView):
     permission_classes = (permissions.AllowAny,)
 
 
+def token_response(token):
+    return Response({'token': token.key, 'expires': expires_at(token)})
+
+
+# ユーザー名とパスワードでトークンを返すView(期限切れのトークンは再発行する)
+class ObtainTokenView(ObtainAuthToken):
+    # 期限切れのトークンを送ってきたクライアントもログインし直せるように、ここではトークンを認証しない
+    authentication_classes = ()
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return token_response(get_valid_token(serializer.validated_data['user']))
+
+
+# POST /api/auth/rotate/ ログインしているユーザーのトークンを再発行する(今のトークンは無効になる)
+class RotateTokenView(views.APIView):
+    def post(self, request):
+        return token_response(rotate_token(request.user))
+
+
 # ログインしているユーザーのプロフィール情報を返すView
 class ProfileUserView(generics.RetrieveUpdateAPIView):
     serializer_class = UserSerializer
@@ -30,25 +69,283 @@ class ProfileUserView(generics.RetrieveUpdateAPIView):
         return Response(response, status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
 
-class SegmentViewSet(viewsets.ModelViewSet):
+# list/retrieveはキャッシュから返す(更新時はsignalでキャッシュを無効化)
+# ETag/Last-Modifiedで変更がなければ304を返す
+class SegmentViewSet(CachedResponseMixin, ConditionalGetMixin, viewsets.ModelViewSet):
     # CRUDを全部使えるようにする
     queryset = Segment.objects.all()
     serializer_class = SegmentSerializer
 
 
-class BrandViewSet(viewsets.ModelViewSet):
+class BrandViewSet(CachedResponseMixin, ConditionalGetMixin, viewsets.ModelViewSet):
     # CRUDを全部使えるようにする
     queryset = Brand.objects.all()
     serializer_class = BrandSerializer
 
 
-class VehicleViewSet(viewsets.ModelViewSet):
+class VehicleViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     # CRUDを全部使えるようにする
-    queryset = Vehicle.objects.all()
+    # segment_name/brand_nameのためにJOINで1クエリにまとめ(N+1対策)、
+    # serializerとETag/Last-Modifiedの計算で使うカラムのみを取得する
+    queryset = Vehicle.objects.select_related('segment', 'brand').only(
+        'id', 'vehicle_name', 'release_year', 'price', 'updated_at',
+        'segment__id', 'segment__segment_name', 'segment__updated_at',
+        'brand__id', 'brand__brand_name', 'brand__updated_at',
+    )
     serializer_class = VehicleSerializer
+    # segment_name/brand_nameが変わった場合も一覧のETag/Last-Modifiedが変わるようにする
+    related_models = (Segment, Brand)
+    # ?segment=&brand=&user=&release_year_min=&price_max=... での絞り込みと ?ordering= での並び替え
+    filter_backends = [VehicleFilterBackend, filters.OrderingFilter]
+    ordering_fields = ['id', 'segment', 'brand', 'user', 'release_year', 'price']
+
+    # 一括処理で1リクエストに含められる件数の上限
+    bulk_max_items = 1000
 
     # vehicleを作成するときにログインユーザーを割り当てるよう
     # overrideする
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
+    # 一覧のGETでは読み取り専用の高速なSerializerを使う
+    # (ブラウザブルAPIのPOSTフォームなどはmethodがGET以外になるので従来のSerializer)
+    def use_fast_serializer(self):
+        return (settings.API_FAST_READ_SERIALIZER and self.action == 'list'
+                and self.request.method in ('GET', 'HEAD'))
+
+    def paginate_queryset(self, queryset):
+        # ページネーションする場合は.values()の辞書のリストをページとして返す
+        # (ETag計算の集計クエリには影響しないよう、ここで変換する)
+        # カーソルは並び替えのフィールドの値から作るので、出力しないフィールド(user)も辞書に含める
+        if self.use_fast_serializer():
+            queryset = FastVehicleSerializer.values_queryset(queryset, extra=self.ordering_fields)
+        return super().paginate_queryset(queryset)
+
+    def get_serializer_class(self):
+        # 一括処理ではJSON配列を扱うSerializerを使う
+        if self.action in ('bulk', 'bulk_update', 'bulk_partial_update'):
+            return BulkVehicleSerializer
+        if self.use_fast_serializer():
+            return FastVehicleSerializer
+        return super().get_serializer_class()
+
+    def get_bulk_serializer(self, data, instance=None, partial=False):
+        return self.get_serializer(instance, data=data, many=True, partial=partial,
+                                   allow_empty=False, max_length=self.bulk_max_items)
+
+    # POST /api/vehicles/bulk/ JSON配列で一括作成(1トランザクション)
+    # バリデーションエラーは配列の位置ごとに返す
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        serializer = self.get_bulk_serializer(request.data)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            self.perform_create(serializer)
+            post_bulk_create.send(sender=Vehicle, instances=serializer.instance)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    # PUT/PATCH /api/vehicles/bulk/ idを含むJSON配列で一括更新(1トランザクション)
+    @bulk.mapping.put
+    def bulk_update(self, request, partial=False):
+        ids = set()
+        if isinstance(request.data, list):
+            for item in request.data:
+                try:
+                    ids.add(int(item['id']))
+                except (TypeError, ValueError, KeyError):
+                    # idの不正はSerializerで位置ごとのエラーにする
+                    pass
+        with transaction.atomic():
+            instances = self.get_queryset().in_bulk(ids)
+            serializer = self.get_bulk_serializer(request.data, instance=instances, partial=partial)
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+            post_bulk_update.send(sender=Vehicle, instances=serializer.instance)
+        return Response(serializer.data)
+
+    @bulk.mapping.patch
+    def bulk_partial_update(self, request):
+        return self.bulk_update(request, partial=True)
+
+    # GET /api/vehicles/export/?type=ndjson|csv 全件をストリーミングで出力する
+    # (一覧と同じ絞り込みのクエリパラメータが使える)
+    # ?format=はDRFのレンダラー選択で使われるので?type=で形式を指定する
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        export_type = request.query_params.get('type', 'ndjson')
+        exporters = {
+            'ndjson': (iter_ndjson, 'application/x-ndjson'),
+            'csv': (iter_csv, 'text/csv'),
+        }
+        if export_type not in exporters:
+            return Response({'type': ['Select one of: %s.' % ', '.join(exporters)]},
+                            status=status.HTTP_400_BAD_REQUEST)
+        exporter, content_type = exporters[export_type]
+        queryset = self.filter_queryset(Vehicle.objects.all())
+        response = StreamingHttpResponse(exporter(queryset), content_type='%s; charset=utf-8' % content_type)
+        response['Content-Disposition'] = 'attachment; filename="vehicles.%s"' % export_type
+        return response
+
+    # GET /api/vehicles/stats/ Segment/Brandごとの台数・平均/最小/最大価格・発売年ごとの台数
+    # Vehicleを集計せず、更新時に差分を反映している集計テーブル(api.summary)から返す
+    # ?group_by=segment|brand で一方だけ取得できる
+    @action(detail=False, methods=['get'])
+    def stats(self, request):
+        group_by = request.query_params.get('group_by')
+        sections = {'segment': 'segments', 'brand': 'brands'}
+        if group_by is not None and group_by not in sections:
+            return Response({'group_by': ['Select one of: %s.' % ', '.join(sections)]},
+                            status=status.HTTP_400_BAD_REQUEST)
+        stats = get_stats()
+        if group_by is not None:
+            stats = {sections[group_by]: stats[sections[group_by]]}
+        return Response(stats)
+
+    # DELETE /api/vehicles/bulk/ idのJSON配列で一括削除(1トランザクション)
+    @bulk.mapping.delete
+    def bulk_destroy(self, request):
+        if not isinstance(request.data, list) or not request.data:
+            return Response({'non_field_errors': ['Expected a non-empty list of ids.']},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(request.data) > self.bulk_max_items:
+            return Response({'non_field_errors': ['Ensure this field has no more than %d elements.'
+                                                  % self.bulk_max_items]},
+                            status=status.HTTP_400_BAD_REQUEST)
+        with transaction.atomic():
+            queryset = self.get_queryset()
+            ids = []
+            errors = []
+            for pk in request.data:
+                try:
+                    ids.append(int(pk))
+                    errors.append({})
+                except (TypeError, ValueError):
+                    ids.append(None)
+                    errors.append({'id': ['A valid integer is required.']})
+            existing = set(queryset.filter(pk__in=[pk for pk in ids if pk is not None]).values_list('pk', flat=True))
+            for position, pk in enumerate(ids):
+                if pk is not None and pk not in existing:
+                    errors[position] = {'id': ['Invalid pk "%s" - object does not exist.' % pk]}
+            if any(errors):
+                return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+            # 集計テーブル(api.summary)は削除したVehicleのグループごとに1回だけ集計し直す
+            with batch_delete():
+                Vehicle.objects.filter(pk__in=existing).delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+# 画面の初期表示に必要なprofile, segments, brands, vehiclesを1回のリクエストでまとめて返すView
+# ?sections=segments,brands のように一部だけ取得することもできる
+# 各セクションはそれぞれキャッシュから返す(更新時はsignalで無効化)
+class BootstrapView(views.APIView):
+    sections = ('profile', 'segments', 'brands', 'vehicles')
+
+    def get(self, request):
+        requested = request.query_params.get('sections')
+        names = requested.split(',') if requested else self.sections
+        unknown = [name for name in names if name not in self.sections]
+        if unknown:
+            return Response({'sections': ['Unknown sections: %s.' % ', '.join(unknown)]},
+                            status=status.HTTP_400_BAD_REQUEST)
+        return Response({name: getattr(self, 'get_%s' % name)() for name in names})
+
+    def get_profile(self):
+        # 認証時に取得済みのユーザーなのでクエリは発生しない
+        return UserSerializer(self.request.user).data
+
+    def get_segments(self):
+        return get_or_build(Segment, 'list', lambda: SegmentSerializer(Segment.objects.all(), many=True).data)
+
+    def get_brands(self):
+        return get_or_build(Brand, 'list', lambda: BrandSerializer(Brand.objects.all(), many=True).data)
+
+    def get_vehicles(self):
+        # segment_name/brand_nameを含むので、Segment/Brandの更新でも無効化する
+        return get_or_build(Vehicle, 'list', lambda: FastVehicleSerializer(VehicleViewSet.queryset.all(), many=True).data,
+                            depends=VehicleViewSet.related_models)
+
+
+# 複数のCRUDのリクエスト(method, path, body)をまとめて受け取り、順番に実行した結果を返すView
+# 認証は1回のみで、サブリクエストはプロセス内で各Viewに直接渡す
+# "atomic": trueの場合は全体を1トランザクションで実行し、失敗したサブリクエストがあればそこで中断してロールバックする
+class BatchView(views.APIView):
+    # 1回のバッチに含められるサブリクエストの上限
+    max_requests = 100
+
+    def post(self, request):
+        if not isinstance(request.data, dict) or not isinstance(request.data.get('requests'), list):
+            return Response({'requests': ['Expected a list of requests.']}, status=status.HTTP_400_BAD_REQUEST)
+        subrequests = request.data['requests']
+        if len(subrequests) > self.max_requests:
+            return Response({'requests': ['Ensure this field has no more than %d elements.' % self.max_requests]},
+                            status=status.HTTP_400_BAD_REQUEST)
+        atomic = bool(request.data.get('atomic', False))
+
+        if not atomic:
+            return Response({'committed': True, 'results': [self.run(request, item) for item in subrequests]})
+
+        results = []
+        with transaction.atomic():
+            for item in subrequests:
+                results.append(self.run(request, item))
+                if results[-1]['status'] >= 400:
+                    transaction.set_rollback(True)
+                    break
+        committed = results == [] or results[-1]['status'] < 400
+        return Response({'committed': committed, 'results': results})
+
+    def run(self, request, item):
+        if not isinstance(item, dict):
+            return {'status': status.HTTP_400_BAD_REQUEST, 'body': {'detail': 'Expected an object.'}}
+        try:
+            code, body = dispatch(request, item.get('method', 'GET'), item.get('path'), item.get('body'),
+                                  excluded_views=('batch', 'vehicle-export'))
+        except SubRequestError as e:
+            return {'status': status.HTTP_400_BAD_REQUEST, 'body': {'detail': str(e)}}
+        return {'status': code, 'body': body}
+
+
+# 差分同期用に、カーソル(?since=)より後のSegment/Brand/Vehicleの作成・更新・削除を返すView
+# レスポンスのcursorを次回の?since=に使う。has_moreがtrueの場合は続けて取得する
+# 保持期間を過ぎたカーソルの場合は410を返すので、クライアントは全件を取得し直す
+# カーソルは変更履歴の自動採番のidなので、SQLite専用(api.changes.get_changesを参照)
+class ChangesView(views.APIView):
+    default_limit = 500
+    max_limit = 5000
+
+    def get(self, request):
+        try:
+            since = int(request.query_params.get('since', 0))
+            limit = min(int(request.query_params.get('limit', self.default_limit)), self.max_limit)
+        except ValueError:
+            return Response({'detail': 'since and limit must be integers.'}, status=status.HTTP_400_BAD_REQUEST)
+        if since < 0 or limit < 1:
+            return Response({'detail': 'since and limit must be positive.'}, status=status.HTTP_400_BAD_REQUEST)
+        # idの範囲(64bit)を超えるカーソルはDBに渡せない(SQLiteではOverflowErrorになる)
+        if since >= 2 ** 63:
+            return Response({'detail': 'since is out of range.'}, status=status.HTTP_400_BAD_REQUEST)
+        changes = get_changes(since, limit)
+        if changes is None:
+            return Response({'detail': 'The cursor has expired. Fetch everything again.'}, status=status.HTTP_410_GONE)
+        return Response(changes)
+
+
+# /metricsを読めるか
+# リクエストのパス・レイテンシ・件数が分かるので、デフォルトでは公開しない
+# API_METRICS_ALLOWED_IPSのアドレス(Prometheusのスクレイプ元)とスタッフユーザーだけが読める
+# (API_METRICS_PUBLIC=1であれば誰でも読める。公開しないネットワークで使う場合)
+class MetricsPermission(permissions.BasePermission):
+    def has_permission(self, request, view):
+        if getattr(settings, 'API_METRICS_PUBLIC', False):
+            return True
+        if request.META.get('REMOTE_ADDR') in getattr(settings, 'API_METRICS_ALLOWED_IPS', ()):
+            return True
+        return bool(request.user and request.user.is_staff)
+
+
+# GET /metrics Prometheusのテキスト形式でメトリクスを返す
+class MetricsView(views.APIView):
+    permission_classes = (MetricsPermission,)
+
+    def get(self, request):
+        return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,25 @@
+"""rest_api URL Configuration for ASGI
+
+Read endpoints (GET/HEAD) are served by async views (api.async_views), as
+are user creation and token login, which hash passwords and so run in the
+thread pool instead of the single shared sync thread. Everything else falls
+through to the regular URLconf. URL names match the regular routes so
+metrics are labelled the same way. Detail routes only match numeric ids so
+list actions such as /api/vehicles/export/ fall through. Selected by
+api.middleware.AsyncReadMiddleware.
+"""
+from django.urls import path, re_path, include
+from api import async_views
+
+urlpatterns = [
+    re_path(r'^api/segments/$', async_views.segment_list, name='segment-list'),
+    re_path(r'^api/segments/(?P<pk>[0-9]+)/$', async_views.segment_detail, name='segment-detail'),
+    re_path(r'^api/brands/$', async_views.brand_list, name='brand-list'),
+    re_path(r'^api/brands/(?P<pk>[0-9]+)/$', async_views.brand_detail, name='brand-detail'),
+    re_path(r'^api/vehicles/$', async_views.vehicle_list, name='vehicle-list'),
+    re_path(r'^api/vehicles/(?P<pk>[0-9]+)/$', async_views.vehicle_detail, name='vehicle-detail'),
+    path('api/profile/', async_views.profile, name='profile'),
+    path('api/create/', async_views.create_user, name='create'),
+    path('api/auth/', async_views.obtain_token, name='auth'),
+    path('', include('rest_api.urls')),
+]
@@ -0,0 +1,33 @@
+import logging
+import os
+from django.db import connections
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+# テスト用のランナー
+# - パスワードのハッシュ計算に時間をかけないよう、高速なハッシャーを使う
+# - SQLiteのWALのファイル(-wal/-shm)がテスト用のDBと一緒に削除されるようにする
+# - リクエストごとの計測値のログ(api.stats)をテストの出力に出さない
+class ApiTestRunner(DiscoverRunner):
+    hashers = override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.hashers.enable()
+        logging.getLogger('api').setLevel(logging.WARNING)
+
+    def teardown_test_environment(self, **kwargs):
+        self.hashers.disable()
+        super().teardown_test_environment(**kwargs)
+
+    def teardown_databases(self, old_config, **kwargs):
+        names = [
+            connection.settings_dict['NAME'] for connection in connections.all()
+            if connection.vendor == 'sqlite' and not connection.is_in_memory_db()
+        ]
+        super().teardown_databases(old_config, **kwargs)
+        for name in names:
+            for suffix in ('-wal', '-shm'):
+                if os.path.exists('%s%s' % (name, suffix)):
+                    os.remove('%s%s' % (name, suffix))
@@ -10,6 +10,9 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.1/ref/settings/
 """
 
+import os
+import tempfile
+from importlib.util import find_spec
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -44,6 +47,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.StatsMiddleware',
+    'api.middleware.MetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -52,6 +57,9 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.middleware.ReplicaMiddleware',
+    'api.middleware.AsyncReadMiddleware',
+    'api.middleware.ProfilingMiddleware',
 ]
 
 CORS_ORIGIN_WHITELIST = [
@@ -86,22 +94,162 @@ REST_FRAMEWORK = {
     ],
     # 認証方法の設定
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        # Tokenを使用した認証を設定
-        'rest_framework.authentication.TokenAuthentication',
-    ]
+        # Tokenを使用した認証を設定(認証結果を短時間キャッシュする)
+        'api.authentication.CachedTokenAuthentication',
+    ],
+    # レスポンスの形式(orjsonによるJSON、msgpackがインストールされていればMessagePackも)
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.FastJSONRenderer',
+        *(['api.renderers.MessagePackRenderer'] if find_spec('msgpack') else []),
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    # リクエストボディの形式
+    'DEFAULT_PARSER_CLASSES': [
+        'api.parsers.FastJSONParser',
+        *(['api.parsers.MessagePackParser'] if find_spec('msgpack') else []),
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+    # ページネーションの設定(?cursor= または ?page_size= を指定した場合のみ有効)
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.KeysetCursorPagination',
+    'PAGE_SIZE': 100,
 }
 
 
 # Database
 # https://docs.djangoproject.com/en/3.1/ref/settings/#databases
 
-DATABASES = {
+# 環境変数でSQLite(デフォルト)とPostgreSQLを切り替える
+#   DJANGO_DB_ENGINE=postgresql DJANGO_DB_NAME=... DJANGO_DB_USER=... DJANGO_DB_HOST=...
+DB_ENGINE = os.environ.get('DJANGO_DB_ENGINE', 'sqlite3')
+# 接続を使い回す秒数(0でリクエストごとに接続し直す、Noneは無制限、空ならデフォルトの60秒)
+DB_CONN_MAX_AGE = os.environ.get('DJANGO_DB_CONN_MAX_AGE', '').strip()
+DB_CONN_MAX_AGE = None if DB_CONN_MAX_AGE.lower() == 'none' else int(DB_CONN_MAX_AGE or 60)
+# 使い回す接続をリクエストの開始時に確認し、切れていれば接続し直す
+DB_HEALTH_CHECKS = os.environ.get('DJANGO_DB_HEALTH_CHECKS', '1') == '1'
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DJANGO_DB_NAME', 'rest_api'),
+            'USER': os.environ.get('DJANGO_DB_USER', ''),
+            'PASSWORD': os.environ.get('DJANGO_DB_PASSWORD', ''),
+            'HOST': os.environ.get('DJANGO_DB_HOST', ''),
+            'PORT': os.environ.get('DJANGO_DB_PORT', ''),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            # PgBouncerなどのコネクションプーラー(トランザクション単位)経由で接続する場合は
+            # サーバーサイドカーソルが使えないので無効にする
+            'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('DJANGO_DB_POOLER', '0') == '1',
+            'OPTIONS': {'connect_timeout': int(os.environ.get('DJANGO_DB_CONNECT_TIMEOUT', 5))},
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DJANGO_DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            # ロックの解放を待つ秒数("database is locked"を避ける)
+            'OPTIONS': {'timeout': int(os.environ.get('DJANGO_DB_BUSY_TIMEOUT', 20))},
+            # WALや複数スレッドからの書き込みを試せるよう、テストでもファイルのDBを使う
+            # (リポジトリの中に作らないよう一時ディレクトリに置く)
+            'TEST': {'NAME': os.environ.get('DJANGO_TEST_DB_NAME',
+                                            Path(tempfile.gettempdir()) / 'rest_api_test_db.sqlite3')},
+        }
+    }
+
+# 読み取り用のレプリカ(カンマ区切り、SQLiteではファイル名、PostgreSQLではホスト名)
+#   DJANGO_DB_REPLICAS=replica1.sqlite3,replica2.sqlite3
+# レプリカへの複製はDBの外で行う(テストではプライマリのミラーとして扱う)
+# 認証(auth, authtoken)は発行直後のトークンが使えるよう常にプライマリから読む(api.routers)
+DATABASE_REPLICAS = []
+for number, replica_name in enumerate(filter(None, os.environ.get('DJANGO_DB_REPLICAS', '').split(',')), 1):
+    replica = dict(DATABASES['default'], TEST={'MIRROR': 'default'})
+    replica['HOST' if DB_ENGINE == 'postgresql' else 'NAME'] = replica_name.strip()
+    DATABASES['replica%d' % number] = replica
+    DATABASE_REPLICAS.append('replica%d' % number)
+
+DATABASE_ROUTERS = ['api.routers.ReplicaRouter']
+# 書き込みの後に同じクライアントの読み取りをプライマリに向ける秒数(レプリカの遅延より長くする)
+DATABASE_REPLICA_STICKY_SECONDS = int(os.environ.get('DJANGO_DB_REPLICA_STICKY_SECONDS', 5))
+
+# SQLiteの接続ごとに設定するPRAGMA(api/db.py)
+# WALで読み取りと書き込みが互いにブロックしないようにし、WALではsynchronous=NORMALでも壊れない
+SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'cache_size': -20000,
+    'temp_store': 'memory',
+    'mmap_size': 128 * 1024 * 1024,
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.1/topics/cache/
+# デフォルトはプロセス内のローカルメモリ。複数のgunicornワーカーでキャッシュを共有する場合は
+# DJANGO_CACHE_BACKEND=django.core.cache.backends.filebased.FileBasedCache
+# DJANGO_CACHE_LOCATION=/var/tmp/django_vehicle_api_cache
+# のように共有できるバックエンドを指定する
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': os.environ.get('DJANGO_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('DJANGO_CACHE_LOCATION', 'django-vehicle-api'),
     }
 }
 
+# Segment/Brandのレスポンスキャッシュの有効期限(秒)
+API_CACHE_TIMEOUT = int(os.environ.get('API_CACHE_TIMEOUT', 60 * 60))
+
+# Vehicle一覧のGETで、.values()から直接JSONの形を作る高速な読み取り用Serializerを使うか
+API_FAST_READ_SERIALIZER = os.environ.get('API_FAST_READ_SERIALIZER', '1') == '1'
+
+# 差分同期(/api/changes/)の変更履歴の保持期間(日)。prune_changesコマンドで削除する
+# /api/changes/のカーソルは変更履歴のidで、コミットの順にidが増えるSQLiteでのみ正しく動く
+# (DJANGO_DB_ENGINE=postgresqlでは同時の書き込みで変更を取りこぼすことがあるので使わない)
+CHANGE_LOG_RETENTION_DAYS = int(os.environ.get('CHANGE_LOG_RETENTION_DAYS', 30))
+
+# トークン認証のキャッシュ(CACHES['default']に保存)の有効期間(秒、0でキャッシュしない)
+API_TOKEN_CACHE_TTL = int(os.environ.get('API_TOKEN_CACHE_TTL', 60))
+
+# トークンの有効期間(秒、0で期限なし)、使われるたびに延長するか、延長する間隔(秒)
+# 既存のトークンが一斉に失効しないよう、有効期限はオプトイン(例: 14日なら1209600)
+API_TOKEN_TTL = int(os.environ.get('API_TOKEN_TTL', 0))
+API_TOKEN_SLIDING = os.environ.get('API_TOKEN_SLIDING', '0') == '1'
+API_TOKEN_REFRESH_INTERVAL = int(os.environ.get('API_TOKEN_REFRESH_INTERVAL', 60 * 60))
+
+# ASGIでsegments/brands/vehicles/profileの読み取りを非同期のViewで処理するか
+API_ASYNC_READS = os.environ.get('API_ASYNC_READS', '1') == '1'
+
+# リクエストごとの計測(api/stats.py)をするか、Server-Timingヘッダーを返すか
+API_STATS = os.environ.get('API_STATS', '1') == '1'
+API_SERVER_TIMING = os.environ.get('API_SERVER_TIMING', '1') == '1'
+# 実行時間がこのミリ秒を超えたSQLをログに出す(0で出さない)と、その件数
+API_SLOW_SQL_MS = int(os.environ.get('API_SLOW_SQL_MS', 0))
+API_SLOW_SQL_LOG_COUNT = int(os.environ.get('API_SLOW_SQL_LOG_COUNT', 5))
+
+# ルートごとのメトリクス(GET /metrics)を記録するか
+API_METRICS = os.environ.get('API_METRICS', '1') == '1'
+# gunicornなどで複数のワーカープロセスを使う場合の集計用ディレクトリ(全プロセスで同じ場所を指定する)
+API_METRICS_DIR = os.environ.get('API_METRICS_DIR') or None
+API_METRICS_FLUSH_SECONDS = float(os.environ.get('API_METRICS_FLUSH_SECONDS', 1))
+# GET /metricsを誰でも読めるようにするか(デフォルトではスタッフユーザーと下のアドレスからのみ)
+API_METRICS_PUBLIC = os.environ.get('API_METRICS_PUBLIC', '0') == '1'
+# GET /metricsを認証なしで読めるアドレス(カンマ区切り、Prometheusのスクレイプ元)
+#   API_METRICS_ALLOWED_IPS=10.0.0.5,127.0.0.1
+API_METRICS_ALLOWED_IPS = [ip.strip() for ip in os.environ.get('API_METRICS_ALLOWED_IPS', '').split(',') if ip.strip()]
+
+# スタッフユーザーが?profile=cprofile|samplingで1リクエストをプロファイルできるようにするか
+API_PROFILING = os.environ.get('API_PROFILING', '1') == '1'
+# プロファイルを保存するディレクトリ(未設定ならレスポンスとして返す)と、サンプリングの間隔(秒)
+API_PROFILE_DIR = os.environ.get('API_PROFILE_DIR') or None
+API_PROFILE_SAMPLE_INTERVAL = float(os.environ.get('API_PROFILE_SAMPLE_INTERVAL', 0.001))
+
+# Server-Sent Events(/api/events/)の接続ごとのキューの上限と、ハートビートの間隔(秒)
+SSE_QUEUE_SIZE = int(os.environ.get('SSE_QUEUE_SIZE', 100))
+SSE_HEARTBEAT_SECONDS = int(os.environ.get('SSE_HEARTBEAT_SECONDS', 15))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
@@ -121,6 +269,36 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# パスワードのハッシュ(先頭が新規作成時に使われ、残りは既存のハッシュの検証用)
+PASSWORD_HASHERS = [
+    'api.hashers.TunablePBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+]
+# PBKDF2の反復回数(0ならDjangoのデフォルト)と、ハッシュ計算を実行するスレッド数(0ならリクエストのスレッドで計算)
+PASSWORD_HASH_ITERATIONS = int(os.environ.get('PASSWORD_HASH_ITERATIONS', 0))
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 0))
+
+# テストでは高速なパスワードのハッシャーを使い、WALのファイルも削除する
+TEST_RUNNER = 'rest_api.runner.ApiTestRunner'
+
+
+# ログ(api.statsのリクエストごとの計測値などを標準エラー出力に出す)
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'api': {
+            'handlers': ['console'],
+            'level': os.environ.get('API_LOG_LEVEL', 'INFO'),
+        },
+    },
+}
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/3.1/topics/i18n/